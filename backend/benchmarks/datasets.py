@@ -0,0 +1,124 @@
+"""
+Generate synthetic upload files for benchmarks.
+
+    cd backend
+    python -m benchmarks.datasets --rows 1000000 --shape mixed --format csv --out /tmp/mixed-1m.csv
+    python -m benchmarks.datasets --rows 100000 --shape wide --format xlsx --out /tmp/wide-100k.xlsx
+
+Shapes:
+  mixed     employee-style table: ids, names, categories, numbers, dates, booleans and
+            text, with a few blanks (12 columns)
+  wide      100 columns, mostly numeric with some categorical and text columns
+  currency  amounts written as text ("$1,234.50", "(90.00)", "n/a") next to plain numbers,
+            the columns the compaction step parses back into numbers
+
+Data is seeded, so the same arguments always produce the same file. XLSX files are
+limited to Excel's 1,048,575 data rows.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+SHAPES = ("mixed", "wide", "currency")
+XLSX_MAX_ROWS = 1_048_575
+DEPARTMENTS = np.array(["Sales", "Engineering", "Finance", "Legal", "Support", "Marketing", "Operations", "HR"])
+REGIONS = np.array(["North", "South", "East", "West"])
+
+
+def _mixed(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    ids = np.arange(rows)
+    salary = rng.normal(85000, 20000, rows).round(-2)
+    salary[rng.random(rows) < 0.01] = np.nan
+    return pd.DataFrame({
+        "Employee ID": np.char.add("E", ids.astype(str)),
+        "Full Name": np.char.add("Employee ", (ids % 50_000).astype(str)),
+        "Department": DEPARTMENTS[rng.integers(0, len(DEPARTMENTS), rows)],
+        "Region": REGIONS[rng.integers(0, len(REGIONS), rows)],
+        "Annual Salary": salary,
+        "Bonus": rng.exponential(5000, rows).round(2),
+        "Rating": rng.integers(1, 6, rows),
+        "Age": rng.integers(21, 66, rows),
+        "Start Date": pd.Timestamp("2010-01-01") + pd.to_timedelta(rng.integers(0, 5000, rows), unit="D"),
+        "Remote": rng.random(rows) < 0.3,
+        "Score": rng.random(rows).round(4),
+        "Notes": np.where(rng.random(rows) < 0.9, "", np.char.add("note ", (ids % 997).astype(str))),
+    })
+
+
+def _wide(rows: int, rng: np.random.Generator, columns: int = 100) -> pd.DataFrame:
+    data = {}
+    for j in range(columns):
+        if j % 10 == 8:
+            data[f"category_{j}"] = DEPARTMENTS[rng.integers(0, len(DEPARTMENTS), rows)]
+        elif j % 10 == 9:
+            data[f"label_{j}"] = np.char.add("item ", rng.integers(0, 2_000, rows).astype(str))
+        elif j % 2:
+            data[f"metric_{j}"] = rng.normal(100, 15, rows).round(3)
+        else:
+            data[f"count_{j}"] = rng.integers(0, 10_000, rows)
+    return pd.DataFrame(data)
+
+
+def _currency(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    amounts = rng.normal(2500, 1500, rows).round(2)
+    text = pd.Series(amounts).map(lambda v: f"(${-v:,.2f})" if v < 0 else f"${v:,.2f}")
+    text[rng.random(rows) < 0.005] = "n/a"
+    costs = pd.Series(rng.exponential(800, rows).round(2)).map("{:,.2f}".format)
+    return pd.DataFrame({
+        "Invoice": np.char.add("INV-", np.arange(rows).astype(str)),
+        "Customer": np.char.add("Customer ", rng.integers(0, 5_000, rows).astype(str)),
+        "Region": REGIONS[rng.integers(0, len(REGIONS), rows)],
+        "Amount": text,
+        "Cost": costs,
+        "Units": rng.integers(1, 500, rows),
+        "Discount": pd.Series(rng.integers(0, 40, rows)).map("{}%".format),
+        "Date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 1000, rows), unit="D"),
+    })
+
+
+def generate_frame(rows: int, shape: str = "mixed", seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    if shape == "mixed":
+        return _mixed(rows, rng)
+    if shape == "wide":
+        return _wide(rows, rng)
+    if shape == "currency":
+        return _currency(rows, rng)
+    raise ValueError(f"Unknown shape {shape!r}; expected one of {', '.join(SHAPES)}")
+
+
+def write_dataset(path: str, rows: int, shape: str = "mixed", seed: int = 0) -> int:
+    """Write a generated table as CSV or XLSX (by extension); returns the file size in bytes"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xlsx" and rows > XLSX_MAX_ROWS:
+        raise ValueError(f"XLSX files hold at most {XLSX_MAX_ROWS:,} data rows")
+    df = generate_frame(rows, shape, seed)
+    if ext == ".csv":
+        df.to_csv(path, index=False)
+    elif ext == ".xlsx":
+        df.to_excel(path, index=False, engine="openpyxl")
+    else:
+        raise ValueError("Use a .csv or .xlsx path")
+    return os.path.getsize(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--shape", choices=SHAPES, default="mixed")
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="output path (default: <shape>-<rows>.<format> in the current directory)")
+    args = parser.parse_args()
+
+    path = args.out or f"{args.shape}-{args.rows}.{args.format}"
+    started = time.perf_counter()
+    size = write_dataset(path, args.rows, args.shape, args.seed)
+    print(f"wrote {path}: {args.rows:,} rows, {size / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare Excel reading engines on generated workbooks.
+
+    cd backend
+    python -m benchmarks.excel_engines                 # 10k, 100k and 1M cells
+    python -m benchmarks.excel_engines --cells 100000 --repeat 5
+
+Engines: "pandas" (pd.read_excel, the previous upload path), "openpyxl"
+(read-only streaming, see services/excel.py) and "calamine" when
+python-calamine is installed.
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import pandas as pd
+from openpyxl import Workbook
+
+from services.excel import CalamineWorkbook, list_sheets, read_sheet
+
+COLUMNS = 10
+
+
+def generate_workbook(path: str, cells: int, sheets: int = 3) -> None:
+    """Employee-style data: ids, names, departments, amounts and dates; extra sheets are small"""
+    rows = max(1, cells // COLUMNS)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    sheet.append(["ID", "Name", "Department", "Salary", "Bonus", "Start Date", "Rating", "Region", "Active", "Notes"])
+    departments = ["Sales", "Engineering", "Finance", "Legal", "Support"]
+    start = datetime.datetime(2015, 1, 1)
+    for i in range(rows - 1):
+        sheet.append([
+            i,
+            f"Employee {i}",
+            departments[i % len(departments)],
+            40000 + (i * 37) % 90000,
+            round((i * 13) % 1000 / 7, 2),
+            start + datetime.timedelta(days=i % 3000),
+            (i % 5) + 1,
+            ["North", "South", "East", "West"][i % 4],
+            i % 3 != 0,
+            None if i % 4 else "review",
+        ])
+    for n in range(1, sheets):
+        extra = workbook.create_sheet(f"Sheet{n + 1}")
+        extra.append(["Key", "Value"])
+        for i in range(100):
+            extra.append([i, i * n])
+    workbook.save(path)
+
+
+def time_call(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cells", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per engine; the best time is reported")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="where generated workbooks are written")
+    args = parser.parse_args()
+
+    engines = ["pandas", "openpyxl"] + (["calamine"] if CalamineWorkbook is not None else [])
+    print(f"{'cells':>10} {'engine':>9} {'parse s':>9} {'cells/s':>12} {'speedup':>8}")
+    for cells in args.cells:
+        path = os.path.join(args.dir, f"insightxl-bench-{cells}.xlsx")
+        if not os.path.exists(path):
+            generate_workbook(path, cells)
+
+        # Sheet names: opening the workbook (pd.ExcelFile) versus reading only the workbook index
+        def open_workbook() -> list[str]:
+            with pd.ExcelFile(path) as workbook:
+                return workbook.sheet_names
+
+        open_s = time_call(open_workbook, args.repeat)
+        index_s = time_call(lambda: list_sheets(path, ".xlsx"), args.repeat)
+        print(f"{cells:>10,} {'sheets':>9} pd.ExcelFile {open_s * 1000:.1f} ms, list_sheets {index_s * 1000:.1f} ms")
+
+        baseline = None
+        shape = None
+        for engine in engines:
+            parse_s = time_call(lambda: read_sheet(path, ".xlsx", 0, engine=engine), args.repeat)
+            frame = read_sheet(path, ".xlsx", 0, engine=engine)
+            if shape is None:
+                shape = frame.shape
+            elif frame.shape != shape:
+                print(f"  warning: {engine} returned shape {frame.shape}, expected {shape}")
+            baseline = baseline or parse_s
+            print(f"{cells:>10,} {engine:>9} {parse_s:>9.3f} {cells / parse_s:>12,.0f} {baseline / parse_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
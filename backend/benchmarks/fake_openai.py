@@ -0,0 +1,160 @@
+"""
+A local stand-in for the OpenAI chat completions endpoint, so load runs go
+through the real client, connection pool and retry path without a key or cost.
+
+    cd backend
+    python -m benchmarks.fake_openai --port 54322 --latency-ms 800 --rate-429 0.05
+
+and start the API against it:
+
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:54322/v1 python main.py
+
+Each completion waits --latency-ms (plus up to --jitter-ms) before answering;
+a --rate-429 fraction of requests is refused with 429 and a Retry-After of
+--retry-after seconds, like an exhausted rate limit. JSON-mode requests get a
+plan that tells the server to fall back to a full analysis; streams are sent
+in small chunks with usage in the last one. GET /stats counts the requests.
+
+Prompt caching is modelled on OpenAI's: the longest prefix of whole messages
+seen in an earlier request, if at least 1024 tokens, is reported as
+`prompt_tokens_details.cached_tokens`, and --prefill-ms-per-1k adds time only
+for the uncached prompt tokens.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = """## Headcount and Salary Overview
+
+### Summary
+Salaries are concentrated in Engineering and Sales, which together account for most of the payroll.
+
+### Methodology
+Grouped the rows by department and compared totals and averages.
+
+### Findings
+
+| Department | Employees | Average Salary |
+|---|---|---|
+| Engineering | 412 | 96,300 |
+| Sales | 388 | 81,950 |
+| Finance | 140 | 88,400 |
+
+### Conclusions
+Engineering pay is the main cost driver; review Sales bonuses before the next cycle."""
+# What JSON-mode calls (query planning, chart specs) get back
+JSON_REPLY = '{"op": "none"}'
+CHUNK_CHARS = 24
+# Shortest prompt prefix the provider caches, and how many prefixes are remembered
+CACHE_MIN_TOKENS = 1024
+CACHE_PREFIXES = 10_000
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def create_app(
+    latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_429: float = 0.0, retry_after: float = 0.1,
+    seed: int | None = None, prefill_ms_per_1k: float = 0.0,
+) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(seed)
+    counts: Counter[str] = Counter()
+    prefixes: OrderedDict[str, None] = OrderedDict()
+
+    def cached_tokens(messages: list[dict]) -> int:
+        """Tokens of the longest message prefix sent before; every prefix of this prompt is remembered"""
+        digest, tokens, cached = hashlib.sha256(), 0, 0
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode())
+            tokens += _tokens(str(message.get("content", "")))
+            key = digest.hexdigest()
+            if key in prefixes:
+                prefixes.move_to_end(key)
+                cached = tokens
+            else:
+                prefixes[key] = None
+        while len(prefixes) > CACHE_PREFIXES:
+            prefixes.popitem(last=False)
+        return cached if cached >= CACHE_MIN_TOKENS else 0
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body: dict[str, Any] = await request.json()
+        if rng.random() < rate_429:
+            counts["429"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": f"{retry_after:g}", "x-ratelimit-remaining-requests": "0"},
+            )
+        counts["stream" if body.get("stream") else "complete"] += 1
+        messages = body.get("messages", [])
+        prompt_tokens = _tokens("".join(str(m.get("content", "")) for m in messages))
+        cached = cached_tokens(messages)
+        counts["cached_tokens"] += cached
+        prefill = prefill_ms_per_1k * (prompt_tokens - cached) / 1000
+        await asyncio.sleep((latency_ms + rng.random() * jitter_ms + prefill) / 1000)
+
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = JSON_REPLY if json_mode else REPLY
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": _tokens(content),
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model", "fake")}
+
+        if not body.get("stream"):
+            return {
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            }
+
+        async def events():
+            chunk = {**base, "object": "chat.completion.chunk"}
+            for start in range(0, len(content), CHUNK_CHARS):
+                delta = {"content": content[start:start + CHUNK_CHARS]}
+                yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': delta}]})}\n\n"
+                await asyncio.sleep(0)
+            yield f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return dict(counts)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=54322)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="time before each completion starts")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random extra latency, up to this much")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests refused with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0, help="extra latency per 1000 uncached prompt tokens")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, args.seed, args.prefill_ms_per_1k)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
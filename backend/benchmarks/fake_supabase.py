@@ -0,0 +1,147 @@
+"""
+A local stand-in for the Supabase endpoints the auth router uses: GoTrue sign-up,
+password sign-in, get user, logout and JWKS, and PostgREST reads of
+user_profiles. Tokens are HS256 JWTs signed with --jwt-secret.
+
+    cd backend
+    python -m benchmarks.fake_supabase --port 54321 --latency-ms 40
+
+and start the API against it:
+
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=anon SUPABASE_JWT_SECRET=fake-jwt-secret-for-local-testing-only python main.py
+
+Leave SUPABASE_JWT_SECRET unset to exercise the path where tokens are checked
+remotely. Every stub request sleeps --latency-ms first, as a stand-in for the
+network round trip; GET /stats counts the requests by endpoint.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any
+
+import jwt
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+TOKEN_SECONDS = 3600
+
+
+def create_app(jwt_secret: str = "fake-jwt-secret-for-local-testing-only", latency_ms: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Fake Supabase")
+    users: dict[str, dict[str, Any]] = {}  # email -> user with "password"
+    profiles: dict[str, dict[str, Any]] = {}  # user id -> user_profiles row
+    revoked: set[str] = set()
+    counts: Counter[str] = Counter()
+
+    @app.exception_handler(HTTPException)
+    async def error_body(request: Request, exc: HTTPException):
+        # GoTrue errors are {"code": ..., "msg": ...} at the top level
+        return JSONResponse(exc.detail, status_code=exc.status_code)
+
+    @app.middleware("http")
+    async def delay(request: Request, call_next):
+        counts[f"{request.method} {request.url.path}"] += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return await call_next(request)
+
+    def public(user: dict[str, Any]) -> dict[str, Any]:
+        return {k: v for k, v in user.items() if k != "password"}
+
+    def session(user: dict[str, Any]) -> dict[str, Any]:
+        now = int(time.time())
+        claims = {
+            "sub": user["id"], "aud": "authenticated", "role": "authenticated", "email": user["email"],
+            "user_metadata": user["user_metadata"], "iat": now, "exp": now + TOKEN_SECONDS,
+            "session_id": str(uuid.uuid4()),
+        }
+        return {
+            "access_token": jwt.encode(claims, jwt_secret, algorithm="HS256"),
+            "refresh_token": uuid.uuid4().hex,
+            "token_type": "bearer",
+            "expires_in": TOKEN_SECONDS,
+            "expires_at": now + TOKEN_SECONDS,
+            "user": public(user),
+        }
+
+    def bearer_user(authorization: str | None) -> dict[str, Any]:
+        token = (authorization or "").removeprefix("Bearer ").strip()
+        try:
+            claims = jwt.decode(token, jwt_secret, algorithms=["HS256"], audience="authenticated")
+        except jwt.PyJWTError as e:
+            raise HTTPException(status_code=401, detail={"code": 401, "msg": str(e)})
+        if token in revoked:
+            raise HTTPException(status_code=401, detail={"code": 401, "msg": "Session not found"})
+        for user in users.values():
+            if user["id"] == claims["sub"]:
+                return user
+        raise HTTPException(status_code=404, detail={"code": 404, "msg": "User not found"})
+
+    @app.post("/auth/v1/signup")
+    async def signup(body: dict[str, Any]):
+        if body["email"] in users:
+            raise HTTPException(status_code=422, detail={"code": 422, "msg": "User already registered"})
+        metadata = body.get("data") or {}
+        user = {
+            "id": str(uuid.uuid4()), "aud": "authenticated", "role": "authenticated", "email": body["email"],
+            "app_metadata": {"provider": "email"}, "user_metadata": metadata,
+            "created_at": datetime.now(timezone.utc).isoformat(), "password": body["password"],
+        }
+        users[body["email"]] = user
+        profiles[user["id"]] = {"id": user["id"], "name": metadata.get("name")}
+        return session(user)
+
+    @app.post("/auth/v1/token")
+    async def token(body: dict[str, Any], grant_type: str = "password"):
+        user = users.get(body.get("email", ""))
+        if grant_type != "password" or user is None or user["password"] != body.get("password"):
+            raise HTTPException(status_code=400, detail={"code": 400, "msg": "Invalid login credentials"})
+        return session(user)
+
+    @app.get("/auth/v1/user")
+    async def get_user(authorization: str | None = Header(None)):
+        return public(bearer_user(authorization))
+
+    @app.post("/auth/v1/logout")
+    async def logout(authorization: str | None = Header(None)):
+        bearer_user(authorization)
+        revoked.add((authorization or "").removeprefix("Bearer ").strip())
+        return Response(status_code=204)
+
+    @app.get("/auth/v1/.well-known/jwks.json")
+    async def jwks():
+        # HS256 projects publish no keys; the server needs SUPABASE_JWT_SECRET to check tokens locally
+        return {"keys": []}
+
+    @app.get("/rest/v1/user_profiles")
+    async def user_profiles(id: str = "", select: str = "*"):
+        rows = [row for row in profiles.values() if not id.startswith("eq.") or row["id"] == id[3:]]
+        if select != "*":
+            fields = select.split(",")
+            rows = [{k: row.get(k) for k in fields} for row in rows]
+        return rows
+
+    @app.get("/stats")
+    async def stats():
+        return dict(counts)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--jwt-secret", default="fake-jwt-secret-for-local-testing-only")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every request")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(create_app(args.jwt_secret, args.latency_ms), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
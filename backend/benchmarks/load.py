@@ -0,0 +1,224 @@
+"""
+End-to-end load test of /chat/upload and /chat/query.
+
+    cd backend
+    python -m benchmarks.load --spawn                                 # API + fake OpenAI on free ports
+    python -m benchmarks.load --spawn --users 50 --duration 60 --llm-latency-ms 800 --rate-429 0.05
+    python -m benchmarks.load --url http://127.0.0.1:8000             # a server you started yourself
+    python -m benchmarks.load --spawn --check                         # exit 1 on a regression against baseline.json
+
+With --spawn the API runs in a subprocess (`uvicorn main:app`, plus any
+settings in the environment) against benchmarks/fake_openai.py, so the real
+OpenAI client, connection pool and retries are exercised with the given model
+latency and 429 rate. Each of --users virtual users uploads its own generated
+file (benchmarks/datasets.py), then sends questions with the response cache off
+until --duration runs out. Reported per endpoint: throughput, p50/p95/p99
+latency and errors by status, plus the server's peak RSS when it was spawned.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any
+
+import httpx
+
+from benchmarks.datasets import SHAPES, write_dataset
+from benchmarks.report import add_baseline_arguments, finish, peak_rss_mb, percentiles
+
+SUITE = "load"
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = [
+    "What is the average Annual Salary?",
+    "Which departments have the highest average salary, and how does it compare by region?",
+    "Show me a bar chart of total bonus by department",
+    "Summarize the main trends in this data",
+    "Who are the top 10 employees by salary?",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode} during startup")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def spawn_servers(args: argparse.Namespace) -> tuple[str, list[subprocess.Popen]]:
+    """Start the fake OpenAI server and the API; returns the API URL and both processes (API last)"""
+    llm_port, api_port = _free_port(), _free_port()
+    llm = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(llm_port),
+         "--latency-ms", str(args.llm_latency_ms), "--jitter-ms", str(args.llm_jitter_ms),
+         "--rate-429", str(args.rate_429), "--seed", "0"],
+        cwd=BACKEND_DIR,
+    )
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "LLM_BACKEND": "openai",
+        # Retries and discarded model output are expected under load; keep the run's output readable
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+    }
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    processes = [llm, api]
+    try:
+        _wait_healthy(f"http://127.0.0.1:{llm_port}/stats", llm)
+        _wait_healthy(f"http://127.0.0.1:{api_port}/health", api)
+    except Exception:
+        stop_servers(processes)
+        raise
+    return f"http://127.0.0.1:{api_port}", processes
+
+
+def stop_servers(processes: list[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {}
+        self.statuses: dict[str, Counter[str]] = {}
+        self.elapsed: dict[str, float] = {}
+
+    def record(self, endpoint: str, started: float, status: str) -> None:
+        self.statuses.setdefault(endpoint, Counter())[status] += 1
+        if status == "200":
+            self.latencies.setdefault(endpoint, []).append(time.perf_counter() - started)
+
+    def results(self) -> dict[str, dict[str, Any]]:
+        results = {}
+        for endpoint, statuses in self.statuses.items():
+            samples = self.latencies.get(endpoint, [])
+            elapsed = self.elapsed.get(endpoint) or 1.0
+            results[endpoint] = {
+                "requests": sum(statuses.values()),
+                "rps": round(len(samples) / elapsed, 2),
+                **percentiles(samples),
+                "errors": {status: n for status, n in statuses.items() if status != "200"},
+            }
+        return results
+
+
+async def _send(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, **kwargs: Any) -> httpx.Response | None:
+    started = time.perf_counter()
+    try:
+        response = await client.post(endpoint, **kwargs)
+    except httpx.HTTPError as e:
+        recorder.record(endpoint, started, type(e).__name__)
+        return None
+    recorder.record(endpoint, started, str(response.status_code))
+    return response
+
+
+async def run_load(url: str, files: list[bytes], duration: float, recorder: Recorder) -> None:
+    limits = httpx.Limits(max_connections=len(files), max_keepalive_connections=len(files))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=httpx.Timeout(300.0)) as client:
+
+        async def upload(user: int) -> str | None:
+            response = await _send(
+                client, recorder, "/chat/upload",
+                files={"file": (f"bench-{user}.csv", files[user], "text/csv")},
+                data={"user_id": f"bench-user-{user}"},
+            )
+            return response.json()["file_id"] if response is not None and response.status_code == 200 else None
+
+        started = time.perf_counter()
+        file_ids = await asyncio.gather(*(upload(user) for user in range(len(files))))
+        recorder.elapsed["/chat/upload"] = time.perf_counter() - started
+
+        async def ask(user: int, file_id: str, deadline: float) -> None:
+            n = user
+            while time.perf_counter() < deadline:
+                await _send(
+                    client, recorder, "/chat/query",
+                    json={"message": QUESTIONS[n % len(QUESTIONS)], "file_id": file_id,
+                          "user_id": f"bench-user-{user}", "use_cache": False},
+                )
+                n += 1
+
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(ask(user, file_id, deadline) for user, file_id in enumerate(file_ids) if file_id))
+        recorder.elapsed["/chat/query"] = time.perf_counter() - started
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running API server")
+    target.add_argument("--spawn", action="store_true", help="start the API and a fake OpenAI server")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of queries after the uploads")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows per uploaded file")
+    parser.add_argument("--shape", choices=SHAPES, default="mixed")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="fake OpenAI latency (--spawn)")
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0, help="fake OpenAI extra random latency (--spawn)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of fake OpenAI calls refused with 429 (--spawn)")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    files = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for user in range(args.users):
+            path = os.path.join(tmp, f"bench-{user}.csv")
+            write_dataset(path, args.rows, args.shape, seed=user)
+            with open(path, "rb") as f:
+                files.append(f.read())
+
+    processes: list[subprocess.Popen] = []
+    url = args.url
+    if args.spawn:
+        url, processes = spawn_servers(args)
+    recorder = Recorder()
+    try:
+        asyncio.run(run_load(url, files, args.duration, recorder))
+        server_rss = peak_rss_mb(processes[-1].pid) if processes else None
+    finally:
+        stop_servers(processes)
+
+    results = recorder.results()
+    print(f"{args.users} users, {args.rows:,} rows per file, {args.duration:g}s of queries")
+    print(f"{'endpoint':>14} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  errors")
+    for endpoint, stats in results.items():
+        print(
+            f"{endpoint:>14} {stats['requests']:>9} {stats['rps']:>8.2f} {stats['p50_ms']:>9.1f} "
+            f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}  {stats['errors'] or '-'}"
+        )
+    if server_rss is not None:
+        results["server"] = {"peak_rss_mb": server_rss}
+        print(f"server peak RSS: {server_rss:.1f} MB")
+    return finish(SUITE, results, args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,129 @@
+"""
+Micro-benchmarks for the upload and query paths, run in-process.
+
+    cd backend
+    python -m benchmarks.micro                           # 1k and 100k rows, mixed shape
+    python -m benchmarks.micro --rows 1000 100000 1000000 --shape currency --repeat 7
+    python -m benchmarks.micro --check                   # exit 1 on a regression against baseline.json
+    python -m benchmarks.micro --save-baseline
+
+For each generated file (see benchmarks/datasets.py) this times the steps of
+/chat/upload (parse, compact, summary, fingerprint, profile), the context and
+prompt building behind answer_query_with_context, generate_chart_data with the
+rule-based chart spec, and JSON encoding of the upload response and the chart.
+The LLM is disabled, so no step waits on the network. Each step reports
+p50/p95/p99 over --repeat runs; peak RSS is the process high-water mark after
+each dataset size.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks.datasets import SHAPES, write_dataset
+from benchmarks.report import add_baseline_arguments, finish, peak_rss_mb, percentiles
+from services.cache import dataset_fingerprint
+from services.gateway import set_llm_backend
+from services.ingest import profile_frame, read_file
+from services.llm import _analysis_messages, generate_chart_data
+from services.optimize import compact_frame
+from services.profile import build_profile
+
+SUITE = "micro"
+QUERY = "Which departments have the highest average salary, and how does it compare by region?"
+CHART_QUERY = "Bar chart of total salary by department"
+
+
+def time_runs(fn: Callable[[], Any], repeat: int) -> tuple[Any, list[float]]:
+    """Result of the last run and the duration of every run in seconds"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return result, samples
+
+
+def bench_dataset(path: str, file_ext: str, repeat: int) -> dict[str, list[float]]:
+    size_bytes = os.path.getsize(path)
+    timings: dict[str, list[float]] = {}
+
+    (df, running), timings["parse"] = time_runs(lambda: read_file(path, file_ext), repeat)
+    (df, memory), timings["compact"] = time_runs(lambda: compact_frame(df), repeat)
+    ingest, timings["summary"] = time_runs(lambda: profile_frame(df, running, size_bytes), repeat)
+    fingerprint, timings["fingerprint"] = time_runs(lambda: dataset_fingerprint(df), repeat)
+    profile, timings["profile"] = time_runs(lambda: build_profile(df, fingerprint, memory.currency_columns), repeat)
+
+    file_info = {
+        'filename': os.path.basename(path),
+        'row_count': ingest.row_count,
+        'column_count': ingest.column_count,
+        'columns': ingest.columns,
+        'dtypes': ingest.dtypes,
+        'numeric_cols': ingest.numeric_cols,
+        'sample_data': ingest.sample_data,
+        'stats': ingest.stats,
+        'fingerprint': fingerprint,
+        'profile': profile,
+    }
+    loop = asyncio.new_event_loop()
+    try:
+        _, timings["prompt"] = time_runs(lambda: loop.run_until_complete(_analysis_messages(QUERY, df, file_info)), repeat)
+        chart, timings["chart"] = time_runs(
+            lambda: loop.run_until_complete(generate_chart_data(CHART_QUERY, df, file_info)), repeat
+        )
+    finally:
+        loop.close()
+
+    upload_response = {
+        'file_id': "0" * 36,
+        'filename': file_info['filename'],
+        'row_count': ingest.row_count,
+        'column_count': ingest.column_count,
+        'columns': ingest.columns,
+        'dtypes': ingest.dtypes,
+        'sample_data': ingest.sample_data[:3],
+        'memory': memory.as_dict(),
+        'stats': ingest.stats,
+    }
+    _, timings["serialize_upload"] = time_runs(lambda: json.dumps(jsonable_encoder(upload_response)), repeat)
+    chart_data = json.loads(chart)
+    _, timings["serialize_chart"] = time_runs(lambda: json.dumps(chart_data), repeat)
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--shape", choices=SHAPES, default="mixed")
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per step")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    # Rule-based chart specs only: the benchmark measures this server, not the model
+    set_llm_backend(None)
+    results: dict[str, dict[str, Any]] = {}
+    print(f"{'benchmark':>36} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = os.path.join(tmp, f"{args.shape}-{rows}.{args.format}")
+            write_dataset(path, rows, args.shape)
+            for step, samples in bench_dataset(path, f".{args.format}", args.repeat).items():
+                name = f"{args.shape}-{args.format}-{rows}/{step}"
+                results[name] = percentiles(samples)
+                stats = results[name]
+                print(f"{name:>36} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} {stats['p99_ms']:>10.2f}")
+            results[f"{args.shape}-{args.format}-{rows}/memory"] = {"peak_rss_mb": peak_rss_mb()}
+            print(f"{f'{args.shape}-{args.format}-{rows}/peak RSS':>36} {peak_rss_mb():>10.1f} MB")
+    return finish(SUITE, results, args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
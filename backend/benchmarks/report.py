@@ -0,0 +1,123 @@
+"""
+Shared helpers for the benchmark scripts: latency percentiles, peak RSS and the
+JSON baseline that runs are checked against (benchmarks/baseline.json).
+
+A baseline maps suite -> benchmark -> metrics. Latencies (p50, p95) and peak
+RSS regress when they grow, throughput (rps) when it shrinks; a change within
+the tolerance is noise. A latency must also grow by MIN_REGRESSION_MS, since
+millisecond steps vary by more than any relative tolerance. p95 is checked only
+with at least MIN_P95_SAMPLES runs; below that it is the slowest run. p99 and
+max are reported but never checked.
+"""
+import json
+import os
+import resource
+import sys
+from typing import Any
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+CHECKED_METRICS = ("p50_ms", "p95_ms", "rps", "peak_rss_mb")
+# Absolute growth a latency needs on top of the relative tolerance to count as a regression
+MIN_REGRESSION_MS = 5.0
+# Fewer runs than this make p95 the slowest run, so only p50 is checked
+MIN_P95_SAMPLES = 20
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """p50/p95/p99 and max of latencies in seconds, in milliseconds (nearest rank), and the sample count"""
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0, "samples": 0}
+    ordered = sorted(samples)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))] * 1000
+
+    return {
+        "p50_ms": round(rank(0.50), 3),
+        "p95_ms": round(rank(0.95), 3),
+        "p99_ms": round(rank(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "samples": len(ordered),
+    }
+
+
+def peak_rss_mb(pid: int | None = None) -> float | None:
+    """Peak resident memory of this process, or of `pid` on Linux (None when unknown)"""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _worse(metric: str, current: float, baseline: float, tolerance: float, samples: int | None = None) -> bool:
+    if metric not in CHECKED_METRICS:
+        return False
+    if metric == "rps":
+        return current < baseline * (1 - tolerance)
+    if metric.endswith("_ms"):
+        if metric == "p95_ms" and (samples or 0) < MIN_P95_SAMPLES:
+            return False
+        if current - baseline < MIN_REGRESSION_MS:
+            return False
+    return current > baseline * (1 + tolerance)
+
+
+def compare(suite: str, results: dict[str, dict[str, Any]], path: str = BASELINE_PATH, tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """Regressions of `results` against the saved baseline for `suite`, one line each"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        baseline = json.load(f).get(suite, {})
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if isinstance(value, (int, float)) and isinstance(expected, (int, float)) and expected > 0:
+                if _worse(metric, value, expected, tolerance, metrics.get("samples")):
+                    regressions.append(f"{suite}/{name} {metric}: {value} (baseline {expected}, {value / expected - 1:+.0%})")
+    return regressions
+
+
+def save(suite: str, results: dict[str, dict[str, Any]], path: str = BASELINE_PATH) -> None:
+    """Replace the baseline for `suite`, keeping the other suites"""
+    data = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data[suite] = results
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def finish(suite: str, results: dict[str, dict[str, Any]], args: Any) -> int:
+    """Print, save or check results as asked on the command line; returns the exit status"""
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if args.save_baseline:
+        save(suite, results, args.baseline)
+        print(f"saved {suite} baseline to {args.baseline}")
+        return 0
+    regressions = compare(suite, results, args.baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if args.check and regressions:
+        return 1
+    return 0
+
+
+def add_baseline_arguments(parser: Any) -> None:
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a metric regressed past --tolerance")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative change (0.25 = 25%%)")
+    parser.add_argument("--json", action="store_true", help="also print the results as JSON")
@@ -0,0 +1,123 @@
+"""
+Compare /chat request and response encodings for large sheets.
+
+    cd backend
+    python -m benchmarks.wire_formats                  # 50,000 x 20 sheet
+    python -m benchmarks.wire_formats --rows 10000 --cols 10 --repeat 5
+
+Requests: per-cell validated rows (the previous schema), rows and column lists
+with shape-only validation, msgpack (when installed) and Arrow IPC. Parse time is
+decode_chat_request plus building the DataFrame, i.e. what the server does before
+running operations. Responses: per-cell `updates` against block `ranges` for a
+new column plus a rewritten column.
+"""
+import argparse
+import json
+import time
+from typing import Any, List
+
+import pyarrow as pa
+from pydantic import BaseModel
+
+from models.schemas import CellUpdate, ChatResponse, UpdateRange
+from services.sandbox import sheet_frame, to_ranges
+from services.wire import ARROW_REQUEST_KEY, decode_chat_request, msgpack, sheet_to_frame
+
+
+class _LegacySheet(BaseModel):
+    name: str = "Sheet1"
+    rows: List[List[Any]] = []
+
+
+class _LegacyRequest(BaseModel):
+    message: str
+    sheet: _LegacySheet | None = None
+
+
+def make_sheet(rows: int, cols: int) -> tuple[list[str], list[list[Any]]]:
+    header = [f"col_{j}" for j in range(cols)]
+    columns = []
+    for j in range(cols):
+        if j % 3 == 0:
+            columns.append([i * (j + 1) for i in range(rows)])
+        elif j % 3 == 1:
+            columns.append([round(i * 0.37 + j, 2) for i in range(rows)])
+        else:
+            columns.append([f"item {i % 500}" for i in range(rows)])
+    return header, columns
+
+
+def time_call(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per format; the best time is reported")
+    args = parser.parse_args()
+
+    header, columns = make_sheet(args.rows, args.cols)
+    rows = [header, *map(list, zip(*columns))]
+    message = "add a bonus column"
+    row_body = json.dumps({"message": message, "sheet": {"rows": rows}}).encode()
+    column_request = {"message": message, "sheet": {"header": header, "columns": columns}}
+
+    def legacy() -> None:
+        request = _LegacyRequest.model_validate_json(row_body)
+        sheet_frame(request.sheet.rows)
+
+    def parse(body: bytes, content_type: str):
+        return lambda: sheet_to_frame(decode_chat_request(body, content_type).sheet)
+
+    formats = [
+        ("json rows, per-cell (before)", row_body, legacy),
+        ("json rows", row_body, parse(row_body, "application/json")),
+    ]
+    body = json.dumps(column_request).encode()
+    formats.append(("json columns", body, parse(body, "application/json")))
+    if msgpack is not None:
+        body = msgpack.packb(column_request)
+        formats.append(("msgpack columns", body, parse(body, "application/msgpack")))
+    table = pa.table(dict(zip(header, columns)))
+    table = table.replace_schema_metadata({ARROW_REQUEST_KEY: json.dumps({"message": message}).encode()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    body = sink.getvalue().to_pybytes()
+    formats.append(("arrow stream", body, parse(body, "application/vnd.apache.arrow.stream")))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table)
+    body = sink.getvalue().to_pybytes()
+    formats.append(("arrow stream, zstd", body, parse(body, "application/vnd.apache.arrow.stream")))
+
+    print(f"request: {args.rows:,} x {args.cols} sheet")
+    print(f"{'format':>30} {'bytes':>12} {'parse ms':>10} {'speedup':>8}")
+    baseline = None
+    for name, body, fn in formats:
+        parse_s = time_call(fn, args.repeat)
+        baseline = baseline or parse_s
+        print(f"{name:>30} {len(body):>12,} {parse_s * 1000:>10.1f} {baseline / parse_s:>7.1f}x")
+
+    # A new column plus one rewritten column: 2 x rows changed cells
+    updates = [(0, args.cols, "bonus")] + [(i + 1, args.cols, i * 0.1) for i in range(args.rows)]
+    updates += [(i + 1, 2, f"ITEM {i % 500}") for i in range(args.rows)]
+    updates.sort(key=lambda u: (u[1], u[0]))
+    cells = ChatResponse(reply="", updates=[CellUpdate.model_construct(row=r, col=c, value=v) for r, c, v in updates])
+    blocks = ChatResponse(reply="", ranges=[UpdateRange.model_construct(row=r, col=c, values=v) for r, c, v in to_ranges(updates)])
+    print(f"\nresponse: {len(updates):,} changed cells")
+    print(f"{'format':>30} {'bytes':>12} {'encode ms':>10}")
+    for name, response in (("updates (per cell)", cells), ("ranges", blocks)):
+        encode_s = time_call(response.model_dump_json, args.repeat)
+        print(f"{name:>30} {len(response.model_dump_json()):>12,} {encode_s * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
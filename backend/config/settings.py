@@ -0,0 +1,104 @@
+import os
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upload ingestion
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "100000"))
+
+# CPU-bound work (parsing, profiling, prompt serialization) runs on a bounded pool
+EXECUTOR_KIND = os.getenv("EXECUTOR_KIND", "thread")  # "thread" or "process"
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXECUTOR_QUEUE = int(os.getenv("EXECUTOR_QUEUE", "16"))
+
+# Excel parsing: "auto" (python-calamine if installed, else openpyxl read-only streaming),
+# "calamine", "openpyxl" or "pandas" (pd.read_excel)
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "auto")
+# Uploaded workbooks are kept here so other sheets can be parsed on demand
+WORKBOOK_DIR = os.getenv("WORKBOOK_DIR", os.path.join(tempfile.gettempdir(), "insightxl-workbooks"))
+
+# Ingest-time memory compaction (services/optimize.py): "on" or "off"
+INGEST_COMPACT = os.getenv("INGEST_COMPACT", "on")
+# Text columns with at most this share of distinct values are stored as pandas categoricals
+CATEGORY_MAX_RATIO = float(os.getenv("CATEGORY_MAX_RATIO", "0.5"))
+# Remaining text columns: "object" (pandas default) or "arrow" (pyarrow-backed strings, needs pyarrow)
+INGEST_STRINGS = os.getenv("INGEST_STRINGS", "object")
+
+# Out-of-core query engine for large CSV uploads (services/engine.py, needs duckdb):
+# "pandas" (every upload is loaded into memory) or "duckdb"
+QUERY_ENGINE = os.getenv("QUERY_ENGINE", "pandas")
+ENGINE_MIN_BYTES = int(os.getenv("ENGINE_MIN_MB", "100")) * 1024 * 1024  # smaller CSVs stay in pandas
+ENGINE_DIR = os.getenv("ENGINE_DIR", os.path.join(tempfile.gettempdir(), "insightxl-engine"))
+ENGINE_MEMORY_MB = int(os.getenv("ENGINE_MEMORY_MB", "1024"))  # DuckDB spills to ENGINE_DIR past this
+ENGINE_THREADS = int(os.getenv("ENGINE_THREADS", str(os.cpu_count() or 1)))
+ENGINE_SAMPLE_ROWS = int(os.getenv("ENGINE_SAMPLE_ROWS", "50000"))  # rows kept in memory for prompts and suggestions
+
+# Sandboxed execution of /chat agent operations (services/sandbox.py)
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "5"))  # CPU time per request; 0 disables the cap
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))  # address space per worker; 0 disables the cap
+SANDBOX_MAX_OPERATIONS = int(os.getenv("SANDBOX_MAX_OPERATIONS", "20"))
+SANDBOX_MAX_UPDATES = int(os.getenv("SANDBOX_MAX_UPDATES", "100000"))  # cell updates returned per request
+
+# Uploaded DataFrame storage
+DATAFRAME_STORE = os.getenv("DATAFRAME_STORE", "memory")  # "memory", "disk" or "shared"
+STORE_MAX_BYTES = int(os.getenv("STORE_MAX_MB", "1024")) * 1024 * 1024
+STORE_TTL_SECONDS = float(os.getenv("STORE_TTL_SECONDS", "3600"))  # 0 disables expiry
+STORE_SPILL_DIR = os.getenv("STORE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "insightxl-spill"))
+SHARED_STORE_DIR = os.getenv("SHARED_STORE_DIR", os.path.join(tempfile.gettempdir(), "insightxl-shared"))
+
+# Secondary indexes and group-by pre-aggregations for in-memory uploads (services/indexes.py):
+# "lazy" (built per column on first use), "upload" (built with the profile) or "off"
+DATASET_INDEXES = os.getenv("DATASET_INDEXES", "lazy")
+INDEX_MAX_BYTES = int(os.getenv("INDEX_MAX_MB", "512")) * 1024 * 1024  # least recently used datasets' indexes are dropped past this
+
+# Number of server worker processes (also read by uvicorn/gunicorn)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# LLM response cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))  # 0 disables expiry
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")  # path to a SQLite file; empty keeps the cache in memory only
+
+# Query planning ahead of the LLM: "llm" (rules, then a small model), "sql" (rules, then
+# model-written SQL run with duckdb, see services/sql.py), "rules" or "off"
+QUERY_PLANNER = os.getenv("QUERY_PLANNER", "llm")
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "10"))  # generated queries running longer are interrupted
+
+# Conversation memory for /chat/query per user and file (services/conversations.py): "on" or "off"
+CONVERSATIONS = os.getenv("CONVERSATIONS", "on")
+CONVERSATION_TURNS = int(os.getenv("CONVERSATION_TURNS", "6"))  # recent turns sent as they were; older ones are summarized
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "400"))
+CONVERSATION_ANSWER_TOKENS = int(os.getenv("CONVERSATION_ANSWER_TOKENS", "300"))  # each past answer is cut to this
+CONVERSATION_MAX = int(os.getenv("CONVERSATION_MAX", "10000"))
+CONVERSATION_TTL_SECONDS = float(os.getenv("CONVERSATION_TTL_SECONDS", "3600"))  # 0 disables expiry
+
+# Charts are aggregated server-side and downsampled to this many points
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "200"))
+CHART_DOWNSAMPLE = os.getenv("CHART_DOWNSAMPLE", "lttb")  # "lttb" or "minmax"
+
+# Token budget for the data context sent with analysis questions
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# LLM gateway (services/gateway.py): "openai", or "fake" for a local canned backend
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", "16"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+# Supabase auth (routers/auth.py): pooled HTTP client, local token checks and profile cache
+AUTH_HTTP_CONNECTIONS = int(os.getenv("AUTH_HTTP_CONNECTIONS", "20"))
+AUTH_HTTP_TIMEOUT_SECONDS = float(os.getenv("AUTH_HTTP_TIMEOUT_SECONDS", "10"))
+AUTH_JWKS_TTL_SECONDS = float(os.getenv("AUTH_JWKS_TTL_SECONDS", "600"))
+AUTH_PROFILE_TTL_SECONDS = float(os.getenv("AUTH_PROFILE_TTL_SECONDS", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+# Observability: Prometheus metrics at /metrics, per-request timing spans and logs
+METRICS = os.getenv("METRICS", "on")  # "on" or "off"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text", or "json" for one JSON object per line with the request id
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
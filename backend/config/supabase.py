@@ -1,46 +1,72 @@
 import os
-from supabase import create_client, Client
+
+import httpx
 from dotenv import load_dotenv
+from gotrue import AsyncGoTrueClient
+
+from config.settings import AUTH_HTTP_CONNECTIONS, AUTH_HTTP_TIMEOUT_SECONDS
 
 load_dotenv()
 
 # Supabase configuration
-SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
-
-# Initialize Supabase client
-supabase: Client | None = None
-supabase_admin: Client | None = None
+# Legacy HS256 JWT secret (Project Settings > API); projects with signing keys are checked against their JWKS
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
 
 if SUPABASE_URL and SUPABASE_KEY:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("[OK] Supabase client initialized")
+    print("[OK] Supabase configured")
 else:
     print("[WARNING] Supabase credentials not found. Please set SUPABASE_URL and SUPABASE_KEY in .env")
 
-# Admin client with service role key for backend operations
-if SUPABASE_URL and SUPABASE_SERVICE_KEY:
-    supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-    print("[OK] Supabase admin client initialized")
-else:
-    print("[WARNING] Supabase service key not found. Some admin operations will not be available.")
-
-
-def get_supabase_client() -> Client:
-    """Get the Supabase client instance"""
-    if supabase is None:
-        raise Exception("Supabase client not initialized. Please check your environment variables.")
-    return supabase
+if not SUPABASE_SERVICE_KEY:
+    print("[WARNING] Supabase service key not found. Profiles are read with the user's own token.")
 
+# One pooled HTTP client for every Supabase call (auth and REST)
+_http_client: httpx.AsyncClient | None = None
+_auth_client: AsyncGoTrueClient | None = None
 
-def get_supabase_admin() -> Client:
-    """Get the Supabase admin client with service role"""
-    if supabase_admin is None:
-        raise Exception("Supabase admin client not initialized. Please check your SUPABASE_SERVICE_KEY.")
-    return supabase_admin
 
+def get_http_client() -> httpx.AsyncClient:
+    """Lazy initialization of the HTTP connection pool shared by all Supabase calls"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=AUTH_HTTP_CONNECTIONS,
+                max_keepalive_connections=AUTH_HTTP_CONNECTIONS,
+                keepalive_expiry=30.0,
+            ),
+            timeout=httpx.Timeout(AUTH_HTTP_TIMEOUT_SECONDS, connect=5.0),
+        )
+    return _http_client
 
 
+def get_auth_client() -> AsyncGoTrueClient:
+    """
+    Get the async Supabase Auth client. It is shared by all requests, so it keeps
+    no session of its own: calls that act for a user take their access token.
+    """
+    global _auth_client
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        raise Exception("Supabase client not initialized. Please check your environment variables.")
+    if _auth_client is None:
+        _auth_client = AsyncGoTrueClient(
+            url=f"{SUPABASE_URL}/auth/v1",
+            headers={"apiKey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+            auto_refresh_token=False,
+            persist_session=False,
+            http_client=get_http_client(),
+        )
+    return _auth_client
 
 
+def rest_headers(access_token: str | None = None) -> dict[str, str]:
+    """
+    Headers for a PostgREST call: the service role when it is configured,
+    otherwise the user's own token so row-level security applies.
+    """
+    if SUPABASE_SERVICE_KEY:
+        return {"apikey": SUPABASE_SERVICE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}"}
+    return {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {access_token or SUPABASE_KEY}"}
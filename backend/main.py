@@ -1,7 +1,9 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from routers import chat, auth
+from services.metrics import ENABLED as METRICS_ENABLED, MetricsMiddleware, render_metrics
 
 
 app = FastAPI(title="InsightXL API", version="0.1.0")
@@ -12,7 +14,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "X-Sheet-Version"],
 )
+if METRICS_ENABLED:
+    # Outermost, so request latency includes every other middleware
+    app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/health")
@@ -20,6 +26,14 @@ async def health_check():
     return {"status": "ok", "service": "InsightXL API"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: request latency by route, spans, LLM tokens and store size"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS=off)")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 app.include_router(chat.router, prefix="/chat", tags=["chat"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 
@@ -27,6 +41,12 @@ app.include_router(auth.router, prefix="/auth", tags=["auth"])
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    from config.settings import WEB_CONCURRENCY
+
+    if WEB_CONCURRENCY > 1:
+        # Workers share uploads through DATAFRAME_STORE=shared; reload is single-process only
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
 
@@ -1,22 +1,53 @@
-from typing import Any, Dict, List, Optional
+from typing import Annotated, Any, Dict, List, Literal, Optional, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, SkipValidation, model_validator
 
 
 class CellUpdate(BaseModel):
+    # Grid position: row 0 is the header row, data rows start at 1
     row: int
     col: int
     value: Any
 
 
+class UpdateRange(BaseModel):
+    # Top-left cell of a rectangular block of updates; `values` is row-major
+    row: int
+    col: int
+    values: List[List[Any]]
+
+
 class SheetState(BaseModel):
     """
     Lightweight representation of the current sheet.
     Later you can extend this to multiple sheets, styling, etc.
+    
+    Either `rows` (row 0 is the header) or the column-oriented `header` and
+    `columns` (one list of values per column). Cell values are not validated one
+    by one; only the shape of the grid is checked.
     """
 
     name: str = "Sheet1"
-    rows: List[List[Any]] = Field(default_factory=list)
+    rows: SkipValidation[List[List[Any]]] = Field(default_factory=list)
+    header: Optional[List[str]] = None
+    columns: Optional[SkipValidation[List[List[Any]]]] = None
+    # Set when the sheet arrives as an Arrow IPC body (see services/wire.py)
+    _frame: Any = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def _check_shape(self) -> "SheetState":
+        if not isinstance(self.rows, list) or not all(isinstance(row, list) for row in self.rows):
+            raise ValueError("rows must be a list of lists")
+        if (self.header is None) != (self.columns is None):
+            raise ValueError("header and columns must be sent together")
+        if self.columns is not None:
+            if not isinstance(self.columns, list) or not all(isinstance(col, list) for col in self.columns):
+                raise ValueError("columns must be a list of lists")
+            if len(self.columns) != len(self.header):
+                raise ValueError("columns must have one list per header name")
+            if len({len(col) for col in self.columns}) > 1:
+                raise ValueError("all columns must have the same length")
+        return self
 
 
 class ChatRequest(BaseModel):
@@ -25,6 +56,14 @@ class ChatRequest(BaseModel):
         default=None,
         description="Optional snapshot of the current sheet to give the agent full context.",
     )
+    file_id: Optional[str] = Field(
+        default=None,
+        description="Optional uploaded file to work on instead of a sheet snapshot.",
+    )
+    update_format: Literal["cells", "ranges"] = Field(
+        default="cells",
+        description='"ranges" returns changes as rectangular blocks in `ranges` instead of per-cell `updates`.',
+    )
 
 
 class ChatResponse(BaseModel):
@@ -33,9 +72,43 @@ class ChatResponse(BaseModel):
         default_factory=list,
         description="Optional cell updates for the frontend to apply to the sheet.",
     )
+    ranges: List[UpdateRange] = Field(
+        default_factory=list,
+        description='Cell updates as rectangular blocks, when requested with update_format "ranges".',
+    )
     chart_spec: Optional[Dict[str, Any]] = Field(
         default=None,
         description="Optional chart configuration to render on the frontend.",
     )
 
 
+
+
+class SetCells(BaseModel):
+    # Rectangular block written at (row, col); row 0 renames columns, and columns
+    # past the right edge of the sheet are added
+    op: Literal["set_cells"]
+    row: int = Field(..., ge=0)
+    col: int = Field(..., ge=0)
+    values: List[List[Any]]
+
+
+class InsertRows(BaseModel):
+    # New data rows inserted before grid row `row` (1 is the first data row)
+    op: Literal["insert_rows"]
+    row: int = Field(..., ge=1)
+    values: List[List[Any]]
+
+
+class DeleteRows(BaseModel):
+    op: Literal["delete_rows"]
+    row: int = Field(..., ge=1)
+    count: int = Field(default=1, ge=1)
+
+
+SheetEdit = Annotated[Union[SetCells, InsertRows, DeleteRows], Field(discriminator="op")]
+
+
+class SheetPatch(BaseModel):
+    base_version: int = Field(..., description="Version of the stored sheet the edits were made against.")
+    edits: List[SheetEdit] = Field(..., description="Edits applied in order, each to the result of the previous one.")
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel, EmailStr
-from config.supabase import get_supabase_client
+from config.supabase import get_auth_client
 from gotrue.errors import AuthApiError
+from services.auth import TokenError, get_profile_name, revoke_token, verify_access_token
+from services.metrics import TimedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 class SignUpRequest(BaseModel):
@@ -29,10 +31,8 @@ async def sign_up(payload: SignUpRequest):
     Register a new user with Supabase Auth
     """
     try:
-        supabase = get_supabase_client()
-        
         # Sign up user with Supabase Auth
-        response = supabase.auth.sign_up({
+        response = await get_auth_client().sign_up({
             "email": payload.email,
             "password": payload.password,
             "options": {
@@ -79,10 +79,8 @@ async def sign_in(payload: SignInRequest):
     Sign in an existing user with Supabase Auth
     """
     try:
-        supabase = get_supabase_client()
-        
         # Sign in with Supabase Auth
-        response = supabase.auth.sign_in_with_password({
+        response = await get_auth_client().sign_in_with_password({
             "email": payload.email,
             "password": payload.password
         })
@@ -93,13 +91,14 @@ async def sign_in(payload: SignInRequest):
                 detail="Invalid credentials"
             )
         
-        # Get user profile from database
-        profile_response = supabase.table("user_profiles").select("*").eq("id", response.user.id).execute()
+        # Get user profile from database (cached, so /auth/user can answer without a round trip)
+        access_token = response.session.access_token if response.session else None
+        name = await get_profile_name(response.user.id, access_token)
         
         user_data = {
             "id": response.user.id,
             "email": response.user.email,
-            "name": profile_response.data[0]["name"] if profile_response.data else response.user.email.split("@")[0]
+            "name": name or response.user.email.split("@")[0]
         }
         
         return AuthResponse(
@@ -124,13 +123,14 @@ async def sign_in(payload: SignInRequest):
 
 
 @router.post("/signout")
-async def sign_out():
+async def sign_out(access_token: str):
     """
-    Sign out the current user
+    Sign out the user the access token belongs to. The token is refused by
+    this server from now on, even though it has not expired yet (by every
+    worker with DATAFRAME_STORE=shared).
     """
     try:
-        supabase = get_supabase_client()
-        supabase.auth.sign_out()
+        await revoke_token(access_token)
         
         return {"message": "Signed out successfully"}
         
@@ -144,27 +144,27 @@ async def sign_out():
 @router.get("/user")
 async def get_current_user(access_token: str):
     """
-    Get the current authenticated user
+    Get the current authenticated user.
+    The token is checked locally against the project's JWT secret or signing
+    keys, and the profile comes from a short-lived cache, so a warm call makes
+    no request to Supabase.
     """
     try:
-        supabase = get_supabase_client()
-        
-        # Get user from access token
-        user_response = supabase.auth.get_user(access_token)
-        
-        if not user_response.user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid or expired token"
-            )
-        
-        # Get user profile
-        profile_response = supabase.table("user_profiles").select("*").eq("id", user_response.user.id).execute()
+        claims = await verify_access_token(access_token)
+    except TokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid or expired token: {str(e)}"
+        )
+    
+    try:
+        email = claims.get("email") or ""
+        name = await get_profile_name(claims["sub"], access_token)
         
         user_data = {
-            "id": user_response.user.id,
-            "email": user_response.user.email,
-            "name": profile_response.data[0]["name"] if profile_response.data else user_response.user.email.split("@")[0]
+            "id": claims["sub"],
+            "email": email,
+            "name": name or (claims.get("user_metadata") or {}).get("name") or email.split("@")[0]
         }
         
         return {"user": user_data}
@@ -174,8 +174,3 @@ async def get_current_user(access_token: str):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Failed to get user: {str(e)}"
         )
-
-
-
-
-
@@ -1,33 +1,223 @@
+import asyncio
+import json
 import os
-import uuid
-import io
-from typing import Dict, Any
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from pydantic import BaseModel
-import pandas as pd
+from collections.abc import AsyncIterator
+from typing import NoReturn
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 
-from models.schemas import ChatRequest, ChatResponse
-from services.llm import run_llm_agent, generate_suggestions, answer_query_with_context
+from config.settings import INGEST_COMPACT
+from models.schemas import ChatRequest, ChatResponse, SheetPatch
+from services.auth import auth_stats
+from services.cache import dataset_fingerprint, get_response_cache
+from services.context import context_stats
+from services.conversations import ENABLED as CONVERSATIONS_ENABLED, Conversation, get_conversation_store
+from services.engine import delete_dataset, engine_stats, ingest_csv, use_engine
+from services.executor import ExecutorSaturated, executor_stats, run_stage
+from services.gateway import llm_stats
+from services.excel import SheetNotFound, get_workbook_store, list_sheets, resolve_sheet
+from services.handles import get_handle_registry
+from services.indexes import drop_dataset_index, get_dataset_index, index_on_upload, index_stats
+from services.optimize import compact_frame, compact_stats, record_compaction
+from services.ingest import UploadTooLarge, profile_frame, read_file, spool_upload
+from services.patches import (
+    PatchError,
+    apply_patch,
+    patch_stats,
+    patched_file_data,
+    patched_fingerprint,
+    record_conflict,
+    record_patch,
+)
+from services.profile import build_profile
+from services.sandbox import sandbox_stats
+from services.sql import sql_stats
+from services.store import get_store
+from services.suggestions import get_suggestions_job, start_suggestions_job, suggestions_stats
+from services.wire import (
+    ARROW_STREAM_TYPE,
+    UnsupportedMediaType,
+    accepts_msgpack,
+    decode_chat_request,
+    encode_msgpack,
+)
+from services.logs import get_logger
+from services.metrics import TimedRoute, register_gauge
+from services.llm import (
+    run_llm_agent,
+    answer_query_with_context,
+    stream_llm_agent,
+    stream_query_with_context,
+)
 
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+log = get_logger("chat")
 
-# In-memory storage for uploaded files and their data
-# In production, use Redis or database
-file_storage: Dict[str, Dict[str, Any]] = {}
+# POST /chat reads its body itself so it can accept more than JSON
+CHAT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"$ref": "#/components/schemas/ChatRequest"}},
+            "application/msgpack": {"schema": {"$ref": "#/components/schemas/ChatRequest"}},
+            ARROW_STREAM_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        },
+    }
+}
+
+# Parsed datasets keyed by content, bounded by size and TTL (see services/store.py)
+store = get_store()
+# The file ids handed to clients, reference-counting the datasets they point at
+handles = get_handle_registry()
+# Datasets being parsed, so concurrent uploads of the same bytes parse once
+_parsing: dict[str, asyncio.Future] = {}
+# One patch at a time per file id in this worker; across workers the handle version is compared-and-set
+_patch_locks: dict[str, asyncio.Lock] = {}
+
+register_gauge("insightxl_store_entries", "Datasets held by the file store", lambda: store.stats()["entries"])
+register_gauge("insightxl_store_bytes", "Bytes held by the file store", lambda: store.stats()["bytes"])
+register_gauge("insightxl_file_handles", "File ids handed out to clients", lambda: handles.stats()["handles"])
+register_gauge("insightxl_executor_in_flight", "Jobs running or queued on the worker pool", lambda: executor_stats()["in_flight"])
+register_gauge("insightxl_llm_in_flight", "LLM calls in progress", lambda: llm_stats().get("in_flight", 0))
+
+
+# Keep proxies (nginx) from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _event_stream(events: AsyncIterator[tuple[str, dict]]) -> AsyncIterator[str]:
+    """Server-sent events for a streaming answer; failures after the response has started become an error event"""
+    try:
+        async for event, data in events:
+            yield _sse(event, data)
+    except ExecutorSaturated as e:
+        yield _sse("error", {"status": 503, "message": str(e)})
+    except Exception as e:
+        log.error(f"Error streaming response: {e}")
+        yield _sse("error", {"status": 500, "message": f"Error processing query: {str(e)}"})
 
 
 class QueryRequest(BaseModel):
     message: str
     file_id: str
     user_id: str
+    use_cache: bool = True
+    # Another sheet of the uploaded workbook, by name or 0-based index
+    sheet: str | None = None
+    sheet_id: int | None = None
+    # Forget earlier questions about this file and start a new conversation
+    new_conversation: bool = False
+
+
+def _upload_summary(row_count: int, column_count: int, numeric_cols: list[str]) -> str:
+    summary = f"Analyzed your file successfully! It contains {row_count} rows and {column_count} columns."
+    if numeric_cols:
+        summary += f" Found {len(numeric_cols)} numeric columns: {', '.join(numeric_cols[:3])}"
+        if len(numeric_cols) > 3:
+            summary += f" and {len(numeric_cols) - 3} more"
+    return summary
+
+
+def sheet_dataset_id(content_id: str, sheet_index: int) -> str:
+    """Store key of one sheet of an upload; the first sheet (and CSV data) uses the content id itself"""
+    return content_id if sheet_index == 0 else f"{content_id}-s{sheet_index}"
+
+
+def edited_dataset_id(file_id: str) -> str:
+    """Store key of a handle's own copy of its sheet, made by its first patch"""
+    return f"edit-{file_id}"
+
+
+async def _parse_dataset(
+    content_id: str, sheet_index: int, path: str, file_ext: str, filename: str, size_bytes: int, sheets: list[str] | None
+) -> dict:
+    """Parse, profile and store a new dataset (one sheet of an upload) on the worker pool"""
+    dataset_id = sheet_dataset_id(content_id, sheet_index)
+    memory = engine = None
+    if use_engine(file_ext, size_bytes):
+        # Too big to hold in memory: queries run on a Parquet copy, prompts use a sample
+        engine = await run_stage("parse", ingest_csv, path, content_id)
+        df = await run_stage("sample", engine.sample)
+        ingest = await run_stage("summary", engine.summary, df, size_bytes)
+        fingerprint = content_id
+        profile = await run_stage("profile", engine.profile, df, fingerprint)
+    else:
+        df, running = await run_stage("parse", read_file, path, file_ext, sheet_index)
+        if INGEST_COMPACT == "on":
+            df, memory = await run_stage("compact", compact_frame, df)
+            record_compaction(memory)
+        ingest = await run_stage("summary", profile_frame, df, running, size_bytes)
+        fingerprint = await run_stage("fingerprint", dataset_fingerprint, df)
+        profile = await run_stage("profile", build_profile, df, fingerprint, memory.currency_columns if memory else None)
+    
+    file_data = {
+        'dataset_id': dataset_id,
+        'content_id': content_id,
+        'file_ext': file_ext,
+        'sheets': sheets,
+        'sheet': sheets[sheet_index] if sheets else None,
+        'filename': filename,
+        'dataframe': df,
+        'row_count': ingest.row_count,
+        'column_count': ingest.column_count,
+        'columns': ingest.columns,
+        'dtypes': ingest.dtypes,
+        'numeric_cols': ingest.numeric_cols,
+        'sample_data': ingest.sample_data,
+        'stats': ingest.stats,
+        'size_bytes': size_bytes,
+        'fingerprint': fingerprint,
+        'profile': profile,
+        'memory': memory.as_dict() if memory else None,
+        'engine': engine,
+    }
+    index = get_dataset_index(file_data) if index_on_upload() else None
+    if index is not None:
+        await run_stage("index", index.build, df, profile)
+    await store.put_async(dataset_id, file_data)
+    return file_data
+
+
+async def _get_or_parse(content_id: str, sheet_index: int, *args) -> dict:
+    """A stored dataset, parsing it if needed; concurrent requests for the same dataset share one parse"""
+    dataset_id = sheet_dataset_id(content_id, sheet_index)
+    file_data = await store.get_async(dataset_id)
+    if file_data is not None:
+        handles.dedup_hits += 1
+        return file_data
+    if dataset_id in _parsing:
+        handles.dedup_hits += 1
+        return await asyncio.shield(_parsing[dataset_id])
+    task = asyncio.ensure_future(_parse_dataset(content_id, sheet_index, *args))
+    _parsing[dataset_id] = task
+    task.add_done_callback(lambda _: _parsing.pop(dataset_id, None))
+    return await asyncio.shield(task)
 
 
 @router.post("/upload")
-async def upload_excel_file(file: UploadFile = File(...)):
+async def upload_excel_file(
+    file: UploadFile = File(...),
+    user_id: str | None = Form(None),
+    sheet: str | None = Form(None),
+    sheet_id: int | None = Form(None),
+):
     """
     Upload and analyze an Excel or CSV file.
-    Returns file metadata, data summary, and smart suggestions.
+    Returns file metadata and data summary right away; smart suggestions are
+    generated in the background and fetched from /chat/suggestions/{job_id}
+    (they are included directly when this data's suggestions are cached).
+    
+    Uploads are hashed while they are spooled: identical content is parsed and
+    stored once, and each user gets a handle (file_id) on the shared dataset.
+    Workbooks are parsed one sheet at a time: `sheet` (name) or `sheet_id`
+    (0-based index) picks the sheet, the first one by default.
     """
     # Validate file type
     valid_extensions = ['.xlsx', '.xls', '.csv']
@@ -40,69 +230,61 @@ async def upload_excel_file(file: UploadFile = File(...)):
         )
     
     try:
-        # Read file content
-        contents = await file.read()
+        # Spool the upload to disk in chunks, then parse it on the worker pool unless
+        # the same bytes were uploaded before
+        path, size_bytes, content_id = await spool_upload(file, file_ext)
+        try:
+            sheets = None
+            if file_ext == '.csv':
+                if sheet is not None or sheet_id not in (None, 0):
+                    raise SheetNotFound("CSV files have a single sheet")
+                sheet_index = 0
+            else:
+                sheets = await run_stage("sheets", list_sheets, path, file_ext)
+                sheet_index = resolve_sheet(sheets, sheet, sheet_id)
+                # Keep the workbook so other sheets can be parsed when they are asked for
+                if len(sheets) > 1:
+                    get_workbook_store().save(content_id, file_ext, path)
+            file_data = await _get_or_parse(
+                content_id, sheet_index, path, file_ext, file.filename, size_bytes, sheets
+            )
+        finally:
+            os.unlink(path)
         
-        # Parse the file based on type
-        if file_ext == '.csv':
-            df = pd.read_csv(io.BytesIO(contents))
-        else:
-            df = pd.read_excel(io.BytesIO(contents))
+        handle = handles.acquire(file_data['dataset_id'], user_id, file.filename)
         
-        # Generate unique file ID
-        file_id = str(uuid.uuid4())
+        columns = file_data['columns']
+        numeric_cols = file_data.get('numeric_cols', list(file_data['stats']))
         
-        # Get data summary
-        row_count, column_count = df.shape
-        columns = df.columns.tolist()
-        dtypes = df.dtypes.to_dict()
-        
-        # Get sample data (first 5 rows)
-        sample_data = df.head(5).to_dict(orient='records')
-        
-        # Get basic statistics for numeric columns
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        stats = {}
-        if numeric_cols:
-            stats = df[numeric_cols].describe().to_dict()
-        
-        # Generate data summary text
-        summary = f"Analyzed your file successfully! It contains {row_count} rows and {column_count} columns."
-        if numeric_cols:
-            summary += f" Found {len(numeric_cols)} numeric columns: {', '.join(numeric_cols[:3])}"
-            if len(numeric_cols) > 3:
-                summary += f" and {len(numeric_cols) - 3} more"
-        
-        # Store file data
-        file_data = {
-            'file_id': file_id,
-            'filename': file.filename,
-            'dataframe': df,
-            'row_count': row_count,
-            'column_count': column_count,
-            'columns': columns,
-            'dtypes': {k: str(v) for k, v in dtypes.items()},
-            'sample_data': sample_data,
-            'stats': {k: {kk: float(vv) if not pd.isna(vv) else None for kk, vv in v.items()} for k, v in stats.items()} if stats else {},
-        }
-        
-        file_storage[file_id] = file_data
-        
-        # Generate smart suggestions based on data
-        suggestions = await generate_suggestions(df, columns, numeric_cols)
+        # Generate smart suggestions based on data without holding up the response
+        suggestions_job_id, suggestions = start_suggestions_job(
+            file_data['dataframe'], columns, numeric_cols, file_data['fingerprint']
+        )
         
         return {
-            'file_id': file_id,
+            'file_id': handle.file_id,
             'filename': file.filename,
-            'row_count': row_count,
-            'column_count': column_count,
+            'sheets': sheets,
+            'sheet': file_data.get('sheet'),
+            'row_count': file_data['row_count'],
+            'column_count': file_data['column_count'],
             'columns': columns,
             'dtypes': file_data['dtypes'],
-            'sample_data': sample_data[:3],  # Return only first 3 rows to frontend
-            'summary': summary,
-            'suggestions': suggestions,
+            'sample_data': file_data['sample_data'][:3],  # Return only first 3 rows to frontend
+            'memory': file_data.get('memory'),
+            'version': file_data.get('version', 0),
+            'summary': _upload_summary(file_data['row_count'], file_data['column_count'], numeric_cols),
+            'suggestions': suggestions or [],
+            'suggestions_job_id': suggestions_job_id,
+            'suggestions_status': 'done' if suggestions is not None else 'pending',
         }
     
+    except SheetNotFound as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -110,6 +292,148 @@ async def upload_excel_file(file: UploadFile = File(...)):
         )
 
 
+async def _load_sheet(file_data: dict, sheet: str | None, sheet_id: int | None) -> dict:
+    """Another sheet of the same workbook, parsed on first use and cached like any dataset"""
+    sheets = file_data.get('sheets')
+    if not sheets:
+        raise SheetNotFound("This file has a single sheet")
+    sheet_index = resolve_sheet(sheets, sheet, sheet_id)
+    if sheets[sheet_index] == file_data.get('sheet'):
+        return file_data
+    content_id, file_ext = file_data['content_id'], file_data['file_ext']
+    dataset_id = sheet_dataset_id(content_id, sheet_index)
+    path = get_workbook_store().get(content_id, file_ext)
+    if path is None and dataset_id not in _parsing and await store.get_async(dataset_id) is None:
+        raise HTTPException(status_code=404, detail="Workbook no longer available. Please upload the file again.")
+    return await _get_or_parse(
+        content_id, sheet_index, path, file_ext, file_data['filename'], file_data['size_bytes'], sheets
+    )
+
+
+def _conversation(request: QueryRequest) -> Conversation | None:
+    if not CONVERSATIONS_ENABLED:
+        return None
+    return get_conversation_store().get(request.user_id, request.file_id, new=request.new_conversation)
+
+
+async def _load_query_file(request: QueryRequest) -> dict:
+    file_data = await _load_file(request.file_id)
+    if request.sheet is None and request.sheet_id is None:
+        return file_data
+    try:
+        sheet_data = await _load_sheet(file_data, request.sheet, request.sheet_id)
+        return {**sheet_data, 'filename': file_data['filename']}
+    except SheetNotFound as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
+async def _load_file(file_id: str) -> dict:
+    handle = handles.get(file_id)
+    file_data = await store.get_async(handle.dataset_id) if handle is not None else None
+    if file_data is None:
+        if handle is not None:
+            # The dataset was evicted or expired; its handles are stale
+            handles.forget_dataset(handle.dataset_id)
+        raise HTTPException(
+            status_code=404,
+            detail="File not found. Please upload the file again."
+        )
+    # The dataset may be shared; prompts use this handle's own filename
+    return {**file_data, 'filename': handle.filename}
+
+
+async def _ensure_profile(file_data: dict) -> None:
+    # Uploads stored before profiles existed, or whose data changed, get a fresh profile
+    profile = file_data.get('profile')
+    if profile is None or profile.fingerprint != file_data.get('fingerprint'):
+        df = file_data['dataframe']
+        fingerprint = file_data.get('fingerprint') or await run_stage("fingerprint", dataset_fingerprint, df)
+        file_data['fingerprint'] = fingerprint
+        file_data['profile'] = await run_stage("profile", build_profile, df, fingerprint)
+
+
+@router.get("/file/{file_id}/sheets")
+async def list_file_sheets(file_id: str):
+    """Sheets of an uploaded workbook; any of them can be queried with `sheet` or `sheet_id`"""
+    file_data = await _load_file(file_id)
+    return {
+        'file_id': file_id,
+        'sheets': file_data.get('sheets') or [],
+        'sheet': file_data.get('sheet'),
+        'version': file_data.get('version', 0),
+    }
+
+
+def _version_conflict(version: int, base_version: int) -> NoReturn:
+    record_conflict()
+    raise HTTPException(
+        status_code=409,
+        detail=f"The sheet is at version {version}, not {base_version}",
+        headers={"X-Sheet-Version": str(version)},
+    )
+
+
+@router.patch("/file/{file_id}")
+async def patch_file(file_id: str, patch: SheetPatch):
+    """
+    Apply cell, range and row edits to an uploaded file's sheet, so clients keep
+    it in sync by sending changes instead of the whole sheet. `base_version` must
+    be the stored version (409 otherwise, with the current one in the
+    X-Sheet-Version header). Only the edited columns are profiled again, and
+    cached answers for the old data stop matching.
+    
+    The first patch gives this handle its own copy of the dataset; other users
+    of the same upload keep the original.
+    """
+    lock = _patch_locks.setdefault(file_id, asyncio.Lock())
+    async with lock:
+        file_data = await _load_file(file_id)
+        handle = handles.get(file_id)
+        if handle is None:
+            raise HTTPException(status_code=404, detail="File not found. Please upload the file again.")
+        # The handle holds the version; stored data behind it is a patch still being written by another worker
+        if patch.base_version != handle.version or file_data.get('version', 0) != handle.version:
+            _version_conflict(handle.version, patch.base_version)
+        if file_data.get('engine') is not None:
+            raise HTTPException(status_code=422, detail="Large files are read-only; edit the file and upload it again")
+        try:
+            result = await run_stage("patch", apply_patch, file_data['dataframe'], patch)
+            fingerprint = patched_fingerprint(file_data['fingerprint'], patch)
+            file_data = await run_stage("profile", patched_file_data, file_data, result, fingerprint)
+        except PatchError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except ExecutorSaturated as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        
+        # Claim the new version before writing, so a worker that patched the same version concurrently gets a 409
+        if not handles.advance_version(file_id, handle.version, file_data['version']):
+            current = handles.get(file_id)
+            _version_conflict(current.version if current is not None else handle.version + 1, patch.base_version)
+        dataset_id = edited_dataset_id(file_id)
+        file_data['dataset_id'] = dataset_id
+        try:
+            await store.put_async(dataset_id, file_data)
+        except BaseException:
+            handles.advance_version(file_id, file_data['version'], handle.version)
+            raise
+        if handle.dataset_id != dataset_id:
+            # The shared dataset stays until it is evicted or its upload is deleted
+            handles.move(file_id, dataset_id)
+        record_patch(result, len(patch.edits))
+    
+    return {
+        'file_id': file_id,
+        'version': file_data['version'],
+        'row_count': file_data['row_count'],
+        'column_count': file_data['column_count'],
+        'columns': file_data['columns'],
+        'dtypes': file_data['dtypes'],
+        'changed_columns': result.changed_columns,
+    }
+
+
 @router.post("/query")
 async def query_excel_data(request: QueryRequest):
     """
@@ -117,21 +441,19 @@ async def query_excel_data(request: QueryRequest):
     The AI will only use the provided data context to prevent hallucinations.
     """
     # Check if file exists
-    if request.file_id not in file_storage:
-        raise HTTPException(
-            status_code=404,
-            detail="File not found. Please upload the file again."
-        )
-    
-    file_data = file_storage[request.file_id]
+    file_data = await _load_query_file(request)
     df = file_data['dataframe']
     
     try:
+        await _ensure_profile(file_data)
+        
         # Generate response using LLM with data context
         response = await answer_query_with_context(
             query=request.message,
             dataframe=df,
-            file_info=file_data
+            file_info=file_data,
+            use_cache=request.use_cache,
+            conversation=_conversation(request),
         )
         
         return {
@@ -139,6 +461,8 @@ async def query_excel_data(request: QueryRequest):
             'file_id': request.file_id,
         }
     
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -146,24 +470,135 @@ async def query_excel_data(request: QueryRequest):
         )
 
 
-@router.post("", response_model=ChatResponse)
-async def chat_with_agent(payload: ChatRequest) -> ChatResponse:
+@router.post("/query/stream")
+async def stream_excel_query(request: QueryRequest):
+    """
+    Streaming variant of /chat/query as server-sent events: "delta" events with
+    report text as it is generated, then a "done" event with the mode, cache
+    status, token usage and timing (or an "error" event).
+    """
+    file_data = await _load_query_file(request)
+    try:
+        await _ensure_profile(file_data)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    
+    events = stream_query_with_context(
+        query=request.message,
+        dataframe=file_data['dataframe'],
+        file_info=file_data,
+        use_cache=request.use_cache,
+        conversation=_conversation(request),
+    )
+    return StreamingResponse(_event_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/stream")
+async def stream_chat_with_agent(payload: ChatRequest):
+    """
+    Streaming variant of POST /chat as server-sent events (same events as /chat/query/stream).
+    With a sheet or file_id, the cell updates, ranges and chart come in the "done" event.
+    """
+    file_data = await _load_file(payload.file_id) if payload.file_id else None
+    return StreamingResponse(
+        _event_stream(stream_llm_agent(payload, file_data)), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+@router.post("", response_model=ChatResponse, openapi_extra=CHAT_REQUEST_BODY)
+async def chat_with_agent(request: Request):
     """
     Core entrypoint for the InsightXL Excel agent.
     
     Takes a natural-language instruction and (optionally) a serialized
-    representation of the current spreadsheet, and returns:
+    representation of the current spreadsheet or an uploaded file id, and returns:
       - a friendly natural-language reply
-      - optionally, a description of actions to apply to the sheet
+      - optionally, cell updates computed by running the agent's operations
+        in a sandbox worker, and a chart
+    
+    The body may be JSON, msgpack or an Arrow IPC table (see services/wire.py);
+    send `Accept: application/msgpack` for a msgpack response.
     """
-    agent_result = await run_llm_agent(payload)
+    try:
+        payload = await run_stage(
+            "decode", decode_chat_request, await request.body(), request.headers.get("content-type", "")
+        )
+    except UnsupportedMediaType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Malformed request body: {e}")
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    
+    file_data = await _load_file(payload.file_id) if payload.file_id else None
+    try:
+        agent_result = await run_llm_agent(payload, file_data)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if accepts_msgpack(request.headers.get("accept", "")):
+        return Response(await run_stage("encode", encode_msgpack, agent_result), media_type="application/msgpack")
     return agent_result
 
 
+@router.get("/suggestions/{job_id}")
+async def get_suggestions(job_id: str, wait: float = 0):
+    """
+    Suggestions for an upload: status "pending", "done" or "failed". Pass
+    `wait` (seconds, up to 30) to hold the request until the job finishes.
+    """
+    job = await get_suggestions_job(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Suggestions job not found")
+    return job
+
+
+@router.get("/stats")
+async def get_stats():
+    """Worker pool occupancy, per-stage timings, file store, response cache, prompt size, LLM gateway, auth, query engine, SQL, index and conversation counters"""
+    return {
+        "executor": executor_stats(),
+        "store": store.stats(),
+        "handles": handles.stats(),
+        "response_cache": get_response_cache().stats(),
+        "context": context_stats(),
+        "llm": llm_stats(),
+        "compaction": compact_stats(),
+        "sandbox": sandbox_stats(),
+        "patches": patch_stats(),
+        "auth": auth_stats(),
+        "suggestions": suggestions_stats(),
+        "engine": engine_stats(),
+        "sql": sql_stats(),
+        "indexes": index_stats(),
+        "conversations": get_conversation_store().stats(),
+    }
+
+
 @router.delete("/file/{file_id}")
 async def delete_file(file_id: str):
-    """Delete a file from storage"""
-    if file_id in file_storage:
-        del file_storage[file_id]
-        return {"message": "File deleted successfully"}
-    raise HTTPException(status_code=404, detail="File not found")
+    """Delete a file handle; the data is freed when no other handle uses it"""
+    released = handles.release(file_id)
+    _patch_locks.pop(file_id, None)
+    if released is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    handle, remaining = released
+    get_conversation_store().forget_file(file_id)
+    if remaining == 0:
+        file_data = await store.get_async(handle.dataset_id)
+        await store.delete_async(handle.dataset_id)
+        if file_data is not None and file_data.get('engine') is not None:
+            delete_dataset(file_data['content_id'])
+        elif file_data is not None:
+            drop_dataset_index(file_data.get('fingerprint'))
+        # Sheets parsed on demand through this handle, and the kept workbook, go
+        # with the last handle on any sheet of the upload
+        sheets = (file_data or {}).get('sheets') or []
+        if sheets:
+            dataset_ids = [sheet_dataset_id(file_data['content_id'], i) for i in range(len(sheets))]
+            if not any(handles.count(dataset_id) for dataset_id in dataset_ids):
+                for dataset_id in dataset_ids:
+                    await store.delete_async(dataset_id)
+                get_workbook_store().delete(file_data['content_id'], file_data['file_ext'])
+    return {"message": "File deleted successfully"}
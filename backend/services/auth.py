@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import jwt
+
+from config.settings import (
+    AUTH_CACHE_SIZE,
+    AUTH_JWKS_TTL_SECONDS,
+    AUTH_PROFILE_TTL_SECONDS,
+    DATAFRAME_STORE,
+    SHARED_STORE_DIR,
+)
+from config.supabase import SUPABASE_JWT_SECRET, SUPABASE_URL, get_auth_client, get_http_client, rest_headers
+from services.logs import get_logger
+
+# Audience of Supabase user access tokens
+AUDIENCE = "authenticated"
+# An unknown key id refreshes the JWKS at most this often
+JWKS_MIN_REFRESH_SECONDS = 30.0
+
+_MISSING = object()
+
+log = get_logger("auth")
+
+
+class TokenError(Exception):
+    """Raised for an access token that is malformed, expired, signed out or not signed by the project."""
+
+
+class TTLCache:
+    """Small LRU whose entries also expire; used from the event loop only, so it takes no lock."""
+
+    def __init__(self, max_entries: int = AUTH_CACHE_SIZE, ttl_seconds: float = AUTH_PROFILE_TTL_SECONDS) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self._entries.pop(key, None)
+        self.misses += 1
+        return default
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class RevocationList:
+    """
+    Digests of tokens signed out through this server, kept until the tokens expire.
+    Kept in SQLite: in memory for a single worker, or next to the shared store so
+    a token signed out on one worker is refused by every worker.
+    """
+
+    def __init__(self, db_path: str = ":memory:") -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS revoked (digest TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def add(self, digest: str, expires_at: float) -> None:
+        now = time.time()
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._db.execute("DELETE FROM revoked WHERE expires_at <= ?", (now,))
+            self._db.execute("INSERT OR REPLACE INTO revoked (digest, expires_at) VALUES (?, ?)", (digest, expires_at))
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM revoked WHERE digest = ? AND expires_at > ?", (digest, time.time())
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM revoked WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+
+# Token digest -> claims, for tokens Supabase had to check because no local key could
+_remote_tokens = TTLCache()
+_revoked: RevocationList | None = None
+# User id -> profile name (None when the user has no profile row)
+_profiles = TTLCache()
+_jwks: dict[str, jwt.PyJWK] = {}
+_jwks_fetched_at = float("-inf")
+# The JWKS fetch in flight, awaited by every request that needs it
+_jwks_refresh: asyncio.Future | None = None
+_stats = {"local": 0, "remote": 0, "rejected": 0, "jwks_fetches": 0, "profile_fetches": 0}
+
+
+def get_revocation_list() -> RevocationList:
+    """Lazy initialization of the revocation list; shared between workers with the shared store"""
+    global _revoked
+    if _revoked is None:
+        if DATAFRAME_STORE == "shared":
+            os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+            _revoked = RevocationList(os.path.join(SHARED_STORE_DIR, "revoked.sqlite"))
+        else:
+            _revoked = RevocationList()
+    return _revoked
+
+
+def _digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _seconds_left(claims: dict[str, Any]) -> float:
+    return float(claims.get("exp", 0)) - time.time()
+
+
+async def _refresh_jwks() -> None:
+    global _jwks, _jwks_fetched_at
+    _jwks_fetched_at = time.monotonic()
+    _stats["jwks_fetches"] += 1
+    try:
+        response = await get_http_client().get(f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json")
+        response.raise_for_status()
+        keys = response.json().get("keys", [])
+    except Exception as e:
+        log.warning(f"Could not fetch the Supabase JWKS: {e}")
+        return
+    jwks = {}
+    for data in keys:
+        try:
+            key = jwt.PyJWK(data)
+        except (jwt.PyJWKError, jwt.InvalidKeyError) as e:
+            # RSA and EC keys need PyJWT's crypto extra (cryptography)
+            log.warning(f"Skipping Supabase signing key {data.get('kid')}: {e}")
+            continue
+        jwks[data.get("kid", "")] = key
+    _jwks = jwks
+
+
+async def _signing_key(header: dict[str, Any]) -> tuple[Any, str] | None:
+    """Key and algorithm to check a token with locally, or None to ask Supabase"""
+    algorithm = header.get("alg", "")
+    if algorithm == "HS256" and SUPABASE_JWT_SECRET:
+        return SUPABASE_JWT_SECRET, algorithm
+    if not SUPABASE_URL or algorithm == "HS256":
+        return None
+    global _jwks_refresh
+    kid = header.get("kid", "")
+    if _jwks_refresh is None or _jwks_refresh.done():
+        age = time.monotonic() - _jwks_fetched_at
+        if age > AUTH_JWKS_TTL_SECONDS or (kid not in _jwks and age > JWKS_MIN_REFRESH_SECONDS):
+            _jwks_refresh = asyncio.ensure_future(_refresh_jwks())
+    if _jwks_refresh is not None and not _jwks_refresh.done():
+        await asyncio.shield(_jwks_refresh)
+    key = _jwks.get(kid)
+    return (key.key, key.algorithm_name) if key is not None else None
+
+
+async def verify_access_token(token: str) -> dict[str, Any]:
+    """
+    Claims of a valid user access token. The signature is checked locally with the
+    JWT secret or the project's cached JWKS; only when neither has the key is
+    Supabase asked, and its answer is cached until the token expires.
+    """
+    digest = _digest(token)
+    if digest in get_revocation_list():
+        _stats["rejected"] += 1
+        raise TokenError("Token has been signed out")
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError as e:
+        _stats["rejected"] += 1
+        raise TokenError(f"Malformed token: {e}")
+
+    signing_key = await _signing_key(header)
+    if signing_key is not None:
+        key, algorithm = signing_key
+        try:
+            claims = jwt.decode(token, key, algorithms=[algorithm], audience=AUDIENCE)
+        except jwt.PyJWTError as e:
+            _stats["rejected"] += 1
+            raise TokenError(str(e))
+        _stats["local"] += 1
+        return claims
+
+    claims = _remote_tokens.get(digest)
+    if claims is not None:
+        return claims
+    _stats["remote"] += 1
+    try:
+        response = await get_auth_client().get_user(token)
+    except Exception as e:
+        _stats["rejected"] += 1
+        raise TokenError(str(e))
+    if response is None or response.user is None:
+        _stats["rejected"] += 1
+        raise TokenError("Invalid or expired token")
+    user = response.user
+    claims = {
+        "sub": user.id,
+        "email": user.email,
+        "user_metadata": user.user_metadata,
+        "exp": jwt.decode(token, options={"verify_signature": False}).get("exp", 0),
+    }
+    _remote_tokens.set(digest, claims, ttl_seconds=_seconds_left(claims))
+    return claims
+
+
+async def revoke_token(token: str) -> None:
+    """Sign a token out with Supabase and stop accepting it here before it expires"""
+    await get_auth_client().admin.sign_out(token)
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp", 0)
+    except jwt.PyJWTError:
+        return
+    get_revocation_list().add(_digest(token), float(exp))
+    _remote_tokens.pop(_digest(token))
+
+
+async def get_profile_name(user_id: str, access_token: str | None = None) -> str | None:
+    """The user's name from user_profiles, cached for AUTH_PROFILE_TTL_SECONDS"""
+    name = _profiles.get(user_id, _MISSING)
+    if name is not _MISSING:
+        return name
+    _stats["profile_fetches"] += 1
+    response = await get_http_client().get(
+        f"{SUPABASE_URL}/rest/v1/user_profiles",
+        params={"select": "name", "id": f"eq.{user_id}"},
+        headers=rest_headers(access_token),
+    )
+    response.raise_for_status()
+    rows = response.json()
+    name = rows[0].get("name") if rows else None
+    _profiles.set(user_id, name)
+    return name
+
+
+def auth_stats() -> dict[str, Any]:
+    return {
+        **_stats,
+        "local_keys": "secret" if SUPABASE_JWT_SECRET else len(_jwks),
+        "token_cache": _remote_tokens.stats(),
+        "revoked": len(get_revocation_list()),
+        "profile_cache": _profiles.stats(),
+    }
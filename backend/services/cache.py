@@ -0,0 +1,147 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import pandas as pd
+
+from config.settings import RESPONSE_CACHE_DB, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS
+
+# Expired rows are deleted from the SQLite tier once every this many writes
+PRUNE_EVERY_WRITES = 100
+
+
+def dataset_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Content hash of a DataFrame: column names, dtypes and every cell value.
+    Two uploads with identical data get the same fingerprint.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(repr([str(t) for t in df.dtypes]).encode())
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # Unhashable cells (lists, dicts) are hashed by their string form
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    digest.update(row_hashes.values.tobytes())
+    return digest.hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial rephrasings share a cache entry"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" ?.!")
+
+
+def response_cache_key(fingerprint: str, query: str, mode: str, model: str) -> str:
+    raw = "\x1f".join([fingerprint, normalize_query(query), mode, model])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM answers: an in-memory LRU in front of an optional
+    SQLite table that survives restarts and is shared by workers on the same box.
+    Expired rows are deleted from the table every PRUNE_EVERY_WRITES writes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        db_path: str = RESPONSE_CACHE_DB,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.pruned = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _expiry(self) -> float:
+        return time.time() + self.ttl_seconds if self.ttl_seconds > 0 else float('inf')
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = self._expiry()
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                if self.stores % PRUNE_EVERY_WRITES == 0:
+                    self.pruned += self._db.execute(
+                        "DELETE FROM responses WHERE expires_at <= ?", (time.time(),)
+                    ).rowcount
+            self.stores += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_tier": bool(self._db),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "pruned": self.pruned,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+_response_cache: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Lazy initialization of the shared response cache"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -0,0 +1,386 @@
+import math
+import re
+import warnings
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pandas as pd
+
+from config.settings import CHART_DOWNSAMPLE, CHART_MAX_POINTS
+from services.planner import GROUP_PREFIX, as_numeric, mentioned_columns
+
+if TYPE_CHECKING:
+    from services.indexes import DatasetIndex
+    from services.profile import DatasetProfile
+
+# A chart spec is what the LLM (or suggest_chart_spec) picks; the data itself is computed here:
+# {
+#   "chartType": "bar" | "line" | "pie" | "area" | "radar",
+#   "x": "<column>", "y": "<numeric column>" | null,
+#   "agg": "sum" | "mean" | "median" | "min" | "max" | "count" | "none",
+#   "title": "...", "description": "...", "xAxisLabel": "...", "yAxisLabel": "..."
+# }
+CHART_TYPES = {"bar", "line", "pie", "area", "radar"}
+CHART_AGGREGATIONS = {"sum", "mean", "median", "min", "max", "count", "none"}
+MAX_PIE_SLICES = 10
+MAX_RADAR_AXES = 12
+
+_CHART_KEYWORDS = [
+    ("pie", r"\b(pie|donut|doughnut)\b"),
+    ("line", r"\b(line|trend|over time|timeline)\b"),
+    ("area", r"\barea\b"),
+    ("radar", r"\b(radar|spider)\b"),
+    ("bar", r"\b(bar|column|histogram)\b"),
+]
+_AGG_KEYWORDS = [
+    ("mean", r"\b(average|avg|mean)\b"),
+    ("median", r"\bmedian\b"),
+    ("max", r"\b(max|maximum|highest)\b"),
+    ("min", r"\b(min|minimum|lowest)\b"),
+    ("count", r"\b(count|number of|how many|distribution)\b"),
+    ("sum", r"\b(total|sum)\b"),
+]
+TIME_UNITS = [("D", "day"), ("W", "week"), ("M", "month"), ("Q", "quarter"), ("Y", "year")]
+
+
+class ChartError(ValueError):
+    """Raised when a chart spec cannot be computed from the data."""
+
+
+def as_datetime(series: pd.Series) -> pd.Series | None:
+    """Datetime view of a column, parsing text dates when nearly all values parse; otherwise None."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+        return None
+    sample = series.dropna().head(200).astype(str)
+    if sample.empty or not sample.str.contains(r"[-/:]").mean() >= 0.9:
+        return None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if pd.to_datetime(sample, errors="coerce", format="mixed").notna().mean() < 0.9:
+            return None
+        return pd.to_datetime(series, errors="coerce", format="mixed")
+
+
+def column_kind(series: pd.Series) -> str:
+    if as_numeric(series) is not None:
+        return "numeric"
+    if as_datetime(series) is not None:
+        return "date"
+    return "category"
+
+
+def _kinds(df: pd.DataFrame, profile: "DatasetProfile | None") -> dict[Any, str]:
+    if profile is not None:
+        return {col: profile.kind(col) or column_kind(df[col]) for col in df.columns}
+    return {col: column_kind(df[col]) for col in df.columns}
+
+
+def chart_schema(df: pd.DataFrame, max_columns: int = 200, profile: "DatasetProfile | None" = None) -> str:
+    """
+    Compact column description for the chart-spec prompt: name, kind, distinct
+    count and a few example values. Size depends on column count, not row count.
+    Pre-rendered from the upload's profile when given.
+    """
+    if profile is not None:
+        return profile.chart_schema(max_columns)
+    lines = []
+    for col in list(df.columns)[:max_columns]:
+        series = df[col]
+        examples = ", ".join(str(v) for v in series.dropna().unique()[:3])
+        lines.append(f"- {col} ({column_kind(series)}, {series.nunique()} distinct): {examples}")
+    if len(df.columns) > max_columns:
+        lines.append(f"- ... {len(df.columns) - max_columns} more columns")
+    return "\n".join(lines)
+
+
+def suggest_chart_spec(query: str, df: pd.DataFrame, profile: "DatasetProfile | None" = None) -> dict[str, Any]:
+    """Rule-based chart spec from the wording of the request and the column types."""
+    q = query.lower()
+    chart_type = next((name for name, pattern in _CHART_KEYWORDS if re.search(pattern, q)), "bar")
+    agg = next((name for name, pattern in _AGG_KEYWORDS if re.search(pattern, q)), None)
+
+    mentions = mentioned_columns(q, df)
+    kinds = _kinds(df, profile)
+    numeric = [col for col, _, _ in mentions if kinds[col] == "numeric"]
+    # Columns introduced by "by/per/each" are the x-axis; others are what is being plotted
+    grouped = [col for col, start, _ in mentions if kinds[col] != "numeric" and GROUP_PREFIX.search(q[:start])]
+    others = grouped + [col for col, _, _ in mentions if kinds[col] != "numeric" and col not in grouped]
+    # "employees by department": the plotted thing is an entity column, so count rows
+    if not numeric and any(df[col].is_unique for col in others[1:]):
+        agg = "count"
+
+    if re.search(r"\b(histogram|distribution)\b", q) and numeric and not grouped:
+        x, y, agg = numeric[0], None, "count"
+    else:
+        if not others:
+            # Prefer a date axis for trends, otherwise the lowest-cardinality category
+            dates = [col for col in df.columns if kinds[col] == "date"]
+            categories = sorted(
+                (col for col in df.columns if kinds[col] == "category"), key=lambda col: df[col].nunique()
+            )
+            if chart_type in ("line", "area") and dates:
+                others = dates[:1]
+            elif categories:
+                others = categories[:1]
+        if not numeric and agg != "count":
+            numeric = [col for col in df.columns if kinds[col] == "numeric"][:1]
+
+        if others:
+            x = others[0]
+            y = numeric[0] if numeric and agg != "count" else None
+        elif numeric:
+            # Only numeric columns: histogram of the first one
+            x, y, agg = numeric[0], None, "count"
+        else:
+            raise ChartError("No columns suitable for a chart")
+
+    if y is None:
+        agg = "count"
+    elif agg is None:
+        agg = "none" if df[x].nunique() == len(df) else "sum"
+
+    y_label = f"{agg.title()} of {y}" if y is not None and agg not in ("none", "count") else (y or "Count")
+    return {
+        "chartType": chart_type,
+        "x": x,
+        "y": y,
+        "agg": agg,
+        "title": f"{y_label} by {x}",
+        "description": f"{y_label} for each {x}",
+        "xAxisLabel": str(x),
+        "yAxisLabel": str(y_label),
+    }
+
+
+def validate_chart_spec(spec: Any, df: pd.DataFrame, index: "DatasetIndex | None" = None) -> dict[str, Any]:
+    """Check a (possibly LLM-written) chart spec against the DataFrame and normalize it."""
+    if not isinstance(spec, dict):
+        raise ChartError("Chart spec must be an object")
+    columns = {str(c): c for c in df.columns}
+    if str(spec.get("x")) not in columns:
+        raise ChartError(f"Unknown x column: {spec.get('x')!r}")
+    x = columns[str(spec["x"])]
+    y = spec.get("y")
+    if y is not None:
+        if str(y) not in columns:
+            raise ChartError(f"Unknown y column: {y!r}")
+        y = columns[str(y)]
+        if (index.numeric(df, y) if index is not None else as_numeric(df[y])) is None:
+            raise ChartError(f"y column {y!r} is not numeric")
+    agg = spec.get("agg") or ("sum" if y is not None else "count")
+    if agg not in CHART_AGGREGATIONS:
+        raise ChartError(f"Unknown aggregation: {agg!r}")
+    if y is None:
+        agg = "count"
+    chart_type = spec.get("chartType") if spec.get("chartType") in CHART_TYPES else "bar"
+    return {**spec, "chartType": chart_type, "x": x, "y": y, "agg": agg}
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the
+    points to keep; the first and last points are always kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        areas = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        keep[i + 1] = a
+    return keep
+
+
+def minmax_downsample(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Keep the min and max of each of n_out / 2 equal-width buckets; indices in order."""
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    buckets = np.array_split(np.arange(n), max(1, n_out // 2))
+    keep = set()
+    for idx in buckets:
+        if len(idx):
+            keep.add(int(idx[np.argmin(y[idx])]))
+            keep.add(int(idx[np.argmax(y[idx])]))
+    return np.array(sorted(keep))
+
+
+def _downsample(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    if CHART_DOWNSAMPLE == "minmax":
+        return minmax_downsample(y, n_out)
+    return lttb(x, y, n_out)
+
+
+def points(names: pd.Index | pd.Series, values: pd.Series) -> list[dict[str, Any]]:
+    """Chart points for the non-missing values"""
+    data = []
+    for name, value in zip(names, values):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            continue
+        data.append({"name": str(name), "value": round(float(value), 4)})
+    return data
+
+
+def _aggregate(values: pd.Series | None, keys: pd.Series, agg: str) -> pd.Series:
+    if values is None or agg == "count":
+        return keys.groupby(keys, observed=True).size()
+    return values.groupby(keys, observed=True).agg("sum" if agg == "none" else agg)
+
+
+def time_unit(span_days: int, max_points: int) -> str:
+    """Finest period (pandas frequency) that splits `span_days` into at most max_points buckets"""
+    for freq, _ in TIME_UNITS:
+        buckets = {"D": span_days, "W": span_days / 7, "M": span_days / 30, "Q": span_days / 91, "Y": span_days / 365}[freq]
+        if buckets <= max_points:
+            return freq
+    return "Y"
+
+
+def compute_chart(
+    df: pd.DataFrame,
+    spec: dict[str, Any],
+    max_points: int = CHART_MAX_POINTS,
+    profile: "DatasetProfile | None" = None,
+    index: "DatasetIndex | None" = None,
+) -> dict[str, Any]:
+    """
+    Compute the chart series for a validated spec with vectorized pandas and
+    downsample it to at most max_points. With the dataset's `index`, converted
+    columns and per-group aggregates are reused across charts.
+    Blocking; run it on the worker pool.
+    """
+    spec = validate_chart_spec(spec, df, index)
+    x, y, agg, chart_type = spec["x"], spec["y"], spec["agg"], spec["chartType"]
+    if y is None:
+        values = None
+    else:
+        values = index.numeric(df, y) if index is not None else as_numeric(df[y])
+    notes = []
+    max_points = points_limit(chart_type, max_points)
+
+    kind = (profile.kind(x) if profile is not None else None) or column_kind(df[x])
+    if kind == "date":
+        dates = index.datetimes(df, x) if index is not None else as_datetime(df[x])
+        valid = dates.notna()
+        freq = time_unit((dates[valid].max() - dates[valid].min()).days + 1, max_points)
+        series = index.group_aggregate(df, x, y, agg, freq) if index is not None else None
+        if series is None:
+            periods = dates[valid].dt.to_period(freq)
+            series = _aggregate(values[valid] if values is not None else None, periods, agg)
+        series = series.sort_index()
+        unit = dict(TIME_UNITS)[freq]
+        notes.append(f"Grouped by {unit}.")
+        if len(series) > max_points:
+            series = series.iloc[-max_points:]
+            notes.append(f"Showing the most recent {max_points} {unit}s.")
+        data = points(series.index, series)
+
+    elif kind == "numeric" and (agg == "none" or values is None) and df[x].nunique() > max_points:
+        x_values = as_numeric(df[x])
+        if values is None:
+            # Histogram of x
+            bins = min(max_points, 30)
+            counts, edges = np.histogram(x_values.dropna(), bins=bins)
+            names = [f"{edges[i]:,.4g}–{edges[i + 1]:,.4g}" for i in range(len(counts))]
+            data = points(pd.Index(names), pd.Series(counts, dtype=float))
+            notes.append(f"Values binned into {bins} equal-width ranges.")
+        else:
+            # Raw y against numeric x, sorted by x and downsampled
+            frame = pd.DataFrame({"x": x_values, "y": values}).dropna().sort_values("x")
+            keep = _downsample(frame["x"].to_numpy(float), frame["y"].to_numpy(float), max_points)
+            sampled = frame.iloc[keep]
+            data = points(sampled["x"].map(lambda v: f"{v:,.6g}"), sampled["y"])
+            if len(frame) > max_points:
+                notes.append(f"Downsampled from {len(frame)} to {len(sampled)} points ({CHART_DOWNSAMPLE}).")
+
+    elif agg == "none" and df[x].is_unique:
+        # One point per row, e.g. salary per employee
+        frame = pd.DataFrame({"x": df[x], "y": values}).dropna()
+        if len(frame) > max_points:
+            if chart_type in ("line", "area"):
+                keep = _downsample(np.arange(len(frame), dtype=float), frame["y"].to_numpy(float), max_points)
+                frame = frame.iloc[keep]
+                notes.append(f"Downsampled from {len(df)} rows to {len(frame)} points ({CHART_DOWNSAMPLE}).")
+            else:
+                frame = frame.nlargest(max_points, "y")
+                notes.append(f"Showing the top {max_points} of {len(df)} rows by {y}.")
+        elif chart_type in ("bar", "pie", "radar"):
+            frame = frame.sort_values("y", ascending=False)
+        data = points(frame["x"], frame["y"])
+
+    else:
+        keys = as_numeric(df[x]) if kind == "numeric" else df[x]
+        if kind == "numeric" and keys.nunique() > max_points:
+            keys = pd.cut(keys, bins=max_points)
+            notes.append(f"{x} binned into {max_points} ranges.")
+        series = index.group_aggregate(df, x, y, agg) if index is not None and kind != "numeric" else None
+        if series is None:
+            series = _aggregate(values, keys, agg)
+        if kind == "numeric":
+            series = series.sort_index()
+        else:
+            series = series.sort_values(ascending=False)
+        if len(series) > max_points:
+            head, tail = series.iloc[:max_points - 1], series.iloc[max_points - 1:]
+            if agg in ("sum", "count", "none"):
+                series = pd.concat([head, pd.Series([tail.sum()], index=["Other"])])
+                notes.append(f"{len(tail)} smaller groups combined into Other.")
+            else:
+                series = head
+                notes.append(f"Showing the top {len(head)} of {len(head) + len(tail)} groups.")
+        data = points(series.index, series)
+
+    return chart_payload(spec, data, notes, len(df))
+
+
+def points_limit(chart_type: str, max_points: int) -> int:
+    if chart_type == "pie":
+        return min(max_points, MAX_PIE_SLICES)
+    if chart_type == "radar":
+        return min(max_points, MAX_RADAR_AXES)
+    return max_points
+
+
+def chart_payload(spec: dict[str, Any], data: list[dict[str, Any]], notes: list[str], rows: int) -> dict[str, Any]:
+    """The chart JSON for the frontend, from a validated spec and its computed points"""
+    if not data:
+        raise ChartError("The selected columns contain no chartable values")
+    x, y, agg = spec["x"], spec["y"], spec["agg"]
+    return {
+        "type": "chart",
+        "chartType": spec["chartType"],
+        "title": spec.get("title") or f"{spec.get('yAxisLabel') or y or 'Count'} by {x}",
+        "description": " ".join(filter(None, [spec.get("description"), *notes])),
+        "xAxisLabel": spec.get("xAxisLabel") or str(x),
+        "yAxisLabel": spec.get("yAxisLabel") or (str(y) if y is not None else "Count"),
+        "data": data,
+        "insights": chart_insights(data, spec.get("yAxisLabel") or (str(y) if y is not None else "Count"), agg),
+        "meta": {"rows": rows, "points": len(data), "x": str(x), "y": None if y is None else str(y), "agg": agg},
+    }
+
+
+def chart_insights(data: list[dict[str, Any]], label: str, agg: str) -> list[str]:
+    """Deterministic highlights for the computed series."""
+    values = np.array([point["value"] for point in data], dtype=float)
+    top, bottom = data[int(values.argmax())], data[int(values.argmin())]
+    insights = [
+        f"Highest {label}: {top['name']} at {top['value']:,.2f}",
+        f"Lowest {label}: {bottom['name']} at {bottom['value']:,.2f}",
+        f"Average across {len(data)} points: {values.mean():,.2f}",
+    ]
+    total = values.sum()
+    # Shares only make sense for additive series
+    if agg in ("sum", "count", "none") and len(data) > 1 and total > 0 and (values >= 0).all():
+        insights.append(f"{top['name']} accounts for {top['value'] / total:.1%} of the total")
+    return insights
@@ -0,0 +1,255 @@
+import difflib
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+import pandas as pd
+
+from config.settings import CONTEXT_TOKEN_BUDGET
+from services.planner import as_numeric, mentioned_columns
+
+if TYPE_CHECKING:
+    from services.profile import DatasetProfile
+
+try:
+    import tiktoken
+except ImportError:  # falls back to a characters-per-token estimate
+    tiktoken = None
+
+# Columns whose name scores below this similarity to every word of the question
+# are only included while there is budget left
+MIN_COLUMN_SIMILARITY = 0.6
+# Share of the budget reserved for column profiles; rows get the rest
+PROFILE_BUDGET_SHARE = 0.35
+SAMPLE_SEED = 7
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count for gpt-4o prompts; approximated as chars / 4 without tiktoken."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class PromptContext:
+    text: str
+    tokens: int
+    budget: int
+    columns: list[str]
+    rows_shown: int
+    total_rows: int
+    omitted_columns: list[str] = field(default_factory=list)
+
+    @property
+    def sampled(self) -> bool:
+        return self.rows_shown < self.total_rows
+
+
+def rank_columns(query: str, df: pd.DataFrame) -> list[tuple[Any, float]]:
+    """
+    Columns ordered by relevance to the question: columns named in it first,
+    then by fuzzy similarity between the question's words and the column name.
+    """
+    q = query.lower()
+    named = {col: 2.0 for col, _, _ in mentioned_columns(q, df)}
+    words = re.findall(r"[a-z0-9]+", q)
+    scored = []
+    for position, col in enumerate(df.columns):
+        score = named.get(col, 0.0)
+        if not score and words:
+            parts = re.findall(r"[a-z0-9]+", str(col).lower()) or [str(col).lower()]
+            score = max(difflib.SequenceMatcher(None, w, p).ratio() for w in words for p in parts)
+        # Stable tiebreak on original column order
+        scored.append((col, score, -position))
+    scored.sort(key=lambda item: (item[1], item[2]), reverse=True)
+    return [(col, score) for col, score, _ in scored]
+
+
+def format_number(value: float) -> str:
+    """Readable number for prompts: 86,250 or 0.4993 rather than 8.625e+04."""
+    if pd.isna(value):
+        return "n/a"
+    if value != 0 and (abs(value) >= 1e15 or abs(value) < 1e-3):
+        return f"{value:.4g}"
+    text = f"{value:,.4f}" if abs(value) < 1 else f"{value:,.2f}"
+    return text.rstrip("0").rstrip(".")
+
+
+def column_profile(series: pd.Series) -> str:
+    """One-line profile of a column computed over all rows."""
+    nulls = int(series.isna().sum())
+    parts = [str(series.dtype), f"{series.nunique()} distinct"]
+    if nulls:
+        parts.append(f"{nulls} null")
+    numeric = as_numeric(series)
+    if numeric is not None and numeric.notna().any():
+        parts.append(
+            f"min {format_number(numeric.min())}, mean {format_number(numeric.mean())}, "
+            f"median {format_number(numeric.median())}, max {format_number(numeric.max())}, "
+            f"sum {format_number(numeric.sum())}"
+        )
+    else:
+        top = series.value_counts().head(5)
+        if len(top):
+            parts.append("top: " + ", ".join(f"{value} ({count})" for value, count in top.items()))
+    return f"- {series.name}: " + "; ".join(parts)
+
+
+def sample_rows(df: pd.DataFrame, n: int, ranked: list[Any], profile: "DatasetProfile | None" = None) -> pd.DataFrame:
+    """
+    Representative rows: the top and bottom rows by the most relevant numeric
+    column, then a sample stratified by the most relevant low-cardinality
+    column, topped up with a seeded random sample. Original order is kept.
+    """
+    if n >= len(df):
+        return df
+
+    def is_numeric(col: Any) -> bool:
+        if profile is not None and profile.column(col) is not None:
+            return profile.kind(col) == "numeric"
+        return as_numeric(df[col]) is not None
+
+    def distinct(col: Any) -> int:
+        if profile is not None and profile.column(col) is not None:
+            return profile.column(col).distinct
+        return df[col].nunique()
+
+    picked: list[Any] = []
+    numeric = next((col for col in ranked if is_numeric(col)), None)
+    if numeric is not None and n >= 4:
+        values = as_numeric(df[numeric])
+        k = max(1, n // 10)
+        picked.extend(values.nlargest(k).index)
+        picked.extend(values.nsmallest(k).index)
+
+    strata = next(
+        (col for col in ranked if not is_numeric(col) and 1 < distinct(col) <= max(2, n // 2)),
+        None,
+    )
+    remaining = n - len(set(picked))
+    if strata is not None and remaining > 0:
+        shares = df[strata].value_counts(normalize=True)
+        for value, share in shares.items():
+            group = df.index[df[strata] == value]
+            take = min(len(group), max(1, round(share * remaining)))
+            picked.extend(pd.Series(group).sample(take, random_state=SAMPLE_SEED))
+
+    picked = list(dict.fromkeys(picked))[:n]
+    if len(picked) < n:
+        rest = df.index.difference(picked)
+        picked.extend(pd.Series(rest).sample(min(len(rest), n - len(picked)), random_state=SAMPLE_SEED))
+    return df.loc[sorted(picked, key=df.index.get_loc)]
+
+
+def _render_rows(df: pd.DataFrame, columns: list[Any]) -> str:
+    # Rows keep the sheet's column order even though profiles are ranked by relevance
+    selected = set(columns)
+    return df[[col for col in df.columns if col in selected]].to_csv(index=False).strip()
+
+
+def build_prompt_context(
+    df: pd.DataFrame,
+    query: str,
+    file_info: dict,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> PromptContext:
+    """
+    Render the data context for analysis mode within a token budget:
+    file header, profiles of the columns relevant to the question, and as many
+    representative rows as fit, as compact CSV. Column profiles are taken
+    pre-rendered from the upload's DatasetProfile when file_info has one.
+    `df` may itself be a sample (see services/engine.py); file_info's row_count
+    is then the size of the whole dataset.
+    Blocking; run it on the worker pool.
+    """
+    profile = file_info.get('profile')
+    total_rows = max(len(df), file_info.get('row_count') or 0)
+    header = (
+        f"FILE: {file_info['filename']}\n"
+        f"SHAPE: {total_rows} rows × {len(df.columns)} columns\n"
+    )
+    ranked = rank_columns(query, df)
+
+    # Column profiles, most relevant first, until the profile share of the budget is used
+    profile_budget = int(budget * PROFILE_BUDGET_SHARE)
+    profiles, columns, used = [], [], count_tokens(header)
+    for col, score in ranked:
+        stored = profile.column(col) if profile is not None else None
+        line = stored.prompt_line if stored is not None else column_profile(df[col])
+        cost = count_tokens(line) + 1
+        if columns and (used + cost > profile_budget or (score < MIN_COLUMN_SIMILARITY and len(columns) >= 30)):
+            break
+        profiles.append(line)
+        columns.append(col)
+        used += cost
+    omitted = [str(col) for col, _ in ranked[len(columns):]]
+
+    profile_text = "\n".join(profiles)
+    if omitted:
+        shown = ", ".join(omitted[:50]) + (" ..." if len(omitted) > 50 else "")
+        profile_text += f"\n(Other columns not profiled: {shown})"
+
+    # Rows: estimate the per-row cost from a small rendering, then shrink until it fits
+    row_budget = budget - count_tokens(header + profile_text) - 50
+    probe = _render_rows(df.head(20), columns).split("\n")
+    per_row = max(1, count_tokens("\n".join(probe[1:])) // max(1, len(probe) - 1))
+    n_rows = max(0, min(len(df), (row_budget - count_tokens(probe[0])) // per_row))
+    rows = sample_rows(df, n_rows, [col for col, _ in ranked], profile)
+    rows_text = _render_rows(rows, columns)
+    while n_rows > 0 and count_tokens(rows_text) > row_budget:
+        n_rows = int(n_rows * 0.8)
+        rows = sample_rows(df, n_rows, [col for col, _ in ranked], profile)
+        rows_text = _render_rows(rows, columns)
+
+    rows_label = (
+        f"ALL {total_rows} ROWS" if n_rows >= total_rows
+        else f"REPRESENTATIVE SAMPLE OF {n_rows} OF {total_rows} ROWS (includes highest/lowest values)"
+    )
+    text = f"""
+{header}
+COLUMN PROFILES (computed over all {total_rows} rows):
+{profile_text}
+
+DATA ({rows_label}, CSV):
+{rows_text}
+"""
+    return PromptContext(
+        text=text,
+        tokens=count_tokens(text),
+        budget=budget,
+        columns=[str(c) for c in columns],
+        rows_shown=n_rows,
+        total_rows=total_rows,
+        omitted_columns=omitted,
+    )
+
+
+_context_stats = {"count": 0, "total_tokens": 0, "max_tokens": 0, "last_tokens": 0, "sampled": 0}
+
+
+def record_context(context: PromptContext) -> None:
+    _context_stats["count"] += 1
+    _context_stats["total_tokens"] += context.tokens
+    _context_stats["max_tokens"] = max(_context_stats["max_tokens"], context.tokens)
+    _context_stats["last_tokens"] = context.tokens
+    _context_stats["sampled"] += int(context.sampled)
+
+
+def context_stats() -> dict[str, Any]:
+    """Token usage of the prompt contexts built so far"""
+    count = _context_stats["count"]
+    return {
+        "budget": CONTEXT_TOKEN_BUDGET,
+        "tokenizer": "tiktoken" if tiktoken is not None else "chars/4",
+        "contexts": count,
+        "avg_tokens": round(_context_stats["total_tokens"] / count, 1) if count else 0.0,
+        "max_tokens": _context_stats["max_tokens"],
+        "last_tokens": _context_stats["last_tokens"],
+        "sampled": _context_stats["sampled"],
+    }
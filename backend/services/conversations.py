@@ -0,0 +1,220 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from config.settings import (
+    CONVERSATION_ANSWER_TOKENS,
+    CONVERSATION_MAX,
+    CONVERSATION_SUMMARY_TOKENS,
+    CONVERSATION_TTL_SECONDS,
+    CONVERSATION_TURNS,
+    CONVERSATIONS,
+)
+from services.context import count_tokens
+from services.planner import mentions_data
+
+ENABLED = CONVERSATIONS == "on"
+# Words that point back at earlier turns: "what is their average salary?", "show them by region"
+_BACK_REFERENCE = re.compile(
+    r"\b(it|its|they|them|their|theirs|those|these|same|instead|previous|above|earlier|again|else|others|rest)\b"
+)
+# Openings that continue the last question: "and the median?", "what about Sales?"
+_CONTINUATION = re.compile(r"^\s*(and|but|or|also|so|then|now|what about|how about|compare|why)\b")
+
+
+@dataclass
+class Turn:
+    question: str
+    # The answer as later prompts see it: a report's title and summary, or a chart's title
+    answer: str
+
+
+@dataclass
+class Conversation:
+    """
+    One user's questions about one file. The data context is rendered once and
+    reused word for word as the prompt prefix, so the provider can serve it from
+    its prompt cache; only the history and the new question change per turn.
+    """
+
+    user_id: str
+    file_id: str
+    fingerprint: str | None = None
+    context: str | None = None
+    summary: str = ""
+    turns: list[Turn] = field(default_factory=list)
+    # Turns that left the window and are not yet folded into the summary
+    pending: list[Turn] = field(default_factory=list)
+    summarizing: bool = False
+    updated: float = field(default_factory=time.time)
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.summary or self.pending or self.turns)
+
+    def set_context(self, fingerprint: str | None, context: str) -> None:
+        self.fingerprint, self.context = fingerprint, context
+
+    def add_turn(self, question: str, answer: str) -> None:
+        self.turns.append(Turn(question, compact_answer(answer)))
+        self.updated = time.time()
+        while len(self.turns) > CONVERSATION_TURNS:
+            self.pending.append(self.turns.pop(0))
+
+    def history_messages(self) -> list[dict[str, Any]]:
+        """Summary of older turns, then the recent turns as user/assistant messages"""
+        messages = []
+        if self.summary:
+            messages.append({"role": "user", "content": f"EARLIER IN THIS CONVERSATION (summary):\n{self.summary}"})
+        for turn in [*self.pending, *self.turns]:
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.answer})
+        return messages
+
+
+def _truncate(text: str, tokens: int) -> str:
+    if count_tokens(text) <= tokens:
+        return text
+    return text[:tokens * 4].rsplit(" ", 1)[0] + " ..."
+
+
+def compact_answer(answer: str) -> str:
+    """
+    What a past answer contributes to later prompts: a chart's title, or a
+    report's heading and Summary section, cut to CONVERSATION_ANSWER_TOKENS.
+    """
+    text = answer.strip()
+    if text.startswith("{"):
+        try:
+            chart = json.loads(text)
+        except ValueError:
+            chart = None
+        if isinstance(chart, dict):
+            if chart.get("type") == "error":
+                return f"(No chart: {chart.get('message', '')})"
+            return f"(Showed a {chart.get('chartType', 'chart')} chart: {chart.get('title', '')})"
+    lines = text.splitlines()
+    title = next((line for line in lines if line.startswith("#")), "")
+    summary: list[str] = []
+    for i, line in enumerate(lines):
+        if line.lstrip("# ").strip().lower() == "summary":
+            for following in lines[i + 1:]:
+                if following.startswith("#"):
+                    break
+                summary.append(following)
+            break
+    compact = "\n".join([title, *summary]).strip() if summary else text
+    return _truncate(compact, CONVERSATION_ANSWER_TOKENS)
+
+
+def digest_turns(summary: str, turns: list[Turn]) -> str:
+    """Rolling summary without a model: one line per turn, oldest dropped past CONVERSATION_SUMMARY_TOKENS"""
+    lines = [line for line in summary.splitlines() if line]
+    for turn in turns:
+        answer = next((line.lstrip("# ") for line in turn.answer.splitlines() if line.strip()), "")
+        lines.append(_truncate(f"- Asked: {turn.question} -> {answer}", 80))
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > CONVERSATION_SUMMARY_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def refers_back(query: str, df: Any, profile: Any = None) -> bool:
+    """
+    Whether a question depends on earlier turns: it points back at them ("their",
+    "those", "what about ..."), or it names no column or value of the data on its
+    own ("and the median?"). Other questions are answered as if asked first, so
+    they still use the response cache and the local planners.
+    """
+    q = query.lower()
+    if _BACK_REFERENCE.search(q) or _CONTINUATION.search(q):
+        return True
+    return not mentions_data(q, df, profile)
+
+
+class ConversationStore:
+    """
+    Conversations by (user_id, file_id): an in-memory LRU of at most
+    CONVERSATION_MAX entries, dropped after CONVERSATION_TTL_SECONDS unused.
+    Each worker process keeps its own, so with WEB_CONCURRENCY > 1 a user's
+    requests must reach the same worker (sticky sessions) to keep the history.
+    """
+
+    def __init__(self, max_entries: int = CONVERSATION_MAX, ttl_seconds: float = CONVERSATION_TTL_SECONDS) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple[str, str], Conversation] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "started": 0, "turns": 0, "follow_ups": 0, "summaries": 0, "summary_failures": 0, "evictions": 0,
+            "prompt_tokens": 0, "cached_tokens": 0, "llm_turns": 0,
+        }
+
+    def get(self, user_id: str, file_id: str, new: bool = False) -> Conversation:
+        """The conversation for this user and file, started fresh when `new` or when none is kept"""
+        key = (user_id, file_id)
+        now = time.time()
+        with self._lock:
+            conversation = None if new else self._entries.get(key)
+            if conversation is not None and self.ttl_seconds > 0 and now - conversation.updated > self.ttl_seconds:
+                conversation = None
+            if conversation is None:
+                conversation = Conversation(user_id=user_id, file_id=file_id)
+                self._entries[key] = conversation
+                self._stats["started"] += 1
+            conversation.updated = now
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            return conversation
+
+    def forget_file(self, file_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == file_id]:
+                del self._entries[key]
+
+    def record_turn(self, conversation: Conversation, usage: dict | None) -> None:
+        """Count a finished turn and the prompt tokens it sent (and how many the provider had cached)"""
+        self._stats["turns"] += 1
+        if conversation.turns[:-1] or conversation.pending or conversation.summary:
+            self._stats["follow_ups"] += 1
+        if usage:
+            self._stats["llm_turns"] += 1
+            self._stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            self._stats["cached_tokens"] += usage.get("cached_tokens") or 0
+
+    def record_summary(self, ok: bool) -> None:
+        self._stats["summaries" if ok else "summary_failures"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        stats = self._stats
+        llm_turns = stats["llm_turns"]
+        with self._lock:
+            active = len(self._entries)
+        return {
+            "enabled": ENABLED,
+            "active": active,
+            "started": stats["started"],
+            "turns": stats["turns"],
+            "follow_ups": stats["follow_ups"],
+            "summaries": stats["summaries"],
+            "summary_failures": stats["summary_failures"],
+            "evictions": stats["evictions"],
+            "avg_prompt_tokens": round(stats["prompt_tokens"] / llm_turns, 1) if llm_turns else 0.0,
+            "cached_token_share": round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0,
+        }
+
+
+_store: ConversationStore | None = None
+
+
+def get_conversation_store() -> ConversationStore:
+    """Lazy initialization of the shared conversation store"""
+    global _store
+    if _store is None:
+        _store = ConversationStore()
+    return _store
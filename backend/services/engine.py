@@ -0,0 +1,615 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from config.settings import (
+    CHART_MAX_POINTS,
+    ENGINE_DIR,
+    ENGINE_MEMORY_MB,
+    ENGINE_MIN_BYTES,
+    ENGINE_SAMPLE_ROWS,
+    ENGINE_THREADS,
+    QUERY_ENGINE,
+    STORE_TTL_SECONDS,
+)
+from services.charts import (
+    TIME_UNITS,
+    chart_payload,
+    column_kind,
+    compute_chart,
+    points,
+    points_limit,
+    time_unit,
+    validate_chart_spec,
+)
+from services.ingest import IngestResult, _clean
+from services.logs import get_logger
+from services.optimize import parse_amounts
+from services.planner import (
+    MAX_FILTER_CARDINALITY,
+    MAX_GROUPS,
+    MAX_RESULT_ROWS,
+    ComputedResult,
+    PlanError,
+    describe_plan,
+    group_label,
+    validate_plan,
+)
+from services.profile import TOP_VALUES, ColumnProfile, DatasetProfile, render_column, render_schema
+
+try:
+    import duckdb
+except ImportError:  # the engine is optional; without it every upload is loaded into pandas
+    duckdb = None
+
+log = get_logger("engine")
+
+if QUERY_ENGINE == "duckdb" and duckdb is None:
+    log.warning("QUERY_ENGINE=duckdb needs the duckdb package (pip install duckdb); loading every upload into pandas")
+
+ENABLED = QUERY_ENGINE == "duckdb" and duckdb is not None
+# Rows read up front to decide which text columns hold amounts such as "$1,250.00"
+AMOUNT_SAMPLE_ROWS = 20_000
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER",
+                  "UBIGINT", "FLOAT", "DOUBLE", "REAL", "DECIMAL")
+_SQL_AGGREGATIONS = {"sum": "sum", "mean": "avg", "median": "median", "min": "min", "max": "max"}
+_PERIODS = {"D": "day", "W": "week", "M": "month", "Q": "quarter", "Y": "year"}
+
+
+
+class EngineError(ValueError):
+    """A query the engine could not run"""
+
+
+_db: Any = None
+_db_lock = threading.Lock()
+_stats = {"conversions": 0, "conversion_seconds": 0.0, "queries": 0, "query_seconds": 0.0, "sample_fallbacks": 0}
+
+
+def use_engine(file_ext: str, size_bytes: int) -> bool:
+    """Whether an upload is converted for the engine instead of loaded into pandas"""
+    return ENABLED and file_ext == '.csv' and size_bytes >= ENGINE_MIN_BYTES
+
+
+def cursor() -> Any:
+    """A cursor on the process-wide DuckDB database; one per call, since cursors are not shared between threads"""
+    global _db
+    with _db_lock:
+        if _db is None:
+            spill_dir = os.path.join(ENGINE_DIR, "spill")
+            os.makedirs(spill_dir, exist_ok=True)
+            _db = duckdb.connect(config={
+                "memory_limit": f"{ENGINE_MEMORY_MB}MB",
+                "threads": ENGINE_THREADS,
+                "temp_directory": spill_dir,
+            })
+        return _db.cursor()
+
+
+def quote(name: Any) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(text: str) -> str:
+    return "'" + text.replace("'", "''") + "'"
+
+
+def amount_sql(ref: str) -> str:
+    # The SQL counterpart of as_numeric: drop currency symbols, separators, percent signs and spaces
+    return f"TRY_CAST(regexp_replace(CAST({ref} AS VARCHAR), '[,$€£¥%\\s]', '', 'g') AS DOUBLE)"
+
+
+def _quartiles(value: Any) -> list[Any]:
+    # approx_quantile returns NULL for a column without values
+    return list(value) if isinstance(value, (list, np.ndarray)) else [None] * 3
+
+
+def _is_numeric_type(sql_type: str) -> bool:
+    return sql_type.startswith(_NUMERIC_TYPES)
+
+
+def _paths(content_id: str) -> tuple[str, str]:
+    base = os.path.join(ENGINE_DIR, content_id)
+    return f"{base}.parquet", f"{base}.json"
+
+
+def _convert(path: str, target: str, sample_size: int) -> list[str]:
+    """Stream a CSV into a Parquet file, converting amount text columns to numbers; returns the currency columns"""
+    con = cursor()
+    try:
+        source = f"read_csv({_literal(path)}, header = true, sample_size = {sample_size})"
+        described = con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+        head = con.execute(f"SELECT * FROM {source} LIMIT {AMOUNT_SAMPLE_ROWS}").df()
+        select, currency = [], []
+        for name, sql_type, *_ in described:
+            parsed = parse_amounts(head[name]) if sql_type == "VARCHAR" else None
+            if parsed is not None:
+                select.append(f"{amount_sql(quote(name))} AS {quote(name)}")
+                if parsed[1]:
+                    currency.append(name)
+            else:
+                select.append(quote(name))
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        con.execute(
+            f"COPY (SELECT {', '.join(select)} FROM {source}) TO {_literal(tmp)} (FORMAT parquet, COMPRESSION zstd)"
+        )
+        os.replace(tmp, target)
+        return currency
+    finally:
+        con.close()
+
+
+def ingest_csv(path: str, content_id: str) -> "EngineDataset":
+    """
+    Convert a spooled CSV upload to Parquet in ENGINE_DIR with DuckDB's streaming,
+    multi-threaded reader; memory stays within ENGINE_MEMORY_MB whatever the file
+    size. Text columns of amounts ("$95,000") are stored as numbers, as the
+    pandas path's compaction does. Uploads already converted are reused.
+    Blocking; run it on the worker pool.
+    """
+    target, meta_path = _paths(content_id)
+    if not (os.path.exists(target) and os.path.exists(meta_path)):
+        started = time.perf_counter()
+        try:
+            currency = _convert(path, target, sample_size=100_000)
+        except duckdb.Error as e:
+            # Types were sniffed from the first rows; a later row did not fit, so sniff the whole file
+            log.warning(f"Retrying CSV conversion with full type detection: {e}")
+            currency = _convert(path, target, sample_size=-1)
+        with open(meta_path, "w") as f:
+            json.dump({"currency": currency}, f)
+        _stats["conversions"] += 1
+        _stats["conversion_seconds"] += time.perf_counter() - started
+        _prune(keep=content_id)
+    return EngineDataset.open(content_id)
+
+
+def delete_dataset(content_id: str) -> None:
+    for path in _paths(content_id):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _prune(keep: str) -> None:
+    # Parquet files are touched on every query, so only abandoned uploads are removed
+    if STORE_TTL_SECONDS <= 0:
+        return
+    cutoff = time.time() - STORE_TTL_SECONDS
+    for name in os.listdir(ENGINE_DIR):
+        content_id, ext = os.path.splitext(name)
+        if ext != ".parquet" or content_id == keep:
+            continue
+        try:
+            if os.path.getmtime(os.path.join(ENGINE_DIR, name)) < cutoff:
+                delete_dataset(content_id)
+        except FileNotFoundError:
+            pass
+
+
+@dataclass
+class EngineDataset:
+    """
+    An upload stored as Parquet and queried with DuckDB. Profiles, describe()
+    stats, computed answers and chart series are pushed down as SQL over every
+    row; prompts and suggestions use a bounded random sample held in memory.
+    Small and picklable, so it is stored with the file data and can be passed to
+    process workers; each query opens its own cursor.
+    """
+
+    content_id: str
+    path: str
+    row_count: int
+    types: dict[str, str]  # column -> DuckDB type
+    currency_columns: list[str]
+
+    @classmethod
+    def open(cls, content_id: str) -> "EngineDataset":
+        path, meta_path = _paths(content_id)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        con = cursor()
+        try:
+            source = f"read_parquet({_literal(path)})"
+            types = {name: sql_type for name, sql_type, *_ in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+            row_count = con.execute(f"SELECT count(*) FROM {source}").fetchone()[0]
+        finally:
+            con.close()
+        return cls(content_id, path, int(row_count), types, meta["currency"])
+
+    @property
+    def source(self) -> str:
+        return f"read_parquet({_literal(self.path)})"
+
+    def _query(self, sql: str, params: list[Any] | None = None) -> Any:
+        started = time.perf_counter()
+        con = cursor()
+        try:
+            result = con.execute(sql, params or []).df()
+        except duckdb.Error as e:
+            raise EngineError(str(e)) from e
+        finally:
+            con.close()
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            pass
+        _stats["queries"] += 1
+        _stats["query_seconds"] += time.perf_counter() - started
+        return result
+
+    def _numeric(self, col: Any) -> str:
+        """SQL for a column's numeric values; text columns are parsed like amounts"""
+        return quote(col) if _is_numeric_type(self.types.get(col, "")) else amount_sql(quote(col))
+
+    def _date(self, col: Any) -> str:
+        return f"TRY_CAST({quote(col)} AS TIMESTAMP)"
+
+    def _kind(self, col: Any, sample: pd.DataFrame) -> str:
+        sql_type = self.types.get(col, "")
+        if _is_numeric_type(sql_type):
+            return "numeric"
+        if sql_type.startswith(("DATE", "TIMESTAMP")):
+            return "date"
+        return column_kind(sample[col])
+
+    # -- upload -----------------------------------------------------------------
+
+    def sample(self, n: int = ENGINE_SAMPLE_ROWS) -> pd.DataFrame:
+        """Seeded random sample of at most n rows, read in one streaming pass"""
+        if self.row_count <= n:
+            return self._query(f"SELECT * FROM {self.source}")
+        return self._query(f"SELECT * FROM {self.source} USING SAMPLE reservoir({int(n)} ROWS) REPEATABLE (42)")
+
+    def summary(self, sample: pd.DataFrame, size_bytes: int = 0) -> IngestResult:
+        """What profile_frame returns for a pandas upload, with describe() stats computed over every row"""
+        numeric_cols = [col for col, sql_type in self.types.items() if _is_numeric_type(sql_type)]
+        stats: dict[str, dict[str, float | None]] = {}
+        if numeric_cols:
+            select = []
+            for i, col in enumerate(numeric_cols):
+                ref = quote(col)
+                select += [
+                    f"count({ref}) AS c{i}", f"avg({ref}) AS mean{i}", f"stddev_samp({ref}) AS std{i}",
+                    f"min({ref}) AS min{i}", f"approx_quantile({ref}, [0.25, 0.5, 0.75]) AS q{i}", f"max({ref}) AS max{i}",
+                ]
+            row = self._query(f"SELECT {', '.join(select)} FROM {self.source}").iloc[0]
+            for i, col in enumerate(numeric_cols):
+                quartiles = _quartiles(row[f"q{i}"])
+                stats[col] = {
+                    'count': float(row[f"c{i}"]),
+                    'mean': _clean(row[f"mean{i}"]),
+                    'std': _clean(row[f"std{i}"]),
+                    'min': _clean(row[f"min{i}"]),
+                    '25%': _clean(quartiles[0]),
+                    '50%': _clean(quartiles[1]),
+                    '75%': _clean(quartiles[2]),
+                    'max': _clean(row[f"max{i}"]),
+                }
+        head = self._query(f"SELECT * FROM {self.source} LIMIT 5")
+        return IngestResult(
+            dataframe=sample,
+            row_count=self.row_count,
+            column_count=len(self.types),
+            columns=list(self.types),
+            dtypes={k: str(v) for k, v in sample.dtypes.to_dict().items()},
+            numeric_cols=numeric_cols,
+            sample_data=head.to_dict(orient='records'),
+            stats=stats,
+            size_bytes=size_bytes,
+        )
+
+    def profile(self, sample: pd.DataFrame, fingerprint: str) -> DatasetProfile:
+        """build_profile over every row: one aggregate scan, plus a top-values query per non-numeric column"""
+        kinds = {col: self._kind(col, sample) for col in self.types}
+        select = []
+        for i, (col, kind) in enumerate(kinds.items()):
+            ref = quote(col)
+            select += [f"count({ref}) AS c{i}", f"approx_count_distinct({ref}) AS d{i}"]
+            if kind == "numeric":
+                num = self._numeric(col)
+                select += [
+                    f"min({num}) AS min{i}", f"max({num}) AS max{i}", f"avg({num}) AS mean{i}",
+                    f"stddev_samp({num}) AS std{i}", f"approx_quantile({num}, [0.25, 0.5, 0.75]) AS q{i}", f"sum({num}) AS sum{i}",
+                ]
+            elif kind == "date":
+                select += [f"CAST(min({self._date(col)}) AS VARCHAR) AS dmin{i}", f"CAST(max({self._date(col)}) AS VARCHAR) AS dmax{i}"]
+        row = self._query(f"SELECT {', '.join(select)} FROM {self.source}").iloc[0]
+
+        columns = {}
+        currency = set(self.currency_columns)
+        for i, (col, kind) in enumerate(kinds.items()):
+            count = int(row[f"c{i}"])
+            profile = ColumnProfile(
+                name=col,
+                dtype=str(sample[col].dtype),
+                kind=kind,
+                count=count,
+                nulls=self.row_count - count,
+                # HyperLogLog estimate; it can exceed the count slightly
+                distinct=min(int(row[f"d{i}"]), count),
+                is_currency=col in currency,
+            )
+            if kind == "numeric":
+                quartiles = _quartiles(row[f"q{i}"])
+                profile.min, profile.max = _clean(row[f"min{i}"]), _clean(row[f"max{i}"])
+                profile.mean, profile.std = _clean(row[f"mean{i}"]), _clean(row[f"std{i}"])
+                profile.q25, profile.median, profile.q75 = (_clean(v) for v in quartiles)
+                profile.sum = _clean(row[f"sum{i}"])
+            else:
+                if kind == "date":
+                    profile.date_min, profile.date_max = row[f"dmin{i}"], row[f"dmax{i}"]
+                top = self._query(
+                    f"SELECT {quote(col)} AS value, count(*) AS n FROM {self.source} WHERE {quote(col)} IS NOT NULL "
+                    f"GROUP BY 1 ORDER BY n DESC, value LIMIT {max(TOP_VALUES, MAX_FILTER_CARDINALITY + 1)}"
+                )
+                profile.top_values = list(zip(top["value"].head(TOP_VALUES), top["n"].head(TOP_VALUES).astype(int)))
+                if len(top) <= MAX_FILTER_CARDINALITY:
+                    profile.distinct = len(top)
+                    profile.categories = list(top["value"])
+            render_column(profile, sample[col].dropna().unique()[:3])
+            columns[col] = profile
+        return DatasetProfile(
+            fingerprint=fingerprint,
+            row_count=self.row_count,
+            columns=columns,
+            schema_text=render_schema(columns),
+        )
+
+    # -- computed answers -------------------------------------------------------
+
+    def _where(self, filters: list[dict[str, Any]], sample: pd.DataFrame) -> tuple[str, list[Any]]:
+        """apply_filters as a SQL condition and its parameters"""
+        clauses, params = [], []
+        for f in filters:
+            col, op, value = f["column"], f["op"], f["value"]
+            kind = self._kind(col, sample)
+            if op == "contains":
+                clauses.append(f"contains(lower(CAST({quote(col)} AS VARCHAR)), lower(?))")
+                params.append(str(value))
+            elif op in (">", ">=", "<", "<="):
+                if kind != "numeric":
+                    raise PlanError(f"Cannot compare non-numeric column {col!r}")
+                clauses.append(f"{self._numeric(col)} {op} ?")
+                params.append(float(value))
+            elif kind == "numeric":
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    # A number never equals text, as in pandas
+                    clauses.append("FALSE" if op == "==" else "TRUE")
+                    continue
+                clauses.append(f"{self._numeric(col)} {'=' if op == '==' else 'IS DISTINCT FROM'} ?")
+                params.append(number)
+            else:
+                clauses.append(f"lower(CAST({quote(col)} AS VARCHAR)) {'=' if op == '==' else 'IS DISTINCT FROM'} lower(?)")
+                params.append(str(value))
+        return " AND ".join(clauses) or "TRUE", params
+
+    def execute_plan(self, plan: dict[str, Any], sample: pd.DataFrame) -> ComputedResult:
+        """
+        execute_plan pushed down to DuckDB: the plan is validated against the
+        sample's columns, then run as one SQL query over every row.
+        Blocking; callers run it through the worker pool.
+        """
+        plan = validate_plan(plan, sample)
+        where, params = self._where(plan["filters"], sample)
+        op = plan["op"]
+        matched = self.row_count
+        if plan["filters"]:
+            matched = int(self._query(f"SELECT count(*) AS n FROM {self.source} WHERE {where}", params)["n"].iloc[0])
+        title, methodology = describe_plan(plan, self.row_count, matched)
+
+        if op == "count":
+            table = pd.DataFrame({"Metric": ["Matching rows"], "Value": [matched]})
+        elif op == "aggregate":
+            col, agg = plan["column"], plan["agg"]
+            if agg == "nunique":
+                expr = f"count(DISTINCT {quote(col)})"
+            elif agg == "count":
+                expr = f"count({quote(col)})"
+            else:
+                expr = f"{_SQL_AGGREGATIONS[agg]}({self._numeric(col)})"
+            value = self._query(f"SELECT {expr} AS value FROM {self.source} WHERE {where}", params)["value"].iloc[0]
+            table = pd.DataFrame({"Metric": [title], "Value": [value]})
+        elif op == "top_n":
+            num = self._numeric(plan["column"])
+            table = self._query(
+                f"SELECT * FROM {self.source} WHERE {where} AND {num} IS NOT NULL "
+                f"ORDER BY {num} {'ASC' if plan['ascending'] else 'DESC'} LIMIT {plan['n']}",
+                params,
+            )
+        elif op == "group_by":
+            group, agg = plan["group_by"], plan["agg"]
+            if agg == "count":
+                expr = "count(*)"
+            elif agg == "nunique":
+                expr = f"count(DISTINCT {quote(plan['column'])})"
+            else:
+                expr = f"{_SQL_AGGREGATIONS[agg]}({self._numeric(plan['column'])})"
+            table = self._query(
+                f"SELECT {quote(group)} AS g, {expr} AS v FROM {self.source} WHERE {where} AND {quote(group)} IS NOT NULL "
+                f"GROUP BY 1 ORDER BY 2 {'ASC' if plan['ascending'] else 'DESC'} NULLS LAST LIMIT {plan.get('n', MAX_GROUPS)}",
+                params,
+            )
+            table.columns = [group, group_label(plan)]
+        else:
+            table = self._query(f"SELECT * FROM {self.source} WHERE {where} LIMIT {MAX_RESULT_ROWS}", params)
+
+        return ComputedResult(
+            plan=plan,
+            title=title,
+            methodology=methodology,
+            table=table,
+            rows_scanned=self.row_count,
+            rows_matched=matched,
+        )
+
+    # -- charts -------------------------------------------------------------------
+
+    def compute_chart(
+        self,
+        spec: dict[str, Any],
+        sample: pd.DataFrame,
+        max_points: int = CHART_MAX_POINTS,
+        profile: DatasetProfile | None = None,
+    ) -> dict[str, Any]:
+        """
+        compute_chart with the grouping pushed down to DuckDB, so totals, counts
+        and histograms cover every row. Series of raw values that pandas would
+        downsample (y against a continuous x, or one line point per row) are
+        computed from the sample instead, and say so.
+        Blocking; run it on the worker pool.
+        """
+        spec = validate_chart_spec(spec, sample)
+        x, y, agg, chart_type = spec["x"], spec["y"], spec["agg"], spec["chartType"]
+        max_points = points_limit(chart_type, max_points)
+        column = profile.column(x) if profile is not None else None
+        kind = column.kind if column is not None else self._kind(x, sample)
+        distinct = column.distinct if column is not None else self.row_count
+
+        result = None
+        if kind == "date":
+            result = self._date_series(x, y, agg, max_points)
+        elif kind == "numeric" and (agg == "none" or y is None) and distinct > max_points:
+            if y is None:
+                result = self._histogram(x, max_points)
+        elif agg == "none" and chart_type in ("line", "area") and column is not None and distinct >= 0.9 * column.count:
+            # One point per row (the distinct count is approximate), which pandas downsamples
+            pass
+        else:
+            result = self._grouped_series(x, y, agg, max_points, kind, binned=kind == "numeric" and distinct > max_points)
+        if result is None:
+            return self._sampled_chart(spec, sample, max_points, profile)
+        data, notes = result
+        return chart_payload(spec, data, notes, self.row_count)
+
+    def _sampled_chart(
+        self, spec: dict[str, Any], sample: pd.DataFrame, max_points: int, profile: DatasetProfile | None
+    ) -> dict[str, Any]:
+        _stats["sample_fallbacks"] += 1
+        chart = compute_chart(sample, spec, max_points, profile)
+        if len(sample) < self.row_count:
+            note = f"Computed from a random sample of {len(sample):,} of {self.row_count:,} rows."
+            chart["description"] = " ".join(filter(None, [chart["description"], note]))
+        chart["meta"]["rows"] = self.row_count
+        return chart
+
+    def _value(self, y: Any, agg: str) -> str:
+        if y is None or agg == "count":
+            return "count(*)"
+        return f"{_SQL_AGGREGATIONS.get(agg, 'sum')}({self._numeric(y)})"
+
+    def _date_series(self, x: Any, y: Any, agg: str, max_points: int) -> tuple[list[dict[str, Any]], list[str]] | None:
+        date = self._date(x)
+        bounds = self._query(f"SELECT min({date}) AS lo, max({date}) AS hi FROM {self.source}").iloc[0]
+        if pd.isna(bounds["lo"]):
+            # Dates pandas can parse but DuckDB cannot cast
+            return None
+        freq = time_unit((bounds["hi"] - bounds["lo"]).days + 1, max_points)
+        unit = dict(TIME_UNITS)[freq]
+        series = self._query(
+            f"SELECT date_trunc('{_PERIODS[freq]}', {date}) AS period, {self._value(y, agg)} AS v "
+            f"FROM {self.source} WHERE {date} IS NOT NULL GROUP BY 1 ORDER BY 1"
+        )
+        notes = [f"Grouped by {unit}."]
+        if len(series) > max_points:
+            series = series.iloc[-max_points:]
+            notes.append(f"Showing the most recent {max_points} {unit}s.")
+        labels = pd.PeriodIndex(pd.to_datetime(series["period"]), freq=freq)
+        return points(labels, series["v"]), notes
+
+    def _bounds(self, num: str) -> tuple[float, float] | None:
+        row = self._query(f"SELECT min({num}) AS lo, max({num}) AS hi FROM {self.source}").iloc[0]
+        if pd.isna(row["lo"]):
+            return None
+        return float(row["lo"]), float(row["hi"])
+
+    def _histogram(self, x: Any, max_points: int) -> tuple[list[dict[str, Any]], list[str]] | None:
+        num = self._numeric(x)
+        bounds = self._bounds(num)
+        if bounds is None:
+            return None
+        lo, hi = bounds if bounds[0] < bounds[1] else (bounds[0] - 0.5, bounds[1] + 0.5)
+        bins = min(max_points, 30)
+        width = (hi - lo) / bins
+        # np.histogram's bins: half-open, with the maximum in the last one
+        counts = self._query(
+            f"SELECT least(CAST(floor(({num} - ?) / ?) AS BIGINT), {bins - 1}) AS b, count(*) AS v "
+            f"FROM {self.source} WHERE {num} IS NOT NULL GROUP BY 1",
+            [lo, width],
+        )
+        series = pd.Series(counts["v"].to_numpy(float), index=counts["b"].to_numpy()).reindex(range(bins), fill_value=0.0)
+        edges = np.linspace(lo, hi, bins + 1)
+        names = [f"{edges[i]:,.4g}–{edges[i + 1]:,.4g}" for i in range(bins)]
+        return points(pd.Index(names), series), [f"Values binned into {bins} equal-width ranges."]
+
+    def _grouped_series(
+        self, x: Any, y: Any, agg: str, max_points: int, kind: str, binned: bool
+    ) -> tuple[list[dict[str, Any]], list[str]] | None:
+        value = self._value(y, agg)
+        if binned:
+            num = self._numeric(x)
+            bounds = self._bounds(num)
+            if bounds is None:
+                return None
+            lo, hi = bounds
+            # The intervals pd.cut picks from the minimum and maximum: right-closed, the first widened to hold the minimum
+            intervals = pd.cut(pd.Series([lo, hi]), bins=max_points).cat.categories
+            width = (hi - lo) / max_points or 1.0
+            groups = self._query(
+                f"SELECT greatest(least(CAST(ceil(({num} - ?) / ?) AS BIGINT) - 1, {max_points - 1}), 0) AS b, {value} AS v "
+                f"FROM {self.source} WHERE {num} IS NOT NULL GROUP BY 1 ORDER BY 1",
+                [lo, width],
+            )
+            return points(pd.Index([intervals[b] for b in groups["b"]]), groups["v"]), [f"{x} binned into {max_points} ranges."]
+
+        key = self._numeric(x) if kind == "numeric" else quote(x)
+        order = "k" if kind == "numeric" else "v DESC NULLS LAST"
+        groups = self._query(
+            f"WITH g AS (SELECT {key} AS k, {value} AS v, count(*) AS n FROM {self.source} WHERE {key} IS NOT NULL GROUP BY 1) "
+            f"SELECT k, v, count(*) OVER () AS groups, sum(n) OVER () AS rows, sum(v) OVER () AS total "
+            f"FROM g ORDER BY {order} LIMIT {max_points}"
+        )
+        if kind == "numeric" and not _is_numeric_type(self.types.get(x, "")) and (groups["k"] % 1 == 0).all():
+            # pd.to_numeric reads whole numbers in text as integers; keep their labels ("31", not "31.0")
+            groups["k"] = groups["k"].astype("int64")
+        notes = []
+        total_groups = int(groups["groups"].iloc[0]) if len(groups) else 0
+        if agg == "none" and kind != "numeric" and total_groups == int(groups["rows"].iloc[0] if len(groups) else 0):
+            # One point per row, e.g. salary per employee: the largest values
+            if total_groups > max_points:
+                groups = groups.dropna(subset=["v"])
+                notes.append(f"Showing the top {max_points} of {self.row_count} rows by {y}.")
+        elif total_groups > max_points:
+            head = groups.iloc[:max_points - 1]
+            if agg in ("sum", "count", "none"):
+                other = float(groups["total"].iloc[0]) - float(head["v"].sum())
+                groups = pd.concat([head, pd.DataFrame({"k": ["Other"], "v": [other]})])
+                notes.append(f"{total_groups - len(head)} smaller groups combined into Other.")
+            else:
+                groups = head
+                notes.append(f"Showing the top {len(head)} of {total_groups} groups.")
+        return points(groups["k"], groups["v"]), notes
+
+
+def engine_stats() -> dict[str, Any]:
+    datasets = [name for name in os.listdir(ENGINE_DIR) if name.endswith(".parquet")] if os.path.isdir(ENGINE_DIR) else []
+    return {
+        "engine": "duckdb" if ENABLED else "pandas",
+        "min_bytes": ENGINE_MIN_BYTES,
+        "datasets": len(datasets),
+        "bytes": sum(os.path.getsize(os.path.join(ENGINE_DIR, name)) for name in datasets),
+        "conversions": _stats["conversions"],
+        "avg_conversion_ms": round(_stats["conversion_seconds"] * 1000 / _stats["conversions"], 1) if _stats["conversions"] else 0.0,
+        "queries": _stats["queries"],
+        "avg_query_ms": round(_stats["query_seconds"] * 1000 / _stats["queries"], 1) if _stats["queries"] else 0.0,
+        "sample_fallbacks": _stats["sample_fallbacks"],
+    }
@@ -0,0 +1,193 @@
+import os
+import shutil
+import time
+import zipfile
+from xml.etree import ElementTree
+from collections.abc import Iterable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from config.settings import EXCEL_ENGINE, STORE_TTL_SECONDS, WORKBOOK_DIR
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # python-calamine is optional; openpyxl in read-only mode is the fallback
+    CalamineWorkbook = None
+
+
+class SheetNotFound(Exception):
+    """Raised when a requested sheet name or index does not exist in the workbook."""
+
+
+def excel_engine(file_ext: str) -> str:
+    """Engine used for a workbook: "calamine", "openpyxl" (read-only streaming) or "pandas"."""
+    if EXCEL_ENGINE != "auto":
+        return EXCEL_ENGINE
+    if CalamineWorkbook is not None:
+        return "calamine"
+    # openpyxl cannot open legacy .xls files; pandas hands those to xlrd
+    return "openpyxl" if file_ext == ".xlsx" else "pandas"
+
+
+def list_sheets(path: str, file_ext: str, engine: str | None = None) -> list[str]:
+    """Sheet names in workbook order. Only the workbook index is read, not the sheet data."""
+    engine = engine or excel_engine(file_ext)
+    if engine == "calamine":
+        return list(CalamineWorkbook.from_path(path).sheet_names)
+    if file_ext == ".xlsx":
+        # Read the sheet list straight from xl/workbook.xml; opening the workbook
+        # with openpyxl would load the whole shared-strings table first
+        with zipfile.ZipFile(path) as archive:
+            root = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        return [element.get("name") for element in root.iter() if element.tag.rsplit("}", 1)[-1] == "sheet"]
+    with pd.ExcelFile(path) as workbook:
+        return [str(name) for name in workbook.sheet_names]
+
+
+def resolve_sheet(sheets: list[str], sheet: str | None = None, sheet_id: int | None = None) -> int:
+    """Index of the requested sheet by name or position; the first sheet by default."""
+    if sheet is not None:
+        if sheet not in sheets:
+            raise SheetNotFound(f"Sheet '{sheet}' not found. Available sheets: {', '.join(sheets)}")
+        return sheets.index(sheet)
+    if sheet_id is not None:
+        if not 0 <= sheet_id < len(sheets):
+            raise SheetNotFound(f"Sheet index {sheet_id} out of range; the workbook has {len(sheets)} sheets")
+        return sheet_id
+    return 0
+
+
+def _header(row: Iterable[Any]) -> list[str]:
+    # Same naming as pandas: blank headers become "Unnamed: i", repeats get ".1", ".2", ...
+    names: list[str] = []
+    seen: dict[str, int] = {}
+    for i, value in enumerate(row):
+        name = f"Unnamed: {i}" if value is None or value == "" else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        seen.setdefault(name, 0)
+        names.append(name)
+    return names
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == ""
+
+
+def rows_to_frame(rows: Iterable[tuple | list]) -> pd.DataFrame:
+    """
+    DataFrame from raw cell rows: the first non-empty row is the header, trailing
+    empty rows and unnamed empty columns are dropped, and column types are
+    inferred once per column.
+    """
+    rows = iter(rows)
+    header = next((row for row in rows if not all(_is_empty(value) for value in row)), None)
+    if header is None:
+        return pd.DataFrame()
+    data = list(rows)
+    while data and all(_is_empty(value) for value in data[-1]):
+        data.pop()
+
+    df = pd.DataFrame(data) if data else pd.DataFrame(columns=range(len(header)))
+    width = max(len(header), df.shape[1])
+    header = list(header) + [None] * (width - len(header))
+    for i in range(df.shape[1], width):
+        df[i] = None
+    # Trailing columns with neither a header nor data are sheet padding
+    while width and _is_empty(header[width - 1]) and df[width - 1].isna().all():
+        width -= 1
+    df = df.iloc[:, :width]
+    df.columns = _header(header[:width])
+    # Entirely empty columns are float NaN, as pd.read_excel returns them
+    for col in df.columns[(df.dtypes == object).to_numpy()]:
+        if df[col].isna().all():
+            df[col] = np.nan
+    return df
+
+
+def read_sheet(path: str, file_ext: str, sheet_index: int = 0, engine: str | None = None) -> pd.DataFrame:
+    """Parse one sheet of a workbook. Blocking; run it on the worker pool."""
+    engine = engine or excel_engine(file_ext)
+    if engine == "calamine":
+        workbook = CalamineWorkbook.from_path(path)
+        sheet = workbook.get_sheet_by_index(sheet_index)
+        df = rows_to_frame(sheet.to_python(skip_empty_area=False))
+        # calamine reports empty cells as "", pandas as NaN
+        return df.replace("", None).infer_objects()
+    if engine == "openpyxl":
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+        try:
+            worksheet = workbook.worksheets[sheet_index]
+            # Some writers store a wrong dimension; recompute it while streaming
+            worksheet.reset_dimensions()
+            return rows_to_frame(worksheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    return pd.read_excel(path, sheet_name=sheet_index)
+
+
+class WorkbookStore:
+    """
+    Keeps uploaded workbooks on disk, keyed by content id, so further sheets
+    can be parsed on demand after the upload request has finished. Workbooks
+    unused for STORE_TTL_SECONDS are removed when new ones are saved.
+    """
+
+    def __init__(self, directory: str = WORKBOOK_DIR, ttl_seconds: float = STORE_TTL_SECONDS) -> None:
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, content_id: str, file_ext: str) -> str:
+        return os.path.join(self.directory, content_id + file_ext)
+
+    def save(self, content_id: str, file_ext: str, source_path: str) -> str:
+        target = self.path(content_id, file_ext)
+        if not os.path.exists(target):
+            tmp = f"{target}.{os.getpid()}.tmp"
+            shutil.copyfile(source_path, tmp)
+            os.replace(tmp, target)
+        self._prune(keep=target)
+        return target
+
+    def get(self, content_id: str, file_ext: str) -> str | None:
+        target = self.path(content_id, file_ext)
+        try:
+            os.utime(target)
+        except FileNotFoundError:
+            return None
+        return target
+
+    def delete(self, content_id: str, file_ext: str) -> None:
+        try:
+            os.unlink(self.path(content_id, file_ext))
+        except FileNotFoundError:
+            pass
+
+    def _prune(self, keep: str) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if path != keep and os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+_workbooks: WorkbookStore | None = None
+
+
+def get_workbook_store() -> WorkbookStore:
+    """Lazy initialization of the workbook store"""
+    global _workbooks
+    if _workbooks is None:
+        _workbooks = WorkbookStore()
+    return _workbooks
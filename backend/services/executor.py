@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from config.settings import EXECUTOR_KIND, EXECUTOR_QUEUE, EXECUTOR_WORKERS
+from services.metrics import record_span
+
+
+class ExecutorSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+_executor: Executor | None = None
+_in_flight = 0
+_stage_timings: dict[str, dict[str, float]] = {}
+
+
+def get_executor() -> Executor:
+    """Lazy initialization of the shared worker pool for CPU-bound pandas work"""
+    global _executor
+    if _executor is None:
+        if EXECUTOR_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=EXECUTOR_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="insightxl-cpu")
+    return _executor
+
+
+def _timed_call(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> tuple[Any, float]:
+    # Runs inside the worker so queue wait and execution time can be told apart
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _record(stage: str, queue_s: float, run_s: float) -> None:
+    timing = _stage_timings.setdefault(
+        stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "queue_ms": 0.0, "last_ms": 0.0}
+    )
+    run_ms = run_s * 1000
+    timing["count"] += 1
+    timing["total_ms"] += run_ms
+    timing["queue_ms"] += queue_s * 1000
+    timing["max_ms"] = max(timing["max_ms"], run_ms)
+    timing["last_ms"] = run_ms
+
+
+async def run_stage(stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a blocking function on the worker pool and record its timing under `stage`.
+    Raises ExecutorSaturated instead of queueing without bound, so callers can shed load.
+    With EXECUTOR_KIND=process, `fn` and its arguments must be picklable.
+    """
+    global _in_flight
+    if _in_flight >= EXECUTOR_WORKERS + EXECUTOR_QUEUE:
+        raise ExecutorSaturated(f"Server is busy ({_in_flight} jobs in progress). Please retry shortly.")
+
+    _in_flight += 1
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    try:
+        result, run_s = await loop.run_in_executor(
+            get_executor(), functools.partial(_timed_call, fn, *args, **kwargs)
+        )
+    finally:
+        _in_flight -= 1
+    elapsed = time.perf_counter() - submitted
+    _record(stage, elapsed - run_s, run_s)
+    record_span(stage, elapsed)
+    return result
+
+
+def executor_stats() -> dict[str, Any]:
+    """Snapshot of pool occupancy and per-stage timings"""
+    stages = {
+        stage: {
+            "count": int(t["count"]),
+            "avg_ms": round(t["total_ms"] / t["count"], 3) if t["count"] else 0.0,
+            "avg_queue_ms": round(t["queue_ms"] / t["count"], 3) if t["count"] else 0.0,
+            "max_ms": round(t["max_ms"], 3),
+            "last_ms": round(t["last_ms"], 3),
+        }
+        for stage, t in _stage_timings.items()
+    }
+    return {
+        "kind": EXECUTOR_KIND,
+        "workers": EXECUTOR_WORKERS,
+        "queue_limit": EXECUTOR_QUEUE,
+        "in_flight": _in_flight,
+        "stages": stages,
+    }
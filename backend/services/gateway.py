@@ -0,0 +1,445 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections.abc import AsyncIterator, Callable, Mapping
+from typing import Any
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from config.settings import (
+    LLM_BACKEND,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_RETRIES,
+    LLM_MODEL_CONCURRENCY,
+    LLM_TIMEOUT_SECONDS,
+)
+from services.logs import get_logger
+from services.metrics import record_tokens, span
+
+
+load_dotenv()
+
+log = get_logger("gateway")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# Errors worth another attempt: rate limits, timeouts, dropped connections and 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    TimeoutError,
+)
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """OpenAI reset durations such as "20ms", "1s" or "6m0s", in seconds"""
+    if not value:
+        return None
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+class _TokenBucket:
+    """
+    Client-side view of one OpenAI rate limit (requests or tokens per minute).
+    Capacity, level and refill rate are reset from the x-ratelimit-* headers of
+    every response; until the first response the bucket does not limit.
+    """
+
+    def __init__(self) -> None:
+        self.capacity: float | None = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float) -> float:
+        """Take `cost` from the bucket; returns how long to wait before it is actually available"""
+        self._refill(time.monotonic())
+        if self.capacity is None:
+            return 0.0
+        self.level -= min(cost, self.capacity)
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate if self.rate > 0 else 1.0
+
+    def update(self, limit: str | None, remaining: str | None, reset: str | None) -> None:
+        try:
+            limit_value, remaining_value = float(limit), float(remaining)
+        except (TypeError, ValueError):
+            return
+        reset_seconds = _parse_duration(reset)
+        self.capacity = limit_value
+        self.level = remaining_value
+        self.updated = time.monotonic()
+        if reset_seconds and limit_value > remaining_value:
+            # "reset" is the time until the bucket is full again
+            self.rate = (limit_value - remaining_value) / reset_seconds
+        else:
+            self.rate = limit_value / 60.0
+
+    def snapshot(self) -> dict[str, Any]:
+        self._refill(time.monotonic())
+        return {"limit": self.capacity, "remaining": round(self.level, 1) if self.capacity is not None else None}
+
+
+class OpenAIBackend:
+    """OpenAI chat completions over one shared, pooled HTTP client; retries are left to the gateway"""
+
+    name = "openai"
+
+    def __init__(self, api_key: str, max_connections: int = LLM_MAX_CONNECTIONS, timeout: float = LLM_TIMEOUT_SECONDS) -> None:
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30.0,
+            ),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0, timeout=timeout, http_client=http_client)
+
+    async def create(self, **kwargs: Any) -> tuple[Mapping[str, str], Any]:
+        raw = await self.client.chat.completions.with_raw_response.create(**kwargs)
+        return raw.headers, raw.parse()
+
+
+FAKE_REPLY = """## Report
+
+### Summary
+This answer comes from the local fake LLM backend (LLM_BACKEND=fake).
+
+### Findings
+
+| Metric | Value |
+|---|---|
+| Rows | n/a |
+
+### Conclusions
+Configure OPENAI_API_KEY for real answers."""
+
+
+class FakeBackend:
+    """
+    Local stand-in for the OpenAI API for tests and load runs: canned replies,
+    simulated latency, optional requests-per-minute limit with OpenAI-style
+    headers and 429s, and an optional number of initial failures.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        reply: str | Callable[[dict], str] = FAKE_REPLY,
+        latency: float = 0.05,
+        chunk_chars: int = 16,
+        requests_per_minute: int | None = None,
+        fail_first: int = 0,
+    ) -> None:
+        self.reply = reply
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.requests_per_minute = requests_per_minute
+        self.fail_first = fail_first
+        self.calls: list[dict] = []
+        self._level = float(requests_per_minute or 0)
+        self._updated = time.monotonic()
+
+    def _content(self, kwargs: dict) -> str:
+        if callable(self.reply):
+            return self.reply(kwargs)
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            return "{}"
+        return self.reply
+
+    def _rate_limit_headers(self) -> dict[str, str]:
+        # Same model as the OpenAI limits: a bucket of requests refilled continuously over a minute
+        if self.requests_per_minute is None:
+            return {}
+        now = time.monotonic()
+        rate = self.requests_per_minute / 60.0
+        self._level = min(self.requests_per_minute, self._level + (now - self._updated) * rate)
+        self._updated = now
+        limited = self._level < 1
+        if not limited:
+            self._level -= 1
+        headers = {
+            "x-ratelimit-limit-requests": str(self.requests_per_minute),
+            "x-ratelimit-remaining-requests": str(int(self._level)),
+            "x-ratelimit-reset-requests": f"{(self.requests_per_minute - self._level) / rate:.3f}s",
+        }
+        if limited:
+            retry_after = f"{(1 - self._level) / rate:.3f}"
+            raise self._error(429, "Rate limit reached (fake backend)", {**headers, "retry-after": retry_after})
+        return headers
+
+    @staticmethod
+    def _error(status: int, message: str, headers: dict[str, str]) -> openai.APIStatusError:
+        response = httpx.Response(
+            status, headers=headers, request=httpx.Request("POST", "https://fake.local/v1/chat/completions")
+        )
+        error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+        return error_class(message, response=response, body=None)
+
+    async def create(self, **kwargs: Any) -> tuple[Mapping[str, str], Any]:
+        self.calls.append(kwargs)
+        await asyncio.sleep(self.latency)
+        if self.fail_first > 0:
+            self.fail_first -= 1
+            raise self._error(503, "Service unavailable (fake backend)", {})
+        headers = self._rate_limit_headers()
+        content = self._content(kwargs)
+        usage = {"prompt_tokens": _estimate_tokens(kwargs.get("messages", [])), "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if kwargs.get("stream"):
+            return headers, self._stream(kwargs["model"], content, usage)
+        return headers, ChatCompletion.model_validate({
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": kwargs["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        })
+
+    async def _stream(self, model: str, content: str, usage: dict) -> AsyncIterator[ChatCompletionChunk]:
+        base = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for start in range(0, len(content), self.chunk_chars):
+            await asyncio.sleep(self.latency / 10)
+            yield ChatCompletionChunk.model_validate(
+                {**base, "choices": [{"index": 0, "delta": {"content": content[start:start + self.chunk_chars]}}]}
+            )
+        yield ChatCompletionChunk.model_validate({**base, "choices": [], "usage": usage})
+
+
+def cached_tokens(usage: Any) -> int:
+    """Prompt tokens the provider served from its prompt cache (0 when it does not report them)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def _estimate_tokens(messages: list[dict]) -> int:
+    # chars / 4 is close enough for rate-limit accounting and costs nothing
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 4 * len(messages)
+
+
+class LLMGateway:
+    """
+    Single entry point for chat completions. Bounds concurrency globally and per
+    model, paces calls with token buckets fed by the provider's rate-limit
+    headers, retries transient failures with jittered exponential backoff,
+    applies a per-call timeout, and coalesces identical concurrent
+    (non-streaming) requests into one upstream call.
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        model_concurrency: int = LLM_MODEL_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+    ) -> None:
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.model_concurrency = model_concurrency
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._models: dict[str, asyncio.Semaphore] = {}
+        self._limits: dict[str, tuple[_TokenBucket, _TokenBucket]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rate_limit_waits = 0
+        self.rate_limit_wait_seconds = 0.0
+
+    def _buckets(self, model: str) -> tuple[_TokenBucket, _TokenBucket]:
+        if model not in self._limits:
+            self._limits[model] = (_TokenBucket(), _TokenBucket())
+        return self._limits[model]
+
+    async def _wait_for_capacity(self, model: str, kwargs: dict) -> None:
+        requests, tokens = self._buckets(model)
+        cost = _estimate_tokens(kwargs.get("messages", [])) + int(kwargs.get("max_tokens") or 0)
+        delay = max(requests.reserve(1), tokens.reserve(cost))
+        if delay > 0:
+            self.rate_limit_waits += 1
+            self.rate_limit_wait_seconds += delay
+            await asyncio.sleep(delay)
+
+    def _update_limits(self, model: str, headers: Mapping[str, str] | None) -> None:
+        if not headers:
+            return
+        requests, tokens = self._buckets(model)
+        requests.update(
+            headers.get("x-ratelimit-limit-requests"),
+            headers.get("x-ratelimit-remaining-requests"),
+            headers.get("x-ratelimit-reset-requests"),
+        )
+        tokens.update(
+            headers.get("x-ratelimit-limit-tokens"),
+            headers.get("x-ratelimit-remaining-tokens"),
+            headers.get("x-ratelimit-reset-tokens"),
+        )
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, model: str) -> AsyncIterator[None]:
+        if model not in self._models:
+            self._models[model] = asyncio.Semaphore(self.model_concurrency)
+        async with self._global, self._models[model]:
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int) -> float:
+        """Seconds to wait before the next attempt; re-raises once retries are exhausted"""
+        if isinstance(error, TimeoutError):
+            self.timeouts += 1
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else None
+        self._update_limits(model, headers)
+        if attempt >= self.max_retries:
+            self.failures += 1
+            raise error
+        self.retries += 1
+        retry_after = _parse_duration(headers.get("retry-after")) if headers else None
+        # Full jitter keeps synchronized clients from retrying in lockstep
+        delay = retry_after if retry_after is not None else random.uniform(
+            0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+        )
+        log.warning(f"LLM call to {model} failed ({type(error).__name__}); retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+    async def _complete(self, model: str, timeout: float, kwargs: dict) -> Any:
+        attempt = 0
+        while True:
+            await self._wait_for_capacity(model, kwargs)
+            async with self._slot(model):
+                try:
+                    headers, completion = await asyncio.wait_for(self.backend.create(model=model, **kwargs), timeout)
+                except RETRYABLE_ERRORS as e:
+                    delay = self._retry_delay(model, e, attempt)
+                else:
+                    self._update_limits(model, headers)
+                    usage = getattr(completion, "usage", None)
+                    if usage is not None:
+                        record_tokens(model, usage.prompt_tokens, usage.completion_tokens, cached_tokens(usage))
+                    return completion
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def complete(self, *, model: str, timeout: float | None = None, **kwargs: Any) -> Any:
+        """A chat completion; identical concurrent requests share one upstream call"""
+        key = hashlib.sha256(json.dumps({"model": model, **kwargs}, sort_keys=True, default=str).encode()).hexdigest()
+        with span("llm"):
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return await asyncio.shield(future)
+
+            future = asyncio.ensure_future(self._complete(model, timeout or self.timeout, kwargs))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            return await asyncio.shield(future)
+
+    async def stream(self, *, model: str, timeout: float | None = None, **kwargs: Any) -> AsyncIterator[Any]:
+        """
+        A streamed chat completion. Retries only happen before the first chunk;
+        the concurrency slot is held until the stream is consumed or closed.
+        """
+        with span("llm"):
+            attempt = 0
+            while True:
+                await self._wait_for_capacity(model, kwargs)
+                async with self._slot(model):
+                    try:
+                        headers, chunks = await asyncio.wait_for(
+                            self.backend.create(model=model, stream=True, **kwargs), timeout or self.timeout
+                        )
+                    except RETRYABLE_ERRORS as e:
+                        delay = self._retry_delay(model, e, attempt)
+                    else:
+                        self._update_limits(model, headers)
+                        async for chunk in chunks:
+                            if getattr(chunk, "usage", None) is not None:
+                                record_tokens(
+                                    model, chunk.usage.prompt_tokens, chunk.usage.completion_tokens, cached_tokens(chunk.usage)
+                                )
+                            yield chunk
+                        return
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "max_concurrency": self.max_concurrency,
+            "model_concurrency": self.model_concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rate_limit_waits": self.rate_limit_waits,
+            "rate_limit_wait_seconds": round(self.rate_limit_wait_seconds, 3),
+            "limits": {
+                model: {"requests": requests.snapshot(), "tokens": tokens.snapshot()}
+                for model, (requests, tokens) in self._limits.items()
+            },
+        }
+
+
+_gateway: LLMGateway | None = None
+
+
+def get_llm_gateway() -> LLMGateway | None:
+    """Lazy initialization of the shared LLM gateway; None when no backend is configured"""
+    global _gateway
+    if _gateway is None:
+        if LLM_BACKEND == "fake":
+            _gateway = LLMGateway(FakeBackend())
+        elif OPENAI_API_KEY:
+            _gateway = LLMGateway(OpenAIBackend(OPENAI_API_KEY))
+    return _gateway
+
+
+def set_llm_backend(backend: Any | None, **options: Any) -> LLMGateway | None:
+    """Replace the shared gateway with one around `backend` (None disables the LLM); used by tests"""
+    global _gateway
+    _gateway = LLMGateway(backend, **options) if backend is not None else None
+    return _gateway
+
+
+def llm_stats() -> dict[str, Any]:
+    gateway = _gateway
+    return gateway.stats() if gateway is not None else {"backend": None}
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any
+
+from config.settings import DATAFRAME_STORE, SHARED_STORE_DIR
+
+
+@dataclass
+class FileHandle:
+    file_id: str
+    dataset_id: str
+    user_id: str | None
+    filename: str
+    # Sheet version of the data behind this handle, bumped by each PATCH
+    version: int = 0
+
+
+class HandleRegistry:
+    """
+    Maps the file ids handed to clients onto content-addressed datasets in the
+    DataFrame store. Identical uploads share one dataset; each user gets one
+    handle per dataset, and a dataset may be freed once its last handle is released.
+    Kept in SQLite: in memory for a single worker, or next to the shared store
+    so every worker sees the same handles.
+    """
+
+    def __init__(self, db_path: str = ":memory:") -> None:
+        self.db_path = db_path
+        self.dedup_hits = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS handles ("
+            "file_id TEXT PRIMARY KEY, dataset_id TEXT NOT NULL, user_id TEXT, filename TEXT NOT NULL, created_at REAL NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0)"
+        )
+        if "version" not in {row[1] for row in self._db.execute("PRAGMA table_info(handles)")}:
+            try:
+                self._db.execute("ALTER TABLE handles ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+        self._db.execute("CREATE INDEX IF NOT EXISTS handles_dataset ON handles (dataset_id, user_id)")
+
+    def acquire(self, dataset_id: str, user_id: str | None, filename: str) -> FileHandle:
+        """A handle on the dataset for this user, reusing the user's existing handle if there is one"""
+        with self._lock:
+            if user_id is not None:
+                row = self._db.execute(
+                    "SELECT file_id, version FROM handles WHERE dataset_id = ? AND user_id = ?", (dataset_id, user_id)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE handles SET filename = ? WHERE file_id = ?", (filename, row[0]))
+                    return FileHandle(row[0], dataset_id, user_id, filename, row[1])
+            file_id = str(uuid.uuid4())
+            self._db.execute(
+                "INSERT INTO handles (file_id, dataset_id, user_id, filename, created_at) VALUES (?, ?, ?, ?, ?)",
+                (file_id, dataset_id, user_id, filename, time.time()),
+            )
+            return FileHandle(file_id, dataset_id, user_id, filename)
+
+    def get(self, file_id: str) -> FileHandle | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id, dataset_id, user_id, filename, version FROM handles WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return FileHandle(*row) if row is not None else None
+
+    def release(self, file_id: str) -> tuple[FileHandle, int] | None:
+        """Drop a handle; returns it with the number of handles still on its dataset"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id, dataset_id, user_id, filename, version FROM handles WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            handle = FileHandle(*row)
+            self._db.execute("DELETE FROM handles WHERE file_id = ?", (file_id,))
+            remaining = self._db.execute(
+                "SELECT COUNT(*) FROM handles WHERE dataset_id = ?", (handle.dataset_id,)
+            ).fetchone()[0]
+        return handle, remaining
+
+    def move(self, file_id: str, dataset_id: str) -> int:
+        """Point a handle at another dataset; returns the number of handles left on its old one"""
+        with self._lock:
+            row = self._db.execute("SELECT dataset_id FROM handles WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                return 0
+            self._db.execute("UPDATE handles SET dataset_id = ? WHERE file_id = ?", (dataset_id, file_id))
+            return self._db.execute("SELECT COUNT(*) FROM handles WHERE dataset_id = ?", (row[0],)).fetchone()[0]
+
+    def advance_version(self, file_id: str, base_version: int, version: int) -> bool:
+        """
+        Set a handle's sheet version if it is still at base_version. A compare-and-set,
+        so of two workers patching the same version only one succeeds.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE handles SET version = ? WHERE file_id = ? AND version = ?", (version, file_id, base_version)
+            )
+            return cursor.rowcount == 1
+
+    def count(self, dataset_id: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM handles WHERE dataset_id = ?", (dataset_id,)).fetchone()[0]
+
+    def forget_dataset(self, dataset_id: str) -> None:
+        """Drop every handle on a dataset that is no longer stored (evicted or expired)"""
+        with self._lock:
+            self._db.execute("DELETE FROM handles WHERE dataset_id = ?", (dataset_id,))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            handles, datasets = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT dataset_id) FROM handles"
+            ).fetchone()
+        return {
+            "handles": handles,
+            "datasets": datasets,
+            "dedup_hits": self.dedup_hits,
+            "shared": self.db_path != ":memory:",
+        }
+
+
+_registry: HandleRegistry | None = None
+
+
+def get_handle_registry() -> HandleRegistry:
+    """Lazy initialization of the handle registry; shared between workers with the shared store"""
+    global _registry
+    if _registry is None:
+        if DATAFRAME_STORE == "shared":
+            os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+            _registry = HandleRegistry(os.path.join(SHARED_STORE_DIR, "handles.sqlite"))
+        else:
+            _registry = HandleRegistry()
+    return _registry
@@ -0,0 +1,348 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pandas as pd
+
+from config.settings import CATEGORY_MAX_RATIO, DATASET_INDEXES, EXECUTOR_KIND, INDEX_MAX_BYTES
+from services.charts import as_datetime
+from services.logs import get_logger
+from services.planner import as_numeric
+
+if TYPE_CHECKING:
+    from services.profile import DatasetProfile
+
+log = get_logger("indexes")
+
+# Group-by aggregations answered from the pre-aggregated per-group statistics
+PREAGGREGATED = frozenset({"count", "sum", "mean", "min", "max", "none"})
+RANGE_OPS = (">", ">=", "<", "<=")
+_COMPARE = {
+    "==": np.equal, "!=": np.not_equal, ">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+}
+
+
+@dataclass
+class HashIndex:
+    """
+    Dictionary-encoded text column: one code per row and the distinct values as
+    the filters see them (`astype(str)`), so a filter is evaluated once per
+    distinct value and mapped back to rows through the codes.
+    """
+
+    codes: np.ndarray
+    values: np.ndarray
+    lowered: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.values.nbytes + self.lowered.nbytes
+
+    def mask(self, op: str, value: Any) -> np.ndarray:
+        if op == "contains":
+            needle = str(value).upper()
+            matches = [i for i, text in enumerate(self.values) if needle in text.upper()]
+        else:
+            matches = np.flatnonzero(self.lowered == value.lower())
+        mask = np.isin(self.codes, matches) if len(matches) != 1 else self.codes == matches[0]
+        return ~mask if op == "!=" else mask
+
+
+@dataclass
+class SortedIndex:
+    """Row positions of a numeric column's non-missing values, in value order"""
+
+    numeric: pd.Series
+    order: np.ndarray
+    values: np.ndarray
+    # Converted text columns are held here; numeric columns share the DataFrame's memory
+    owned: bool = False
+    # Nullable dtypes (Int64, Float64, Arrow): a missing value compares as <NA>, which the scan
+    # treats as no match, so it never matches != either (NaN in a float column does)
+    nullable: bool = False
+
+    @property
+    def nbytes(self) -> int:
+        own = int(self.numeric.memory_usage(index=False)) if self.owned else 0
+        return own + self.order.nbytes + self.values.nbytes
+
+    def mask(self, op: str, value: float) -> np.ndarray:
+        values = self.values
+        if op == ">":
+            rows = self.order[np.searchsorted(values, value, "right"):]
+        elif op == ">=":
+            rows = self.order[np.searchsorted(values, value, "left"):]
+        elif op == "<":
+            rows = self.order[:np.searchsorted(values, value, "left")]
+        elif op == "<=":
+            rows = self.order[:np.searchsorted(values, value, "right")]
+        else:
+            rows = self.order[np.searchsorted(values, value, "left"):np.searchsorted(values, value, "right")]
+        if len(rows) * 8 > len(self.numeric):
+            # Broad ranges: comparing the (already converted) column is cheaper than scattering positions
+            column = self.numeric.to_numpy(dtype=float, na_value=np.nan)
+            mask = _COMPARE[op](column, value)
+        else:
+            mask = np.zeros(len(self.numeric), dtype=bool)
+            mask[rows] = True
+            if op != "!=":
+                return mask
+            mask = ~mask
+        if op == "!=" and self.nullable:
+            mask &= self.numeric.notna().to_numpy(dtype=bool)
+        return mask
+
+
+def _sorted_index(numeric: pd.Series, owned: bool) -> SortedIndex:
+    values = numeric.to_numpy(dtype=float, na_value=np.nan)
+    order = np.argsort(values, kind="stable")
+    order = order[:int(np.count_nonzero(~np.isnan(values)))]
+    order = order.astype(np.int32 if len(values) < 2**31 else np.int64)
+    nullable = getattr(numeric.dtype, "na_value", None) is pd.NA
+    return SortedIndex(numeric=numeric, order=order, values=values[order], owned=owned, nullable=nullable)
+
+
+def _hash_index(series: pd.Series) -> HashIndex | None:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        values = series.cat.categories.astype(str).to_numpy(dtype=object)
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(values), codes)
+            values = np.append(values, "nan")
+    else:
+        codes, values = pd.factorize(series.astype(str))
+        if len(values) > max(1, CATEGORY_MAX_RATIO * len(series)):
+            return None
+        values = np.asarray(values, dtype=object)
+    lowered = np.array([text.lower() for text in values], dtype=object)
+    return HashIndex(codes=codes, values=values, lowered=lowered)
+
+
+class DatasetIndex:
+    """
+    Secondary indexes and pre-aggregations for one dataset, keyed by its
+    fingerprint. Each structure is built from the full DataFrame on first use
+    (or at upload with DATASET_INDEXES=upload) and kept until the dataset is
+    evicted, so repeated filters, group-bys and charts skip the column scan.
+    """
+
+    def __init__(self, fingerprint: str) -> None:
+        self.fingerprint = fingerprint
+        self._structures: dict[tuple, Any] = {}
+        # Structures dropped to stay within INDEX_MAX_MB; these are answered by scanning
+        self._skipped: set[tuple] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(_nbytes(structure) for structure in list(self._structures.values()))
+
+    def _get(self, key: tuple, build: Any) -> Any:
+        if key in self._structures:
+            return self._structures[key]
+        with self._lock:
+            if key in self._skipped:
+                return None
+            if key not in self._structures:
+                started = time.perf_counter()
+                structure = build()
+                _stats["builds"] += 1
+                _stats["build_seconds"] += time.perf_counter() - started
+                self._structures[key] = structure
+                _trim(self)
+            return self._structures.get(key)
+
+    def numeric(self, df: pd.DataFrame, col: Any) -> pd.Series | None:
+        """`as_numeric` of a column, converted once for text columns such as "$95,000" """
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series):
+            return as_numeric(series)
+        index = self._sorted(df, col)
+        return index.numeric if index is not None else as_numeric(series)
+
+    def datetimes(self, df: pd.DataFrame, col: Any) -> pd.Series | None:
+        """`as_datetime` of a column, parsed once for text dates"""
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            return df[col]
+        dates = self._get(("dates", col), lambda: as_datetime(df[col]))
+        return dates if dates is not None else as_datetime(df[col])
+
+    def _sorted(self, df: pd.DataFrame, col: Any) -> SortedIndex | None:
+        def build() -> SortedIndex | None:
+            numeric = as_numeric(df[col])
+            if numeric is None:
+                return None
+            return _sorted_index(numeric, owned=not pd.api.types.is_numeric_dtype(df[col]))
+        return self._get(("sorted", col), build)
+
+    def _hash(self, df: pd.DataFrame, col: Any) -> HashIndex | None:
+        return self._get(("hash", col), lambda: _hash_index(df[col]))
+
+    def filter_mask(self, df: pd.DataFrame, f: dict[str, Any]) -> np.ndarray | None:
+        """
+        Row mask for one plan filter, with the same semantics as the column scan
+        in planner.filter_mask; None when no index covers it.
+        """
+        series = df[f["column"]]
+        op, value = f["op"], f["value"]
+        numeric_dtype = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+        text_dtype = pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+        index: HashIndex | SortedIndex | None = None
+        if op == "contains" and not numeric_dtype:
+            index = self._hash(df, f["column"])
+        elif op in RANGE_OPS:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return None
+            index = self._sorted(df, f["column"])
+        elif op in ("==", "!="):
+            if isinstance(value, str) and text_dtype:
+                index = self._hash(df, f["column"])
+            elif numeric_dtype and isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+                index = self._sorted(df, f["column"])
+        if index is None:
+            return None
+        _stats["filter_hits"] += 1
+        return index.mask(op, value)
+
+    def group_aggregate(
+        self, df: pd.DataFrame, group: Any, column: Any | None, agg: str, freq: str | None = None
+    ) -> pd.Series | None:
+        """
+        Per-group aggregate over all rows from the cached group statistics (size,
+        count, sum, min, max of `column` per value of `group`, or per `freq`
+        period of a date column). Without a column, or with agg "count", the
+        group sizes. None for aggregations that need the rows (median, nunique).
+        """
+        if agg not in PREAGGREGATED:
+            return None
+        column = None if agg == "count" else column
+        key = ("groups", group, column, freq)
+        fresh = key not in self._structures
+        stats = self._get(key, lambda: self._group_stats(df, group, column, freq))
+        if stats is None:
+            return None
+        _stats["preagg_builds" if fresh else "preagg_hits"] += 1
+        if column is None:
+            return stats["size"]
+        if agg == "mean":
+            return stats["sum"] / stats["count"]
+        return stats["sum" if agg == "none" else agg]
+
+    def _group_stats(self, df: pd.DataFrame, group: Any, column: Any | None, freq: str | None) -> pd.DataFrame | None:
+        values = self.numeric(df, column) if column is not None else None
+        if column is not None and values is None:
+            return None
+        if freq is not None:
+            dates = self.datetimes(df, group)
+            if dates is None:
+                return None
+            valid = dates.notna()
+            keys = dates[valid].dt.to_period(freq)
+            values = values[valid] if values is not None else None
+        else:
+            keys = df[group]
+        if values is None:
+            return keys.groupby(keys, observed=True).size().to_frame("size")
+        return values.groupby(keys, observed=True).agg(["size", "count", "sum", "min", "max"])
+
+    def build(self, df: pd.DataFrame, profile: "DatasetProfile | None" = None) -> None:
+        """
+        Build every column index up front: hash indexes for text columns, sorted
+        indexes for numeric ones and parsed dates. Blocking; run it on the worker
+        pool.
+        """
+        for col in df.columns:
+            kind = profile.kind(col) if profile is not None else None
+            series = df[col]
+            if kind == "date":
+                self.datetimes(df, col)
+            elif kind == "numeric" or pd.api.types.is_numeric_dtype(series):
+                if not pd.api.types.is_bool_dtype(series):
+                    self._sorted(df, col)
+            elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+                self._hash(df, col)
+
+
+def _nbytes(structure: Any) -> int:
+    if isinstance(structure, (HashIndex, SortedIndex)):
+        return structure.nbytes
+    if isinstance(structure, pd.DataFrame):
+        return int(structure.memory_usage(index=True).sum())
+    if isinstance(structure, pd.Series):
+        return int(structure.memory_usage(index=True))
+    return 0
+
+
+_indexes: OrderedDict[str, DatasetIndex] = OrderedDict()
+_registry_lock = threading.Lock()
+_stats = {"builds": 0, "build_seconds": 0.0, "filter_hits": 0, "preagg_hits": 0, "preagg_builds": 0, "evictions": 0}
+
+
+def _trim(current: DatasetIndex) -> None:
+    """Evict the least recently used datasets' indexes past INDEX_MAX_MB"""
+    with _registry_lock:
+        total = sum(index.nbytes for index in _indexes.values())
+        for fingerprint in list(_indexes):
+            if total <= INDEX_MAX_BYTES:
+                return
+            if _indexes[fingerprint] is current:
+                continue
+            total -= _indexes.pop(fingerprint).nbytes
+            _stats["evictions"] += 1
+    # The current dataset alone is over budget: drop its newest structures and scan for those
+    for key in reversed(list(current._structures)):
+        if total <= INDEX_MAX_BYTES:
+            break
+        total -= _nbytes(current._structures.pop(key))
+        current._skipped.add(key)
+        _stats["evictions"] += 1
+        log.info("index over INDEX_MAX_MB, scanning instead", extra={"index": str(key)})
+
+
+def get_dataset_index(file_info: dict) -> DatasetIndex | None:
+    """
+    The index for an in-memory upload, created empty on first use. None when
+    indexes are off, for query engine uploads (DuckDB plans its own scans) and
+    with EXECUTOR_KIND=process, where the structures would be copied to the
+    worker on every call.
+    """
+    fingerprint = file_info.get('fingerprint')
+    if DATASET_INDEXES == "off" or EXECUTOR_KIND == "process" or not fingerprint or file_info.get('engine') is not None:
+        return None
+    with _registry_lock:
+        index = _indexes.get(fingerprint)
+        if index is None:
+            index = _indexes[fingerprint] = DatasetIndex(fingerprint)
+        _indexes.move_to_end(fingerprint)
+    return index
+
+
+def drop_dataset_index(fingerprint: str | None) -> None:
+    with _registry_lock:
+        _indexes.pop(fingerprint, None)
+
+
+def index_on_upload() -> bool:
+    return DATASET_INDEXES == "upload" and EXECUTOR_KIND != "process"
+
+
+def index_stats() -> dict[str, Any]:
+    with _registry_lock:
+        datasets = list(_indexes.values())
+    builds = _stats["builds"]
+    return {
+        "mode": DATASET_INDEXES,
+        "datasets": len(datasets),
+        "memory_mb": round(sum(index.nbytes for index in datasets) / (1024 * 1024), 1),
+        "builds": builds,
+        "avg_build_ms": round(_stats["build_seconds"] * 1000 / builds, 1) if builds else 0.0,
+        "filter_hits": _stats["filter_hits"],
+        "preagg_hits": _stats["preagg_hits"],
+        "preagg_builds": _stats["preagg_builds"],
+        "evictions": _stats["evictions"],
+    }
@@ -0,0 +1,233 @@
+import hashlib
+import math
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any
+
+import pandas as pd
+from fastapi import UploadFile
+
+from config.settings import CSV_CHUNK_ROWS, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES
+from services.excel import read_sheet
+from services.logs import get_logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:  # pyarrow is optional, pandas chunked parsing is the fallback
+    pa = None
+
+try:
+    from blake3 import blake3 as _content_hasher
+except ImportError:  # blake3 is optional and faster; sha256 is the fallback
+    _content_hasher = hashlib.sha256
+
+log = get_logger("ingest")
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES while it is being spooled."""
+
+
+@dataclass
+class IngestResult:
+    dataframe: pd.DataFrame
+    row_count: int
+    column_count: int
+    columns: list[str]
+    dtypes: dict[str, str]
+    numeric_cols: list[str]
+    sample_data: list[dict[str, Any]]
+    stats: dict[str, dict[str, float | None]]
+    size_bytes: int = 0
+
+
+@dataclass
+class _ColumnMoments:
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: float = math.inf
+    max: float = -math.inf
+
+    def merge(self, count: int, mean: float, m2: float, lo: float, hi: float) -> None:
+        # Chan et al. parallel update so chunk order does not affect the result
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, lo)
+        self.max = max(self.max, hi)
+
+
+@dataclass
+class _RunningStats:
+    """Accumulates describe()-style moments chunk by chunk while a file is parsed."""
+
+    moments: dict[str, _ColumnMoments] = field(default_factory=dict)
+    # Columns that showed a non-numeric chunk; their stats are recomputed at the end
+    dropped: set[str] = field(default_factory=set)
+
+    def _track(self, col: str, count: int, mean: float, m2: float, lo: float, hi: float) -> None:
+        if col in self.dropped:
+            return
+        self.moments.setdefault(col, _ColumnMoments()).merge(count, mean, m2, lo, hi)
+
+    def update_from_pandas(self, chunk: pd.DataFrame) -> None:
+        numeric = set(chunk.select_dtypes(include=['number']).columns)
+        for col in chunk.columns:
+            if col not in numeric:
+                self.dropped.add(col)
+                self.moments.pop(col, None)
+                continue
+            values = chunk[col].dropna()
+            if values.empty:
+                continue
+            n = len(values)
+            self._track(col, n, float(values.mean()), float(values.var(ddof=0)) * n,
+                        float(values.min()), float(values.max()))
+
+    def update_from_arrow(self, batch: "pa.RecordBatch") -> None:
+        for col, array in zip(batch.schema.names, batch.columns):
+            if not (pa.types.is_integer(array.type) or pa.types.is_floating(array.type)):
+                self.dropped.add(col)
+                self.moments.pop(col, None)
+                continue
+            n = pc.count(array).as_py()
+            if n == 0:
+                continue
+            values = pc.cast(array, pa.float64())
+            bounds = pc.min_max(values)
+            self._track(col, n, pc.mean(values).as_py(), pc.variance(values, ddof=0).as_py() * n,
+                        bounds['min'].as_py(), bounds['max'].as_py())
+
+    def describe(self, df: pd.DataFrame, numeric_cols: list[str]) -> dict[str, dict[str, float | None]]:
+        """Finish the describe() table; quartiles need the full column so they come from df."""
+        if not numeric_cols:
+            return {}
+        quartiles = df[numeric_cols].quantile([0.25, 0.5, 0.75])
+        stats: dict[str, dict[str, float | None]] = {}
+        for col in numeric_cols:
+            m = self.moments.get(col)
+            if m is None or m.count == 0:
+                described = df[col].describe()
+                stats[col] = {k: _clean(v) for k, v in described.items()}
+                continue
+            std = math.sqrt(m.m2 / (m.count - 1)) if m.count > 1 else float('nan')
+            stats[col] = {
+                'count': float(m.count),
+                'mean': _clean(m.mean),
+                'std': _clean(std),
+                'min': _clean(m.min),
+                '25%': _clean(quartiles.at[0.25, col]),
+                '50%': _clean(quartiles.at[0.5, col]),
+                '75%': _clean(quartiles.at[0.75, col]),
+                'max': _clean(m.max),
+            }
+        return stats
+
+
+def _clean(value: Any) -> float | None:
+    return float(value) if not pd.isna(value) else None
+
+
+async def spool_upload(file: UploadFile, suffix: str) -> tuple[str, int, str]:
+    """
+    Copy an upload to a temp file in fixed-size chunks so the whole body never
+    has to sit in memory, hashing the bytes as they stream past. Returns the
+    temp path, the number of bytes written and a content id (hex digest of the
+    file type and bytes) under which identical uploads share one dataset.
+    """
+    fd, path = tempfile.mkstemp(prefix="insightxl-", suffix=suffix)
+    size = 0
+    hasher = _content_hasher()
+    hasher.update(suffix.encode() + b"\0")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(
+                        f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+                    )
+                hasher.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, size, hasher.hexdigest()
+
+
+def _read_csv_arrow(path: str, running: _RunningStats) -> pd.DataFrame:
+    reader = pacsv.open_csv(path)
+    batches = []
+    for batch in reader:
+        running.update_from_arrow(batch)
+        batches.append(batch)
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    del batches
+    # self_destruct releases Arrow buffers as columns are converted, keeping peak near one copy
+    return table.to_pandas(self_destruct=True, split_blocks=True)
+
+
+def _read_csv_chunked(path: str, running: _RunningStats) -> pd.DataFrame:
+    chunks = []
+    for chunk in pd.read_csv(path, chunksize=CSV_CHUNK_ROWS):
+        running.update_from_pandas(chunk)
+        chunks.append(chunk)
+    if not chunks:
+        return pd.read_csv(path)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_csv_streaming(path: str) -> tuple[pd.DataFrame, _RunningStats]:
+    """Parse a CSV incrementally, preferring pyarrow's streaming reader when installed."""
+    if pa is not None:
+        running = _RunningStats()
+        try:
+            return _read_csv_arrow(path, running), running
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            # Arrow infers types from the first block; mixed columns fall back to pandas
+            log.warning(f"pyarrow CSV reader failed, falling back to pandas: {e}")
+    running = _RunningStats()
+    return _read_csv_chunked(path, running), running
+
+
+def read_file(path: str, file_ext: str, sheet_index: int = 0) -> tuple[pd.DataFrame, _RunningStats]:
+    """Parse a spooled upload (one sheet of a workbook) into a DataFrame. Blocking; run it on the worker pool."""
+    if file_ext == '.csv':
+        return read_csv_streaming(path)
+    return read_sheet(path, file_ext, sheet_index), _RunningStats()
+
+
+def describe_columns(df: pd.DataFrame, numeric_cols: list[str]) -> dict[str, dict[str, float | None]]:
+    """describe() stats for some numeric columns of a stored frame, e.g. after an edit."""
+    return _RunningStats().describe(df, numeric_cols)
+
+
+def profile_frame(df: pd.DataFrame, running: _RunningStats, size_bytes: int = 0) -> IngestResult:
+    """Build the row count, dtypes, sample rows and describe() stats for a parsed upload."""
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    row_count, column_count = df.shape
+
+    return IngestResult(
+        dataframe=df,
+        row_count=row_count,
+        column_count=column_count,
+        columns=df.columns.tolist(),
+        dtypes={k: str(v) for k, v in df.dtypes.to_dict().items()},
+        numeric_cols=numeric_cols,
+        sample_data=df.head(5).to_dict(orient='records'),
+        stats=running.describe(df, numeric_cols),
+        size_bytes=size_bytes,
+    )
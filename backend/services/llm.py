@@ -1,25 +1,44 @@
-import os
+import asyncio
+import time
+from collections.abc import AsyncIterator
 from typing import Any
 
-from dotenv import load_dotenv
-from openai import AsyncOpenAI
+from config.settings import CONVERSATION_SUMMARY_TOKENS, QUERY_PLANNER
+from models.schemas import CellUpdate, ChatRequest, ChatResponse, UpdateRange
+from services.cache import get_response_cache, response_cache_key
+from services.charts import ChartError, chart_schema, compute_chart, suggest_chart_spec, validate_chart_spec
+from services.context import build_prompt_context, record_context
+from services.conversations import Conversation, digest_turns, get_conversation_store, refers_back
+from services.engine import EngineError
+from services.executor import run_stage
+from services.gateway import cached_tokens, get_llm_gateway
+from services.indexes import get_dataset_index
+from services.logs import get_logger
+from services.planner import (
+    ComputedResult,
+    PlanError,
+    execute_plan,
+    markdown_table,
+    parse_rule_plan,
+    render_computed_report,
+)
+from services.sandbox import FUNCTIONS, OperationError, SandboxLimitExceeded, parse_operations, run_operations
+from services.sql import ENABLED as SQL_ENABLED, SQLError, record_sql, run_sql, schema_text, sql_cache_key
+from services.wire import sheet_preview, sheet_to_frame
 
-from models.schemas import ChatRequest, ChatResponse
+log = get_logger("llm")
 
 
-load_dotenv()
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-
-client: AsyncOpenAI | None = None
-
-
-def get_openai_client() -> AsyncOpenAI | None:
-    """Lazy initialization of OpenAI client"""
-    global client
-    if client is None and OPENAI_API_KEY:
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-    return client
+# Models used for /chat/query; part of the response cache key
+ANALYSIS_MODEL = "gpt-4o"
+# The chart model only picks columns and an aggregation; the data is computed locally
+CHART_MODEL = "gpt-4o-mini"
+# Small model for structured query plans and for narrating locally computed results
+PLANNER_MODEL = "gpt-4o-mini"
+SQL_MODEL = "gpt-4o-mini"
+NARRATION_MODEL = "gpt-4o-mini"
+SUMMARY_MODEL = "gpt-4o-mini"
+SUGGESTIONS_MODEL = "gpt-4o-mini"
 
 
 SYSTEM_PROMPT = """
@@ -35,57 +54,173 @@ Your job:
 - optionally, propose a chart specification (type, data range, labels)
 - respond with a concise, user-friendly explanation of what you did or suggest.
 
-For now, you are only returning high-level natural language guidance.
-The backend will later execute pandas operations based on your instructions.
+Respond in plain language; do not write code.
 """
 
+AGENT_OPERATIONS_PROMPT = """You are InsightXL, an Excel / spreadsheet AI agent. You change the user's sheet
+by returning operations; the backend runs them on every row and shows the result.
 
-async def run_llm_agent(payload: ChatRequest) -> ChatResponse:
-    """
-    Thin wrapper around GPT-4o (or similar) with a stable interface for the rest
-    of the backend. Right now it returns a simple reply; you can evolve this
-    into a tool-calling / code-writing agent that generates pandas code.
-    """
-    client = get_openai_client()
-    if client is None:
-        # Fallback behavior when API key is not configured.
-        return ChatResponse(
-            reply=(
-                "InsightXL is not fully configured yet (missing OpenAI API key). "
-                "However, based on your message I would: "
-                f'"{payload.message}". Once configured, I will analyze your sheet '
-                "and generate concrete transformations and visualizations."
-            )
-        )
+Return ONLY this JSON object:
+{
+  "reply": "Short, friendly explanation of what you did (or why nothing was changed)",
+  "operations": [ ... ],
+  "chart": null or {"chartType": "bar" | "line" | "pie" | "area" | "radar", "x": "<column>",
+                    "y": "<numeric column>" or null, "agg": "sum" | "mean" | "median" | "min" | "max" | "count" | "none",
+                    "title": "...", "description": "...", "xAxisLabel": "...", "yAxisLabel": "..."}
+}
+
+OPERATIONS (applied in order):
+- {"op": "set_column", "column": "<new or existing column>", "expr": "<expression>", "where": "<condition>" (optional, only those rows change)}
+- {"op": "filter_rows", "where": "<condition>"}  keeps matching rows
+- {"op": "sort", "by": ["<column>", ...], "ascending": true | false}
+- {"op": "drop_columns", "columns": ["<column>", ...]}
+- {"op": "rename_columns", "mapping": {"<old name>": "<new name>"}}
+- {"op": "fill_missing", "column": "<column>", "value": <value>}
+- {"op": "drop_duplicates", "columns": ["<column>", ...] or omitted for whole rows}
+
+EXPRESSIONS are formulas over whole columns:
+- Columns: a bare name (Salary) or col("Annual Salary") for names with spaces or symbols
+- Operators: + - * / // % ** == != < <= > >= and or not, and "a if condition else b"
+- Functions: {functions}
+- Text values in quotes: where(Rating >= 4, "top", "other")
+
+Use ONLY the exact column names listed. Use "operations": [] when the user only asks a question.
+Output ONLY valid JSON."""
+
+
+AGENT_MODEL = "gpt-4o-mini"
 
-    messages: list[dict[str, Any]] = [
+
+# Rows of the sheet shown to the prose agent; the full sheet is never serialized into the prompt
+AGENT_PREVIEW_ROWS = 20
+# The agent edits whole sheets; files handled by the query engine (services/engine.py) are only queried
+READ_ONLY_REPLY = (
+    "This file is too large to edit here. Ask questions about it in the analysis chat, "
+    "or edit it in Excel and upload it again."
+)
+
+
+def _agent_messages(payload: ChatRequest) -> list[dict[str, Any]]:
+    import json
+    
+    snapshot = "None"
+    if payload.sheet is not None:
+        rows, total = sheet_preview(payload.sheet, AGENT_PREVIEW_ROWS)
+        snapshot = f"{payload.sheet.name} ({total} data rows), header and first rows: {json.dumps(rows, default=str)}"
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
         {
             "role": "user",
             "content": (
                 f"User message: {payload.message}\n\n"
-                f"Sheet snapshot (may be empty): {payload.sheet.model_dump() if payload.sheet else 'None'}"
+                f"Sheet snapshot (may be empty): {snapshot}"
             ),
         },
     ]
 
-    completion = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        temperature=0.3,
+
+def _not_configured_reply(payload: ChatRequest) -> str:
+    return (
+        "InsightXL is not fully configured yet (missing OpenAI API key). "
+        "However, based on your message I would: "
+        f'"{payload.message}". Once configured, I will analyze your sheet '
+        "and generate concrete transformations and visualizations."
     )
 
-    reply = completion.choices[0].message.content or ""
-    return ChatResponse(reply=reply)
 
+def _operations_messages(payload: ChatRequest, df: Any, file_info: dict | None) -> list[dict[str, Any]]:
+    profile = file_info.get('profile') if file_info else None
+    schema = chart_schema(df, profile=profile)
+    return [
+        {"role": "system", "content": AGENT_OPERATIONS_PROMPT.replace("{functions}", ", ".join(f"{name}()" for name in FUNCTIONS))},
+        {"role": "user", "content": f"SHEET ({len(df)} rows) COLUMNS:\n{schema}\n\nUSER MESSAGE: {payload.message}"},
+    ]
 
-async def generate_suggestions(df: Any, columns: list[str], numeric_cols: list[str]) -> list[str]:
+
+async def _agent_frame(payload: ChatRequest, file_info: dict | None) -> Any:
+    if file_info is not None:
+        return file_info['dataframe']
+    if payload.sheet is not None:
+        df = await run_stage("sheet", sheet_to_frame, payload.sheet)
+        return df if df.shape[1] else None
+    return None
+
+
+async def run_llm_agent(payload: ChatRequest, file_info: dict | None = None) -> ChatResponse:
+    """
+    The /chat agent. Without a sheet it only replies. With a sheet snapshot or an
+    uploaded file, the model answers with operations (see services/sandbox.py) that
+    are run in a resource-limited worker process and returned as cell updates,
+    where row 0 is the header row, plus an optional computed chart.
+    """
+    import json
+    
+    gateway = get_llm_gateway()
+    if gateway is None:
+        # Fallback behavior when API key is not configured.
+        return ChatResponse(reply=_not_configured_reply(payload))
+
+    if file_info is not None and file_info.get('engine') is not None:
+        return ChatResponse(reply=READ_ONLY_REPLY)
+
+    df = await _agent_frame(payload, file_info)
+    if df is None:
+        completion = await gateway.complete(
+            model=AGENT_MODEL,
+            messages=_agent_messages(payload),
+            temperature=0.3,
+        )
+        reply = completion.choices[0].message.content or ""
+        return ChatResponse(reply=reply)
+
+    messages = await run_stage("prompt", _operations_messages, payload, df, file_info)
+    completion = await gateway.complete(
+        model=AGENT_MODEL,
+        messages=messages,
+        temperature=0.1,
+        response_format={"type": "json_object"},
+    )
+    content = completion.choices[0].message.content or ""
+    try:
+        plan = json.loads(content)
+    except json.JSONDecodeError:
+        return ChatResponse(reply=content)
+    if not isinstance(plan, dict):
+        return ChatResponse(reply=content)
+    
+    reply = str(plan.get("reply") or "")
+    chart = plan.get("chart") if isinstance(plan.get("chart"), dict) else None
+    try:
+        operations = parse_operations(plan.get("operations") or [])
+        if not operations and chart is None:
+            return ChatResponse(reply=reply)
+        result = await run_operations(df, operations, chart, ranges=payload.update_format == "ranges")
+    except (OperationError, SandboxLimitExceeded) as e:
+        log.warning(f"Agent operations not applied: {e}")
+        return ChatResponse(reply=f"{reply}\n\nI could not apply these changes: {e}".strip())
+    
+    notes = list(result.notes)
+    if result.returned_cells < result.changed_cells:
+        notes.append(f"Showing the first {result.returned_cells:,} of {result.changed_cells:,} changed cells.")
+    updates = [CellUpdate.model_construct(row=row, col=col, value=value) for row, col, value in result.updates]
+    ranges = [UpdateRange.model_construct(row=row, col=col, values=values) for row, col, values in result.ranges or []]
+    return ChatResponse(
+        reply="\n\n".join([reply, *notes]).strip(), updates=updates, ranges=ranges, chart_spec=result.chart
+    )
+
+
+async def generate_suggestions(
+    df: Any, columns: list[str], numeric_cols: list[str], cache_key: str | None = None
+) -> list[str]:
     """
     Generate smart suggestions based on the uploaded data.
     Analyzes the DataFrame and returns relevant questions/operations.
+    Suggestions from the model are stored in the response cache under `cache_key` when given.
     """
-    client = get_openai_client()
-    if client is None:
+    import json
+    
+    gateway = get_llm_gateway()
+    if gateway is None:
         # Fallback suggestions when API key is not configured
         return [
             "What is the summary statistics of the numerical columns?",
@@ -109,8 +244,8 @@ Make the questions specific to the actual column names and data types in the dat
 Return ONLY the 3 questions, one per line, without numbering or extra formatting."""
     
     try:
-        completion = await client.chat.completions.create(
-            model="gpt-4o-mini",
+        completion = await gateway.complete(
+            model=SUGGESTIONS_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": data_info},
@@ -123,6 +258,9 @@ Return ONLY the 3 questions, one per line, without numbering or extra formatting
         # Split by newlines and filter empty lines
         suggestions = [s.strip() for s in suggestions_text.strip().split('\n') if s.strip()]
         
+        if suggestions and cache_key:
+            get_response_cache().set(cache_key, json.dumps(suggestions[:3]))
+        
         # Return up to 3 suggestions
         return suggestions[:3] if suggestions else [
             "What are the key insights from this data?",
@@ -130,7 +268,7 @@ Return ONLY the 3 questions, one per line, without numbering or extra formatting
             "What patterns do you see in the data?"
         ]
     except Exception as e:
-        print(f"Error generating suggestions: {e}")
+        log.error(f"Error generating suggestions: {e}")
         return [
             "What are the key insights from this data?",
             "Can you show me summary statistics?",
@@ -158,194 +296,329 @@ def is_chart_request(query: str) -> bool:
     return False
 
 
-async def generate_chart_data(query: str, dataframe: Any, file_info: dict) -> str:
-    """
-    Generate chart data JSON for visualization requests.
-    Returns a JSON string that the frontend can parse and render as a chart.
-    """
-    import json
-    
-    client = get_openai_client()
-    if client is None:
-        return json.dumps({
-            "type": "error",
-            "message": "InsightXL is not configured (missing OpenAI API key)."
-        })
-    
-    df = dataframe
-    
-    # Prepare column information
-    columns_info = list(df.columns)
-    sample_data = df.head(10).to_dict('records')
-    
-    data_context = f"""
-AVAILABLE COLUMNS: {columns_info}
-
-SAMPLE DATA (first 10 rows):
-{json.dumps(sample_data, default=str, indent=2)}
-
-TOTAL ROWS: {len(df)}
-"""
-    
-    system_prompt = """You are a Chart Data Generator. Your ONLY job is to output valid JSON for chart visualization.
-
-When the user requests a chart, you MUST:
-1. Analyze the data to find the appropriate columns
-2. Extract the actual data values from the dataset
-3. Return a JSON object with the chart configuration
-
-OUTPUT FORMAT - Return ONLY this JSON structure, nothing else:
+CHART_SPEC_SYSTEM_PROMPT = """You are a chart designer. You pick WHAT to plot; the backend computes the data.
 
+Given the column list and the user's request, return ONLY this JSON object:
 {
-  "type": "chart",
   "chartType": "bar" | "line" | "pie" | "area" | "radar",
+  "x": "<column for categories / x-axis>",
+  "y": "<numeric column for values>" or null to count rows,
+  "agg": "sum" | "mean" | "median" | "min" | "max" | "count" | "none",
   "title": "A descriptive title for the chart",
   "description": "Brief explanation of what this chart shows",
   "xAxisLabel": "Label for X-axis",
-  "yAxisLabel": "Label for Y-axis", 
-  "data": [
-    {"name": "Category1", "value": 100},
-    {"name": "Category2", "value": 200}
-  ],
-  "insights": ["Key insight 1", "Key insight 2", "Key insight 3"]
+  "yAxisLabel": "Label for Y-axis"
 }
 
 CHART TYPE MAPPING:
-- "bar chart", "bar", "column" → "bar"
-- "line chart", "line", "trend" → "line"  
+- "bar chart", "bar", "column", "histogram" → "bar"
+- "line chart", "line", "trend" → "line"
 - "pie chart", "pie", "donut" → "pie"
 - "area chart", "area" → "area"
 - "radar chart", "radar", "spider" → "radar"
 
-CRITICAL RULES:
-1. Output ONLY valid JSON - no markdown, no explanation, no extra text
-2. Use the ACTUAL data values from the dataset
-3. The "data" array should contain real values from the spreadsheet
-4. For pie/donut charts, use "name" and "value" keys
-5. For bar/line/area charts, use the actual column names as keys
-6. Include 3 meaningful insights about the chart data
-
-EXAMPLE for a bar chart request with "Full Name" on x-axis and "Annual Salary" on y-axis:
-{
-  "type": "chart",
-  "chartType": "bar",
-  "title": "Employee Annual Salaries",
-  "description": "Comparison of annual salaries across all employees",
-  "xAxisLabel": "Full Name",
-  "yAxisLabel": "Annual Salary ($)",
-  "data": [
-    {"name": "John Smith", "value": 95000},
-    {"name": "Jane Doe", "value": 85000}
-  ],
-  "insights": [
-    "Highest salary: John Smith at $95,000",
-    "Salary range spans from $X to $Y",
-    "Average salary is approximately $Z"
-  ]
-}
+RULES:
+1. Use ONLY exact column names from the list.
+2. Use "agg": "none" only when x identifies individual rows (e.g. a name or ID) and each row is one point.
+3. To show a distribution of one numeric column, set "x" to that column, "y": null and "agg": "count".
+4. Output ONLY valid JSON - no markdown, no explanation."""
 
-Remember: OUTPUT ONLY THE JSON OBJECT. No other text."""
 
-    user_message = f"""DATA CONTEXT:
-{data_context}
+async def pick_chart_spec(query: str, dataframe: Any, file_info: dict) -> dict:
+    """
+    Choose chart type, columns and aggregation. The LLM only sees the column
+    schema, so the prompt size is independent of the row count; without an API
+    key, or if the model's spec is unusable, a rule-based spec is used.
+    """
+    import json
+    
+    gateway = get_llm_gateway()
+    if gateway is not None:
+        profile = file_info.get('profile')
+        schema = profile.chart_schema() if profile is not None else await run_stage("prompt", chart_schema, dataframe)
+        try:
+            completion = await gateway.complete(
+                model=CHART_MODEL,
+                messages=[
+                    {"role": "system", "content": CHART_SPEC_SYSTEM_PROMPT},
+                    {"role": "user", "content": f"COLUMNS ({file_info['row_count']} rows):\n{schema}\n\nUSER REQUEST: {query}"},
+                ],
+                temperature=0.1,  # Very low for consistent JSON output
+                max_tokens=300,
+                response_format={"type": "json_object"},
+            )
+            spec = json.loads(completion.choices[0].message.content or "{}")
+            return validate_chart_spec(spec, dataframe)
+        except (ChartError, json.JSONDecodeError) as e:
+            log.warning(f"Discarding chart spec from model: {e}")
+        except Exception as e:
+            log.error(f"Error choosing chart spec: {e}")
+    
+    return await run_stage("plan", suggest_chart_spec, query, dataframe, file_info.get('profile'))
 
-FULL DATA FOR CHART (use ALL rows):
-{df.to_json(orient='records', default_handler=str)}
 
-USER REQUEST: {query}
+async def generate_chart_data(query: str, dataframe: Any, file_info: dict, cache_key: str | None = None) -> str:
+    """
+    Generate chart data JSON for visualization requests.
+    Returns a JSON string that the frontend can parse and render as a chart.
+    The series is aggregated and downsampled server-side (see services/charts.py).
+    Valid chart JSON is stored in the response cache under `cache_key` when given.
+    """
+    import json
+    
+    try:
+        spec = await pick_chart_spec(query, dataframe, file_info)
+        engine = file_info.get('engine')
+        if engine is not None:
+            chart = await run_stage("chart", engine.compute_chart, spec, dataframe, profile=file_info.get('profile'))
+        else:
+            chart = await run_stage(
+                "chart", compute_chart, dataframe, spec, profile=file_info.get('profile'), index=get_dataset_index(file_info)
+            )
+    except (ChartError, EngineError) as e:
+        return json.dumps({
+            "type": "error",
+            "message": f"Failed to generate chart data: {e}. Please try rephrasing your request."
+        })
+    
+    response = json.dumps(chart)
+    if cache_key:
+        get_response_cache().set(cache_key, response)
+    return response
 
-Generate the chart JSON using the ACTUAL data from the spreadsheet. Include ALL data points."""
 
+PLANNER_SYSTEM_PROMPT = """You translate a question about a table into a JSON operation plan.
+
+Return ONLY a JSON object with this shape:
+{
+  "op": "aggregate" | "count" | "top_n" | "group_by" | "filter" | "none",
+  "column": "<numeric column to aggregate or sort by>",
+  "agg": "sum" | "mean" | "median" | "min" | "max" | "count" | "nunique",
+  "group_by": "<column to group by>",
+  "n": <number of rows or groups to return>,
+  "ascending": true | false,
+  "filters": [{"column": "<column>", "op": "==" | "!=" | ">" | ">=" | "<" | "<=" | "contains", "value": <value>}]
+}
+
+Rules:
+- Use ONLY the exact column names provided.
+- Use "op": "none" when the question needs judgement, explanation or anything beyond
+  a single aggregation, ranking, grouping, count or filter.
+- Numbers in filters must be plain numbers (80000, not "80k")."""
+
+
+async def plan_query_with_llm(query: str, file_info: dict) -> dict | None:
+    """
+    Ask a small model for an operation plan when the rule-based parser cannot handle
+    the phrasing. Returns None when the model declines or the output is unusable.
+    Plans and declines are cached by dataset fingerprint and normalized question,
+    so asking again does not wait for the planner.
+    """
+    import json
+    
+    gateway = get_llm_gateway()
+    if gateway is None:
+        return None
+    
+    cache = get_response_cache()
+    key = response_cache_key(file_info['fingerprint'], query, mode="plan", model=PLANNER_MODEL) \
+        if file_info.get('fingerprint') else None
+    cached = cache.get(key) if key else None
+    if cached is not None:
+        return json.loads(cached)
+    
+    profile = file_info.get('profile')
+    schema = profile.schema_text if profile is not None else "\n".join(
+        f"- {col}: {dtype}" for col, dtype in file_info['dtypes'].items()
+    )
     try:
-        completion = await client.chat.completions.create(
-            model="gpt-4o",
+        completion = await gateway.complete(
+            model=PLANNER_MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
+                {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+                {"role": "user", "content": f"COLUMNS:\n{schema}\n\nQUESTION: {query}"},
             ],
-            temperature=0.1,  # Very low for consistent JSON output
-            max_tokens=3000,
+            temperature=0,
+            max_tokens=300,
+            response_format={"type": "json_object"},
         )
-        
-        response = completion.choices[0].message.content or ""
-        
-        # Clean up the response - remove markdown code blocks if present
-        response = response.strip()
-        if response.startswith("```json"):
-            response = response[7:]
-        if response.startswith("```"):
-            response = response[3:]
-        if response.endswith("```"):
-            response = response[:-3]
-        response = response.strip()
-        
-        # Validate it's valid JSON
-        try:
-            parsed = json.loads(response)
-            # Ensure it has the chart type marker
-            if "type" not in parsed:
-                parsed["type"] = "chart"
-            return json.dumps(parsed)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, return error
-            return json.dumps({
-                "type": "error",
-                "message": "Failed to generate chart data. Please try rephrasing your request."
-            })
-        
+        plan = json.loads(completion.choices[0].message.content or "{}")
     except Exception as e:
-        print(f"Error generating chart: {e}")
-        return json.dumps({
-            "type": "error",
-            "message": f"Error generating chart: {str(e)}"
-        })
+        log.error(f"Error planning query: {e}")
+        return None
+    
+    if not isinstance(plan, dict) or plan.get("op") in (None, "none"):
+        plan = None
+    if key:
+        cache.set(key, json.dumps(plan))
+    return plan
+
+
+SQL_SYSTEM_PROMPT = """You answer questions about a table by writing one DuckDB SQL query.
+
+Return ONLY a JSON object with this shape:
+{"sql": "<one SELECT query>", "title": "<short title for the result>"}
 
+Rules:
+- Query ONLY the table named data, with the exact column names provided (in double quotes).
+- Write a single read-only SELECT (CTEs are fine). Use standard aggregate, window, text and date functions only.
+- Return a small result: aggregate, group, or ORDER BY with a LIMIT rather than listing every row.
+- Match text values exactly as listed in the schema; use ILIKE for partial matches.
+- Return {"sql": null} when the question needs judgement or explanation rather than a computed table."""
 
-async def answer_query_with_context(query: str, dataframe: Any, file_info: dict) -> str:
+
+async def write_sql_with_llm(
+    query: str, schema: str, previous: dict | None = None, error: str | None = None
+) -> dict | None:
     """
-    Answer a user query using ONLY the provided DataFrame context.
-    This prevents hallucinations by grounding responses in actual data.
-    
-    Has TWO MODES:
-    1. CHART MODE: If user requests a chart, return JSON for visualization
-    2. ANALYSIS MODE: For all other queries, return professional text report
+    Ask a small model for a SQL query answering the question; `previous` and
+    `error` describe a failed attempt to fix. Returns {"sql", "title"}, or None
+    when the model declines or the output is unusable.
     """
+    import json
     
-    # Check if this is a chart request
-    if is_chart_request(query):
-        return await generate_chart_data(query, dataframe, file_info)
+    gateway = get_llm_gateway()
+    if gateway is None:
+        return None
     
-    # Otherwise, continue with analysis mode
-    client = get_openai_client()
-    if client is None:
-        return "InsightXL is not fully configured yet (missing OpenAI API key). Please configure the API key to use this feature."
+    messages = [
+        {"role": "system", "content": SQL_SYSTEM_PROMPT},
+        {"role": "user", "content": f"{schema}\n\nQUESTION: {query}"},
+    ]
+    if previous is not None:
+        messages.append({"role": "assistant", "content": json.dumps(previous)})
+        messages.append({"role": "user", "content": f"That query failed: {error}\nReturn a corrected query."})
+    try:
+        completion = await gateway.complete(
+            model=SQL_MODEL,
+            messages=messages,
+            temperature=0,
+            max_tokens=500,
+            response_format={"type": "json_object"},
+        )
+        compiled = json.loads(completion.choices[0].message.content or "{}")
+    except Exception as e:
+        log.error(f"Error writing SQL: {e}")
+        return None
     
-    # Prepare comprehensive data context
-    df = dataframe
+    if not isinstance(compiled, dict) or not isinstance(compiled.get("sql"), str) or not compiled["sql"].strip():
+        return None
+    record_sql("generated")
+    return {"sql": compiled["sql"], "title": str(compiled.get("title") or "") or None}
+
+
+async def compute_sql_answer(query: str, dataframe: Any, file_info: dict) -> ComputedResult | None:
+    """
+    Answer a question with one model-written SQL query, validated and run locally
+    over every row (see services/sql.py). The query is cached by dataset
+    fingerprint and normalized question, so asking again skips the model; a
+    query that fails is sent back to the model once with the error.
+    Returns None when the model declines or no query ran.
+    """
+    import json
     
-    # Get data summary - send more data for better analysis
-    # For small datasets (< 100 rows), send all data
-    # For large datasets, send first 50 rows + summary
-    max_rows_to_show = 100 if len(df) <= 100 else 50
+    cache = get_response_cache()
+    key = sql_cache_key(file_info['fingerprint'], query, SQL_MODEL) if file_info.get('fingerprint') else None
+    cached = cache.get(key) if key else None
+    if cached is not None:
+        compiled = json.loads(cached)
+        try:
+            result = await run_stage("compute", run_sql, compiled["sql"], dataframe, file_info, compiled.get("title"))
+            record_sql("cache_hits")
+            return result
+        except SQLError as e:
+            log.warning(f"Discarding cached SQL {compiled['sql']!r}: {e}")
     
-    data_display = df.head(max_rows_to_show).to_string(index=False)
-    rows_info = f"ALL {len(df)} ROWS" if len(df) <= max_rows_to_show else f"FIRST {max_rows_to_show} OF {len(df)} ROWS"
+    schema = await run_stage("prompt", schema_text, dataframe, file_info)
+    compiled, error = None, None
+    for _ in range(2):
+        compiled = await write_sql_with_llm(query, schema, compiled, error)
+        if compiled is None:
+            return None
+        try:
+            result = await run_stage("compute", run_sql, compiled["sql"], dataframe, file_info, compiled["title"])
+        except SQLError as e:
+            log.warning(f"Discarding SQL {compiled['sql']!r}: {e}")
+            error = str(e)
+            continue
+        if key:
+            cache.set(key, json.dumps(compiled))
+        return result
+    return None
+
+
+async def compute_answer(query: str, dataframe: Any, file_info: dict) -> ComputedResult | None:
+    """
+    Plan a question and, if it is a plain aggregation, compute the answer with
+    pandas over the full DataFrame, using the upload's indexes (or with the query
+    engine over every row of a large file, whose DataFrame is a sample). With QUERY_PLANNER=sql, questions
+    the rules cannot plan get a model-written SQL query instead of a JSON plan.
+    Returns None when the question needs the LLM.
+    """
+    if QUERY_PLANNER == "off":
+        return None
     
-    data_summary = f"""
-FILE: {file_info['filename']}
-SHAPE: {file_info['row_count']} rows × {file_info['column_count']} columns
+    plan = await run_stage("plan", parse_rule_plan, query, dataframe, file_info.get('profile'))
+    if plan is None and QUERY_PLANNER == "sql" and SQL_ENABLED:
+        return await compute_sql_answer(query, dataframe, file_info)
+    if plan is None and QUERY_PLANNER in ("llm", "sql"):
+        plan = await plan_query_with_llm(query, file_info)
+    if plan is None:
+        return None
+    
+    try:
+        engine = file_info.get('engine')
+        if engine is not None:
+            return await run_stage("compute", engine.execute_plan, plan, dataframe)
+        return await run_stage("compute", execute_plan, dataframe, plan, get_dataset_index(file_info))
+    except (PlanError, KeyError, TypeError, ValueError) as e:
+        log.warning(f"Discarding query plan {plan}: {e}")
+        return None
 
-COLUMNS AND TYPES:
-{chr(10).join([f"- {col}: {dtype}" for col, dtype in file_info['dtypes'].items()])}
 
-COMPLETE DATA ({rows_info}):
-{data_display}
+def _narration_messages(query: str, result: ComputedResult, file_info: dict) -> list[dict[str, Any]]:
+    user_message = f"""FILE: {file_info['filename']} ({file_info['row_count']} rows × {file_info['column_count']} columns)
 
-STATISTICAL SUMMARY (numeric columns):
-{df.describe().to_string() if not df.select_dtypes(include=['number']).empty else 'No numeric columns'}
-"""
+USER QUESTION: {query}
+
+The answer below was computed EXACTLY over ALL {result.rows_scanned} rows.
+Do not recompute or alter these numbers; explain them.
+
+METHODOLOGY: {result.methodology}
+
+RESULT ({result.title}):
+{markdown_table(result.table)}
+
+Write the report in the mandatory format, using the result table above as the Data Results table."""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+async def narrate_computed_result(query: str, result: ComputedResult, file_info: dict) -> str:
+    """
+    Turn an exact computed result into the standard analyst report. The model only
+    sees the result table, so the prompt stays small regardless of file size.
+    """
+    gateway = get_llm_gateway()
+    if gateway is None:
+        return render_computed_report(result)
     
-    system_prompt = """You are a Senior Data Analyst for a Fortune 500 company. 
+    try:
+        completion = await gateway.complete(
+            model=NARRATION_MODEL,
+            messages=_narration_messages(query, result, file_info),
+            temperature=0.3,
+            max_tokens=1200,
+        )
+        return completion.choices[0].message.content or render_computed_report(result)
+    except Exception as e:
+        log.error(f"Error narrating computed result: {e}")
+        return render_computed_report(result)
+
+
+ANALYSIS_SYSTEM_PROMPT = """You are a Senior Data Analyst for a Fortune 500 company. 
 Your job is to analyze data and produce professional, executive-level reports.
 
 CRITICAL RULES:
@@ -395,14 +668,30 @@ FORMATTING RULES:
 
 TONE: Professional, objective, insightful, and executive-ready.
 Never give a simple list. Always provide a complete analytical report."""
-    
-    user_message = f"""DATA CONTEXT:
-{data_summary}
 
-USER QUESTION: {query}
 
-MANDATORY INSTRUCTIONS:
-1. Use ALL {file_info['row_count']} rows of data in your analysis - do not truncate or omit any records
+def _query_cache_key(query: str, file_info: dict, chart_mode: bool, use_cache: bool) -> str | None:
+    if not use_cache or not file_info.get('fingerprint'):
+        return None
+    return response_cache_key(
+        file_info['fingerprint'],
+        query,
+        mode="chart" if chart_mode else "analysis",
+        model=CHART_MODEL if chart_mode else ANALYSIS_MODEL,
+    )
+
+
+def _analysis_instructions(context: Any, file_info: dict) -> str:
+    if context.sampled:
+        rows_instruction = (
+            f"The column profiles cover all {file_info['row_count']} rows; the data rows are a representative "
+            "sample. Use the profiles for totals and statistics, and never claim to list every record"
+        )
+    else:
+        rows_instruction = f"Use ALL {file_info['row_count']} rows of data in your analysis - do not truncate or omit any records"
+    
+    return f"""MANDATORY INSTRUCTIONS:
+1. {rows_instruction}
 2. Follow the EXACT report format: Title → Summary → Methodology → Findings (with Markdown table) → Conclusions
 3. You MUST include a properly formatted Markdown table showing all relevant data
 4. Provide executive-level analysis, not just a list
@@ -410,23 +699,348 @@ MANDATORY INSTRUCTIONS:
 6. Reference specific values, names, and percentages from the data
 
 Remember: You are a Senior Data Analyst. Produce a professional report, not a simple list."""
+
+
+async def _analysis_messages(
+    query: str, dataframe: Any, file_info: dict, conversation: Conversation | None = None
+) -> list[dict[str, Any]]:
+    if conversation is not None:
+        return await _conversation_messages(query, dataframe, file_info, conversation)
     
+    # Build a token-budgeted data context on the worker pool
+    context = await run_stage("prompt", build_prompt_context, dataframe, query, file_info)
+    record_context(context)
+    
+    user_message = f"""DATA CONTEXT:
+{context.text}
+
+USER QUESTION: {query}
+
+{_analysis_instructions(context, file_info)}"""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+async def _conversation_messages(
+    query: str, dataframe: Any, file_info: dict, conversation: Conversation
+) -> list[dict[str, Any]]:
+    """
+    Analysis prompt within a conversation: the system prompt and the data context
+    come first and are identical on every turn, so the provider's prompt cache
+    covers them; the summary, recent turns and new question follow. The context
+    is built once per conversation and data version, without ranking columns by
+    any one question.
+    """
+    fingerprint = file_info.get('fingerprint')
+    if conversation.context is None or conversation.fingerprint != fingerprint:
+        context = await run_stage("prompt", build_prompt_context, dataframe, "", file_info)
+        record_context(context)
+        conversation.set_context(fingerprint, f"DATA CONTEXT:\n{context.text}\n\n{_analysis_instructions(context, file_info)}")
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": conversation.context},
+        *conversation.history_messages(),
+        {"role": "user", "content": f"USER QUESTION: {query}\n\nAnswer this question with the data context above, in the mandatory report format."},
+    ]
+
+
+SUMMARY_SYSTEM_PROMPT = f"""You keep the running summary of a conversation about a dataset.
+Merge the earlier summary and the new turns into terse bullet points, at most {CONVERSATION_SUMMARY_TOKENS} tokens:
+what the user asked, the figures and conclusions they were given, and any open follow-ups.
+Keep numbers exactly as given and do not add anything that is not in the turns."""
+
+# Summaries run after the answer is sent; references keep the tasks alive until they finish
+_summary_tasks: set[asyncio.Task] = set()
+
+
+async def summarize_conversation(conversation: Conversation) -> None:
+    """
+    Fold the turns that left the conversation window into its rolling summary.
+    Until this finishes those turns are still sent as they were. Without a model,
+    or when the call fails, each turn becomes one line of the summary instead.
+    """
+    if conversation.summarizing or not conversation.pending:
+        return
+    conversation.summarizing = True
+    turns = list(conversation.pending)
     try:
-        completion = await client.chat.completions.create(
-            model="gpt-4o",  # Use GPT-4o for better reasoning
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ],
+        summary = None
+        gateway = get_llm_gateway()
+        if gateway is not None:
+            history = "\n\n".join(f"USER: {turn.question}\nANSWER: {turn.answer}" for turn in turns)
+            try:
+                completion = await gateway.complete(
+                    model=SUMMARY_MODEL,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"EARLIER SUMMARY:\n{conversation.summary or '(none)'}\n\nNEW TURNS:\n{history}"},
+                    ],
+                    temperature=0,
+                    max_tokens=CONVERSATION_SUMMARY_TOKENS,
+                )
+                summary = (completion.choices[0].message.content or "").strip() or None
+            except Exception as e:
+                log.warning(f"Conversation summary failed: {e}")
+            get_conversation_store().record_summary(summary is not None)
+        conversation.summary = summary or digest_turns(conversation.summary, turns)
+        del conversation.pending[:len(turns)]
+    finally:
+        conversation.summarizing = False
+
+
+def _remember_turn(conversation: Conversation | None, query: str, answer: str, usage: dict | None = None) -> None:
+    """Add an answered question to the conversation and fold older turns into its summary in the background"""
+    if conversation is None:
+        return
+    conversation.add_turn(query, answer)
+    get_conversation_store().record_turn(conversation, usage)
+    if conversation.pending and not conversation.summarizing:
+        task = asyncio.ensure_future(summarize_conversation(conversation))
+        _summary_tasks.add(task)
+        task.add_done_callback(_summary_tasks.discard)
+
+
+def _usage(usage: Any) -> dict | None:
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "cached_tokens": cached_tokens(usage)}
+
+
+NOT_CONFIGURED_MESSAGE = "InsightXL is not fully configured yet (missing OpenAI API key). Please configure the API key to use this feature."
+
+
+async def answer_query_with_context(
+    query: str, dataframe: Any, file_info: dict, use_cache: bool = True, conversation: Conversation | None = None
+) -> str:
+    """
+    Answer a user query using ONLY the provided DataFrame context.
+    This prevents hallucinations by grounding responses in actual data.
+    
+    Has TWO MODES:
+    1. CHART MODE: If user requests a chart, return JSON for visualization
+    2. ANALYSIS MODE: For all other queries, return professional text report
+       Plain aggregations are computed with pandas over the full data first
+       (see services/planner.py) and the LLM only narrates the result.
+    
+    Successful answers are cached by dataset fingerprint, normalized query,
+    mode and model, so repeated questions skip the LLM round trip.
+    
+    With a `conversation`, analysis answers see its earlier turns and every
+    answer is added to it. Follow-up questions other than charts skip the
+    response cache and the planners, since their answer depends on what came
+    before ("what is their average salary?" after "show employees in Sales").
+    A question that stands on its own is answered as usual (see refers_back).
+    """
+    chart_mode = is_chart_request(query)
+    follow_up = (conversation is not None and conversation.has_history and not chart_mode
+                 and refers_back(query, dataframe, file_info.get('profile')))
+    
+    cache_key = _query_cache_key(query, file_info, chart_mode, use_cache and not follow_up)
+    if cache_key:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            _remember_turn(conversation, query, cached)
+            return cached
+    
+    # Check if this is a chart request
+    if chart_mode:
+        chart = await generate_chart_data(query, dataframe, file_info, cache_key=cache_key)
+        _remember_turn(conversation, query, chart)
+        return chart
+    
+    # Plain aggregations are computed locally over the full data; the LLM only narrates.
+    # The planners see only the question, so follow-ups go to the analysis model with the history.
+    computed = None if follow_up else await compute_answer(query, dataframe, file_info)
+    if computed is not None:
+        response = await narrate_computed_result(query, computed, file_info)
+        if cache_key:
+            get_response_cache().set(cache_key, response)
+        _remember_turn(conversation, query, response)
+        return response
+    
+    # Otherwise, continue with analysis mode
+    gateway = get_llm_gateway()
+    if gateway is None:
+        return NOT_CONFIGURED_MESSAGE
+    
+    messages = await _analysis_messages(query, dataframe, file_info, conversation)
+    
+    try:
+        completion = await gateway.complete(
+            model=ANALYSIS_MODEL,  # Use GPT-4o for better reasoning
+            messages=messages,
             temperature=0.3,  # Lower temperature for more focused responses
             max_tokens=2000,  # Increased for detailed responses with complete data
         )
         
-        response = completion.choices[0].message.content or "I couldn't generate a response. Please try again."
+        response = completion.choices[0].message.content
+        if not response:
+            return "I couldn't generate a response. Please try again."
+        if cache_key:
+            get_response_cache().set(cache_key, response)
+        _remember_turn(conversation, query, response, _usage(completion.usage))
         return response
     
     except Exception as e:
-        print(f"Error answering query: {e}")
+        log.error(f"Error answering query: {e}")
         return f"I encountered an error while processing your question: {str(e)}. Please try rephrasing your question or try again."
 
 
+# Streaming variants. Each yields (event, data) pairs: any number of
+# ("delta", {"content": ...}) followed by one ("done", {...metadata}),
+# or an ("error", {"message": ...}) if the model call fails mid-stream.
+# ("status", {"stage": ...}) events may come first, before slow steps that send no text.
+
+async def _stream_completion(usage: dict, **kwargs: Any) -> AsyncIterator[str]:
+    """Text deltas of a streamed chat completion; token usage is written into `usage` at the end"""
+    gateway = get_llm_gateway()
+    async for chunk in gateway.stream(stream_options={"include_usage": True}, **kwargs):
+        if chunk.usage is not None:
+            usage.update(
+                prompt_tokens=chunk.usage.prompt_tokens,
+                cached_tokens=cached_tokens(chunk.usage),
+                completion_tokens=chunk.usage.completion_tokens,
+                total_tokens=chunk.usage.total_tokens,
+            )
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+class _StreamTimer:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.first_token_ms: float | None = None
+    
+    def delta(self, content: str) -> tuple[str, dict]:
+        if self.first_token_ms is None:
+            self.first_token_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        return "delta", {"content": content}
+    
+    def done(self, **meta: Any) -> tuple[str, dict]:
+        meta["timing"] = {
+            "first_token_ms": self.first_token_ms,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+        return "done", meta
+
+
+async def stream_llm_agent(payload: ChatRequest, file_info: dict | None = None) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Streaming variant of run_llm_agent. A reply without a sheet is streamed as it
+    is generated. With a sheet snapshot or an uploaded file the operations are
+    planned and run as in run_llm_agent: the reply arrives as one delta and the
+    updates, ranges and chart in the "done" event.
+    """
+    timer = _StreamTimer()
+    if get_llm_gateway() is None:
+        yield timer.delta(_not_configured_reply(payload))
+        yield timer.done(model=None, usage=None)
+        return
+    
+    if file_info is not None or payload.sheet is not None:
+        yield "status", {"stage": "planning"}
+        response = await run_llm_agent(payload, file_info)
+        if response.reply:
+            yield timer.delta(response.reply)
+        yield timer.done(
+            model=AGENT_MODEL,
+            usage=None,
+            updates=[update.model_dump() for update in response.updates],
+            ranges=[block.model_dump() for block in response.ranges],
+            chart_spec=response.chart_spec,
+        )
+        return
+    
+    usage: dict = {}
+    try:
+        async for content in _stream_completion(
+            usage, model=AGENT_MODEL, messages=_agent_messages(payload), temperature=0.3
+        ):
+            yield timer.delta(content)
+    except Exception as e:
+        log.error(f"Error streaming agent reply: {e}")
+        yield "error", {"message": f"I encountered an error while processing your message: {str(e)}."}
+        return
+    yield timer.done(model=AGENT_MODEL, usage=usage or None)
+
+
+async def stream_query_with_context(
+    query: str, dataframe: Any, file_info: dict, use_cache: bool = True, conversation: Conversation | None = None
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Streaming variant of answer_query_with_context: same modes, cache and
+    conversation handling, but report text is forwarded as the model generates
+    it. Cached answers and charts arrive as a single delta. The final "done"
+    event carries the mode, cache status ("hit", "miss" or "bypass"), token
+    usage (including cached prompt tokens) and timing.
+    """
+    timer = _StreamTimer()
+    chart_mode = is_chart_request(query)
+    follow_up = (conversation is not None and conversation.has_history and not chart_mode
+                 and refers_back(query, dataframe, file_info.get('profile')))
+    
+    cache_key = _query_cache_key(query, file_info, chart_mode, use_cache and not follow_up)
+    cache_status = "miss" if cache_key else "bypass"
+    if cache_key:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            _remember_turn(conversation, query, cached)
+            yield timer.delta(cached)
+            yield timer.done(mode="chart" if chart_mode else "analysis", cache="hit", model=None, usage=None)
+            return
+    
+    if chart_mode:
+        chart = await generate_chart_data(query, dataframe, file_info, cache_key=cache_key)
+        _remember_turn(conversation, query, chart)
+        yield timer.delta(chart)
+        yield timer.done(mode="chart", cache=cache_status, model=CHART_MODEL, usage=None)
+        return
+    
+    usage: dict = {}
+    computed = None
+    if not follow_up:
+        # Planning can wait on a model call; start the stream so the client sees the request is under way
+        yield "status", {"stage": "planning"}
+        computed = await compute_answer(query, dataframe, file_info)
+    if computed is not None:
+        mode, model = "computed", NARRATION_MODEL
+        if get_llm_gateway() is None:
+            report = render_computed_report(computed)
+            _remember_turn(conversation, query, report)
+            yield timer.delta(report)
+            yield timer.done(mode=mode, cache=cache_status, model=None, usage=None)
+            return
+        messages, max_tokens = _narration_messages(query, computed, file_info), 1200
+    else:
+        mode, model = "analysis", ANALYSIS_MODEL
+        if get_llm_gateway() is None:
+            yield timer.delta(NOT_CONFIGURED_MESSAGE)
+            yield timer.done(mode=mode, cache=cache_status, model=None, usage=None)
+            return
+        messages, max_tokens = await _analysis_messages(query, dataframe, file_info, conversation), 2000
+    
+    parts: list[str] = []
+    try:
+        async for content in _stream_completion(
+            usage, model=model, messages=messages, temperature=0.3, max_tokens=max_tokens
+        ):
+            parts.append(content)
+            yield timer.delta(content)
+    except Exception as e:
+        log.error(f"Error streaming answer: {e}")
+        if computed is None or parts:
+            yield "error", {"message": f"I encountered an error while processing your question: {str(e)}."}
+            return
+        # The computed result stands on its own without the narration
+        report = render_computed_report(computed)
+        _remember_turn(conversation, query, report)
+        yield timer.delta(report)
+    else:
+        if cache_key and parts:
+            get_response_cache().set(cache_key, "".join(parts))
+        if parts:
+            _remember_turn(conversation, query, "".join(parts), usage if mode == "analysis" else None)
+    
+    yield timer.done(mode=mode, cache=cache_status, model=model, usage=usage or None)
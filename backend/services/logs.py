@@ -0,0 +1,58 @@
+import contextvars
+import json
+import logging
+import sys
+import time
+from typing import Any
+
+from config.settings import LOG_FORMAT, LOG_LEVEL
+
+# Set per request by the metrics middleware (services/metrics.py)
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed with `extra=` and is logged as a field
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and any `extra=` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        return f"{text} [{record.request_id}]" if getattr(record, "request_id", None) else text
+
+
+_root = logging.getLogger("insightxl")
+if not _root.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.addFilter(_RequestIdFilter())
+    _handler.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else _TextFormatter("%(levelname)s %(name)s: %(message)s"))
+    _root.addHandler(_handler)
+    _root.setLevel(LOG_LEVEL.upper())
+    _root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the "insightxl" hierarchy, formatted by LOG_FORMAT"""
+    return logging.getLogger(f"insightxl.{name}")
@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import math
+import time
+import uuid
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+from fastapi.routing import APIRoute
+
+from config.settings import LOG_FORMAT, METRICS
+from services.logs import get_logger, request_id_var
+
+ENABLED = METRICS == "on"
+# Seconds; the same buckets serve request latency and spans
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Request ids taken from the X-Request-ID header are cut to this length
+MAX_REQUEST_ID = 64
+
+log = get_logger("access")
+
+
+def _labels(names: tuple[str, ...], values: tuple[Any, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple[Any, ...], float] = {}
+
+    def inc(self, *labels: Any, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in self._values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> (per-bucket counts with a final +Inf bucket, sum)
+        self._series: dict[tuple[Any, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: Any) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, (*key, _number(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(round(total[0], 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Read when /metrics is scraped: `read` returns a value, or {label values: value}"""
+
+    def __init__(self, name: str, help: str, read: Callable[[], Any], labels: tuple[str, ...] = ()) -> None:
+        self.name, self.help, self.read, self.labels = name, help, read, labels
+
+    def render(self) -> list[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            get_logger("metrics").warning(f"Gauge {self.name} failed: {e}")
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in values.items() if v is not None]
+        return lines
+
+
+_registry: list[Counter | Histogram | Gauge] = []
+
+
+def _register(metric: Any) -> Any:
+    _registry.append(metric)
+    return metric
+
+
+http_requests = _register(Counter(
+    "insightxl_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+))
+http_latency = _register(Histogram(
+    "insightxl_http_request_duration_seconds", "HTTP request latency, including streamed bodies", ("method", "route")
+))
+span_latency = _register(Histogram(
+    "insightxl_span_duration_seconds", "Time spent in named steps of a request (parse, profile, prompt, llm, ...)", ("span",)
+))
+llm_tokens = _register(Counter(
+    "insightxl_llm_tokens_total", "LLM tokens by model and kind (prompt, cached prompt or completion)", ("model", "kind")
+))
+
+
+def register_gauge(name: str, help: str, read: Callable[[], Any], labels: tuple[str, ...] = ()) -> None:
+    _register(Gauge(name, help, read, labels))
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    lines: list[str] = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+@dataclass
+class RequestTrace:
+    request_id: str
+    # Seconds per span name; repeated spans add up
+    spans: dict[str, float] = field(default_factory=dict)
+    tokens: dict[str, int] = field(default_factory=dict)
+    endpoint_started: float = 0.0
+    endpoint_finished: float = 0.0
+
+
+_trace: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar("trace", default=None)
+
+
+def record_span(name: str, seconds: float) -> None:
+    if not ENABLED:
+        return
+    span_latency.observe(seconds, name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans[name] = trace.spans.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block as a named span of the current request"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def record_tokens(
+    model: str, prompt_tokens: int | None, completion_tokens: int | None, cached_tokens: int | None = None
+) -> None:
+    if not ENABLED:
+        return
+    trace = _trace.get()
+    for kind, count in (("prompt", prompt_tokens), ("cached", cached_tokens), ("completion", completion_tokens)):
+        if count:
+            llm_tokens.inc(model, kind, amount=count)
+            if trace is not None:
+                trace.tokens[f"{kind}_tokens"] = trace.tokens.get(f"{kind}_tokens", 0) + count
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: gives each request an id (X-Request-ID, taken from the
+    request when present), records its latency by route template and status, and
+    with LOG_FORMAT=json logs one access line with its spans and token usage.
+    """
+
+    def __init__(self, app: Callable[..., Any]) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:MAX_REQUEST_ID]
+        request_id = request_id or uuid.uuid4().hex
+        trace = RequestTrace(request_id)
+        trace_token, id_token = _trace.set(trace), request_id_var.set(request_id)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_id(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", ()), (b"x-request-id", request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except Exception:
+            log.exception("Unhandled error", extra={"method": scope["method"], "path": scope["path"]})
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            # The route template keeps label values bounded; unmatched paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(scope["method"], route, status)
+            http_latency.observe(elapsed, scope["method"], route)
+            if LOG_FORMAT == "json":
+                log.info(
+                    f"{scope['method']} {scope['path']} {status}",
+                    extra={
+                        "method": scope["method"],
+                        "route": route,
+                        "status": status,
+                        "duration_ms": round(elapsed * 1000, 3),
+                        "spans_ms": {name: round(s * 1000, 3) for name, s in trace.spans.items()},
+                        **trace.tokens,
+                    },
+                )
+            _trace.reset(trace_token)
+            request_id_var.reset(id_token)
+
+
+def _timed_endpoint(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    if not ENABLED or not asyncio.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def timed(*args: Any, **kwargs: Any) -> Any:
+        trace = _trace.get()
+        if trace is not None:
+            trace.endpoint_started = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if trace is not None:
+                trace.endpoint_finished = time.perf_counter()
+
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """
+    Route class that adds two spans around the endpoint itself: "validate"
+    (reading and validating the request) and "serialize" (encoding the response).
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable[..., Any]:
+        handler = super().get_route_handler()
+        if not ENABLED:
+            return handler
+
+        async def timed_handler(request: Any) -> Any:
+            trace = _trace.get()
+            start = time.perf_counter()
+            response = await handler(request)
+            if trace is not None and trace.endpoint_started >= start:
+                record_span("validate", trace.endpoint_started - start)
+                record_span("serialize", time.perf_counter() - trace.endpoint_finished)
+            return response
+
+        return timed_handler
@@ -0,0 +1,158 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from config.settings import CATEGORY_MAX_RATIO, INGEST_STRINGS
+from services.charts import as_datetime
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # pyarrow-backed strings are optional; object columns are kept without it
+    pyarrow = None
+
+# "$95,000", "-1,250.50", "€ 12.5": optional sign and currency symbol, comma-grouped thousands
+_AMOUNT = re.compile(r"[-+]?[$€£¥]?\s*[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?")
+_CURRENCY = re.compile(r"[$€£¥]")
+# Codes such as "00123" are identifiers, not numbers; they keep their leading zeros
+_LEADING_ZERO = re.compile(r"[-+]?[$€£¥]?\s*0\d")
+_INT32 = np.iinfo(np.int32)
+
+_totals = {"frames": 0, "before_bytes": 0, "after_bytes": 0}
+
+
+@dataclass
+class CompactReport:
+    before_bytes: int
+    after_bytes: int
+    # Column -> what it became: "currency", "numeric", "date", "category", "string" or "int32"
+    conversions: dict[Any, str] = field(default_factory=dict)
+
+    @property
+    def ratio(self) -> float:
+        return self.before_bytes / self.after_bytes if self.after_bytes else 1.0
+
+    @property
+    def currency_columns(self) -> list[Any]:
+        return [col for col, kind in self.conversions.items() if kind == "currency"]
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "before_bytes": self.before_bytes,
+            "after_bytes": self.after_bytes,
+            "ratio": round(self.ratio, 2),
+            "conversions": {str(col): kind for col, kind in self.conversions.items()},
+        }
+
+
+def parse_amounts(series: pd.Series) -> tuple[pd.Series, bool] | None:
+    """Numbers from text such as "$95,000" when every non-empty value is one; with whether any had a currency symbol."""
+    text = series.dropna().astype(str).str.strip()
+    if text.empty or not text.head(200).str.fullmatch(_AMOUNT).all():
+        return None
+    if not text.str.fullmatch(_AMOUNT).all() or text.str.match(_LEADING_ZERO).any():
+        return None
+    numbers = pd.to_numeric(text.str.replace(r"[$€£¥,\s]", "", regex=True), errors="coerce")
+    if numbers.isna().any():
+        return None
+    return numbers.reindex(series.index), bool(text.str.contains(_CURRENCY).any())
+
+
+def _parse_dates(series: pd.Series) -> pd.Series | None:
+    """Datetimes from text dates, only when every non-empty value parses."""
+    parsed = as_datetime(series)
+    if parsed is None or not pd.api.types.is_datetime64_any_dtype(parsed):
+        return None
+    if parsed[series.notna()].isna().any():
+        return None
+    return parsed
+
+
+def widen_numeric(series: pd.Series) -> pd.Series:
+    """
+    The column as int64/float64 when it was stored narrower, for arithmetic:
+    `int32 * 100000` would wrap around instead of growing. Aggregations (sum,
+    mean) already accumulate in 64 bits and do not need this.
+    """
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or not pd.api.types.is_numeric_dtype(dtype) or dtype.itemsize >= 8:
+        return series
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return series.astype("Float64" if pd.api.types.is_float_dtype(dtype) else "Int64")
+    return series.astype(np.float64 if pd.api.types.is_float_dtype(dtype) else np.int64)
+
+
+def _downcast_int(series: pd.Series) -> pd.Series | None:
+    # int32 is the floor for storage; arithmetic on a stored column widens it first (see widen_numeric)
+    if series.dtype.itemsize <= 4 or series.empty:
+        return None
+    if _INT32.min <= series.min() and series.max() <= _INT32.max:
+        return series.astype(np.int32)
+    return None
+
+
+def _compact_column(series: pd.Series) -> tuple[pd.Series, str] | None:
+    if pd.api.types.is_integer_dtype(series):
+        downcast = _downcast_int(series)
+        return (downcast, "int32") if downcast is not None else None
+    if not pd.api.types.is_object_dtype(series) or pd.api.types.infer_dtype(series, skipna=True) != "string":
+        return None
+
+    amounts = parse_amounts(series)
+    if amounts is not None:
+        numbers, is_currency = amounts
+        if pd.api.types.is_integer_dtype(numbers):
+            downcast = _downcast_int(numbers)
+            numbers = downcast if downcast is not None else numbers
+        return numbers, "currency" if is_currency else "numeric"
+    dates = _parse_dates(series)
+    if dates is not None:
+        return dates, "date"
+    count = int(series.notna().sum())
+    if series.nunique() <= CATEGORY_MAX_RATIO * count:
+        return series.astype("category"), "category"
+    if INGEST_STRINGS == "arrow" and pyarrow is not None:
+        # The pyarrow_numpy variant keeps NaN for missing values, like object columns
+        return series.astype(pd.StringDtype("pyarrow_numpy")), "string"
+    return None
+
+
+def compact_frame(df: pd.DataFrame) -> tuple[pd.DataFrame, CompactReport]:
+    """
+    Shrink a freshly parsed upload: integers are downcast, currency and number
+    text ("$95,000") becomes numeric, text dates become datetimes and repetitive
+    text becomes categorical. Floats stay float64 so sums and means keep full
+    precision. Blocking; run it on the worker pool.
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    out = df.copy(deep=False)
+    conversions: dict[Any, str] = {}
+    for i, col in enumerate(df.columns):
+        converted = _compact_column(df.iloc[:, i])
+        if converted is not None:
+            out.isetitem(i, converted[0])
+            conversions[col] = converted[1]
+    after = int(out.memory_usage(deep=True).sum()) if conversions else before
+    return out, CompactReport(before, after, conversions)
+
+
+def compact_series(series: pd.Series) -> pd.Series:
+    """One column through the same conversions as compact_frame, e.g. after an edit turned it back into text."""
+    converted = _compact_column(series)
+    return converted[0] if converted is not None else series
+
+
+def record_compaction(report: CompactReport) -> None:
+    # Called by the request handler; compact_frame may run in a worker process
+    _totals["frames"] += 1
+    _totals["before_bytes"] += report.before_bytes
+    _totals["after_bytes"] += report.after_bytes
+
+
+def compact_stats() -> dict[str, Any]:
+    return {
+        **_totals,
+        "ratio": round(_totals["before_bytes"] / _totals["after_bytes"], 2) if _totals["after_bytes"] else None,
+    }
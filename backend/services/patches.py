@@ -0,0 +1,253 @@
+import dataclasses
+import hashlib
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from config.settings import INGEST_COMPACT
+from models.schemas import DeleteRows, InsertRows, SetCells, SheetPatch
+from services.ingest import describe_columns
+from services.optimize import compact_series, parse_amounts, widen_numeric
+
+# Edits address the same grid as /chat updates: row 0 is the header row and data
+# rows start at 1. Each edit sees the result of the ones before it.
+
+_totals = {"patches": 0, "edits": 0, "cells": 0, "conflicts": 0}
+
+
+class PatchError(ValueError):
+    """Raised for an edit that does not fit the sheet it is applied to."""
+
+
+@dataclass
+class PatchResult:
+    dataframe: pd.DataFrame
+    # Columns whose values changed, by their name after the patch
+    changed_columns: list[Any]
+    # Names that no longer exist (renamed columns)
+    removed_columns: list[Any]
+    # Rows were inserted or deleted, so every column changed
+    rows_changed: bool
+    cells: int
+
+
+def _coerce(values: list[Any], like: pd.Series) -> pd.Series | None:
+    """
+    `values` in the dtype of `like`, or widened to int64 when they overflow a compact
+    int32 column; None when some value does not fit it (text or a bool in a number column, ...)
+    """
+    if pd.api.types.is_object_dtype(like):
+        return pd.Series(values, dtype=object)
+    if pd.api.types.is_bool_dtype(like) and not all(isinstance(v, (bool, np.bool_)) for v in values):
+        return None
+    missing = pd.isna(np.array(values, dtype=object))
+    if pd.api.types.is_numeric_dtype(like) and not pd.api.types.is_bool_dtype(like):
+        # True would be stored as 1
+        if any(isinstance(v, (bool, np.bool_)) for v in values):
+            return None
+        # "$1,200" typed into a column that held currency text before ingest
+        amounts = parse_amounts(pd.Series(values, dtype=object))
+        if amounts is not None:
+            values = amounts[0].tolist()
+    # A number too large for a compact int32 column widens it to int64 (see services/optimize.py)
+    for dtype in dict.fromkeys([like.dtype, widen_numeric(like.head(0)).dtype]):
+        try:
+            coerced = pd.Series(values, dtype=dtype)
+            break
+        except (ValueError, TypeError, OverflowError):
+            continue
+    else:
+        return None
+    # Categoricals turn unknown values into NaN instead of raising
+    if (coerced.isna().to_numpy() != missing).any():
+        return None
+    return coerced
+
+
+def _retype(series: pd.Series) -> pd.Series:
+    # An edit changed the column's type: infer it again, as at upload
+    series = series.infer_objects()
+    return compact_series(series) if INGEST_COMPACT == "on" else series
+
+
+def _write(series: pd.Series, start: int, values: list[Any]) -> pd.Series:
+    coerced = _coerce(values, series)
+    if coerced is not None:
+        out = series.astype(coerced.dtype) if coerced.dtype != series.dtype else series.copy()
+        out.iloc[start:start + len(values)] = coerced.to_numpy()
+        return out
+    cells = series.to_numpy(dtype=object, copy=True)
+    cells[start:start + len(values)] = values
+    return _retype(pd.Series(cells, index=series.index, name=series.name))
+
+
+def _insert(series: pd.Series, at: int, values: list[Any]) -> pd.Series:
+    coerced = _coerce(values, series)
+    if coerced is None:
+        cells = series.to_numpy(dtype=object)
+        cells = np.concatenate([cells[:at], np.array(values, dtype=object), cells[at:]])
+        return _retype(pd.Series(cells, name=series.name))
+    out = pd.concat([series.iloc[:at], coerced, series.iloc[at:]], ignore_index=True)
+    out.name = series.name
+    return out
+
+
+def _check_block(values: list[list[Any]]) -> int:
+    if not values:
+        raise PatchError("values must hold at least one row")
+    width = len(values[0])
+    if width == 0 or any(len(row) != width for row in values):
+        raise PatchError("values must be a rectangle: every row the same, non-zero length")
+    return width
+
+
+def _set_cells(df: pd.DataFrame, edit: SetCells, changed: set[Any], removed: set[Any]) -> tuple[pd.DataFrame, int]:
+    width = _check_block(edit.values)
+    if edit.col > df.shape[1]:
+        raise PatchError(f"Column {edit.col} is past the right edge of the sheet ({df.shape[1]} columns)")
+    header = edit.values[0] if edit.row == 0 else None
+    data = edit.values[1:] if edit.row == 0 else edit.values
+    start = max(edit.row - 1, 0)
+    if start + len(data) > len(df):
+        raise PatchError(f"Rows {edit.row}-{edit.row + len(edit.values) - 1} are past the end of the sheet; use insert_rows")
+
+    names = list(df.columns)
+    for j in range(df.shape[1], edit.col + width):
+        names.append(header[j - edit.col] if header is not None else f"Column {j + 1}")
+    if header is not None:
+        for j, name in enumerate(header):
+            if not isinstance(name, str) or not name:
+                raise PatchError("Header cells must be non-empty text")
+            old = names[edit.col + j]
+            if old != name and edit.col + j < df.shape[1]:
+                removed.add(old)
+                changed.add(name)
+            names[edit.col + j] = name
+    if len(set(names)) != len(names):
+        raise PatchError("Column names must be unique")
+
+    out = df.copy(deep=False)
+    for j in range(df.shape[1], edit.col + width):
+        # The same edit may rename an existing column away from this name
+        out.insert(j, names[j], pd.Series(np.nan, index=df.index, dtype=object), allow_duplicates=True)
+    out.columns = names
+    if data:
+        for j in range(width):
+            i = edit.col + j
+            out.isetitem(i, _write(out.iloc[:, i], start, [row[j] for row in data]))
+            changed.add(names[i])
+    for j in range(df.shape[1], edit.col + width):
+        out.isetitem(j, _retype(out.iloc[:, j]))
+        changed.add(names[j])
+    return out, len(edit.values) * width
+
+
+def _insert_rows(df: pd.DataFrame, edit: InsertRows) -> tuple[pd.DataFrame, int]:
+    width = _check_block(edit.values)
+    if width > df.shape[1]:
+        raise PatchError(f"Rows have {width} cells but the sheet has {df.shape[1]} columns")
+    if edit.row > len(df) + 1:
+        raise PatchError(f"Row {edit.row} is past the end of the sheet ({len(df)} data rows)")
+    at = edit.row - 1
+    columns = {}
+    for i, name in enumerate(df.columns):
+        values = [row[i] if i < width else None for row in edit.values]
+        columns[name] = _insert(df.iloc[:, i], at, values)
+    return pd.DataFrame(columns), len(edit.values) * df.shape[1]
+
+
+def _delete_rows(df: pd.DataFrame, edit: DeleteRows) -> tuple[pd.DataFrame, int]:
+    start = edit.row - 1
+    if start + edit.count > len(df):
+        raise PatchError(f"Rows {edit.row}-{edit.row + edit.count - 1} are past the end of the sheet ({len(df)} data rows)")
+    keep = np.r_[0:start, start + edit.count:len(df)]
+    return df.take(keep).reset_index(drop=True), edit.count * df.shape[1]
+
+
+def apply_patch(df: pd.DataFrame, patch: SheetPatch) -> PatchResult:
+    """
+    Apply a client's edits to a stored frame. The stored frame is not modified:
+    cell edits copy only the columns they touch. Blocking; run it on the worker pool.
+    """
+    changed: set[Any] = set()
+    removed: set[Any] = set()
+    rows_changed = False
+    cells = 0
+    for edit in patch.edits:
+        if isinstance(edit, SetCells):
+            df, n = _set_cells(df, edit, changed, removed)
+        elif isinstance(edit, InsertRows):
+            df, n = _insert_rows(df, edit)
+            rows_changed = True
+        else:
+            df, n = _delete_rows(df, edit)
+            rows_changed = True
+        cells += n
+    if rows_changed:
+        changed = set(df.columns)
+    removed -= set(df.columns)
+    return PatchResult(
+        dataframe=df,
+        changed_columns=[col for col in df.columns if col in changed],
+        removed_columns=list(removed),
+        rows_changed=rows_changed,
+        cells=cells,
+    )
+
+
+def patched_fingerprint(fingerprint: str, patch: SheetPatch) -> str:
+    """
+    Fingerprint of a sheet after a patch: the previous fingerprint chained with the
+    edits, so cached answers for the old data stop matching without rehashing every cell.
+    """
+    digest = hashlib.sha256(fingerprint.encode())
+    digest.update(patch.model_dump_json(include={"edits"}).encode())
+    return digest.hexdigest()
+
+
+def patched_file_data(file_data: dict[str, Any], result: PatchResult, fingerprint: str) -> dict[str, Any]:
+    """
+    The stored file_data for the patched frame. Profiles and describe() stats are
+    recomputed only for changed columns. Blocking; run it on the worker pool.
+    """
+    df = result.dataframe
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    stats = {col: s for col, s in file_data['stats'].items() if col in numeric_cols and col not in result.changed_columns}
+    stats.update(describe_columns(df, [col for col in numeric_cols if col in result.changed_columns]))
+
+    profile = file_data.get('profile')
+    if profile is not None:
+        # The old profile may still be used by requests on the previous version
+        profile = dataclasses.replace(profile, columns=dict(profile.columns))
+        profile.update_columns(df, result.changed_columns + result.removed_columns, fingerprint)
+
+    return {
+        **file_data,
+        'dataframe': df,
+        'version': file_data.get('version', 0) + 1,
+        'row_count': len(df),
+        'column_count': df.shape[1],
+        'columns': df.columns.tolist(),
+        'dtypes': {k: str(v) for k, v in df.dtypes.to_dict().items()},
+        'numeric_cols': numeric_cols,
+        'sample_data': df.head(5).to_dict(orient='records'),
+        'stats': {col: stats[col] for col in numeric_cols},
+        'fingerprint': fingerprint,
+        'profile': profile,
+    }
+
+
+def record_patch(result: PatchResult, edits: int) -> None:
+    _totals["patches"] += 1
+    _totals["edits"] += edits
+    _totals["cells"] += result.cells
+
+
+def record_conflict() -> None:
+    _totals["conflicts"] += 1
+
+
+def patch_stats() -> dict[str, Any]:
+    return dict(_totals)
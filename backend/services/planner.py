@@ -0,0 +1,539 @@
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from services.indexes import DatasetIndex
+    from services.profile import DatasetProfile
+
+# A plan is a small JSON-compatible dict, produced either by parse_rule_plan or by the LLM:
+# {
+#   "op": "aggregate" | "count" | "top_n" | "group_by" | "filter",
+#   "column": "<numeric column>",          # aggregate / top_n / group_by value column
+#   "agg": "sum" | "mean" | "median" | "min" | "max" | "count" | "nunique",
+#   "group_by": "<column>",                # group_by only
+#   "n": 10, "ascending": false,           # top_n, and optional limit for group_by
+#   "filters": [{"column": "<column>", "op": "==", "value": "Engineering"}]
+# }
+OPS = {"aggregate", "count", "top_n", "group_by", "filter"}
+AGGREGATIONS = {"sum", "mean", "median", "min", "max", "count", "nunique"}
+FILTER_OPS = {"==", "!=", ">", ">=", "<", "<=", "contains"}
+
+MAX_RESULT_ROWS = 100
+MAX_GROUPS = 50
+# String columns with at most this many distinct values are matched against words in the question
+MAX_FILTER_CARDINALITY = 200
+
+_AGG_KEYWORDS = [
+    ("mean", r"\b(average|avg|mean)\b"),
+    ("sum", r"\b(total|sum)\b"),
+    ("median", r"\bmedian\b"),
+    ("nunique", r"\b(unique|distinct)\b"),
+    ("max", r"\b(max|maximum|highest|largest|biggest)\b"),
+    ("min", r"\b(min|minimum|lowest|smallest)\b"),
+    ("count", r"\b(how many|count|number of)\b"),
+]
+_TOP_N = re.compile(r"\b(top|bottom|highest|lowest|largest|smallest|first|last)\s+(\d+)\b")
+_COMPARISON = re.compile(
+    r"\b(above|over|greater than|more than|exceeding|at least|below|under|less than|at most)\s+"
+    r"\$?(\d[\d,]*(?:\.\d+)?)\s*(k|m)?\b"
+)
+_COMPARISON_OPS = {
+    "above": ">", "over": ">", "greater than": ">", "more than": ">", "exceeding": ">",
+    "at least": ">=", "below": "<", "under": "<", "less than": "<", "at most": "<=",
+}
+_AGG_LABELS = {
+    "sum": "Total", "mean": "Average", "median": "Median", "min": "Minimum",
+    "max": "Maximum", "count": "Count", "nunique": "Distinct count",
+}
+GROUP_PREFIX = re.compile(r"\b(by|per|each|every|across)\s+(the\s+|each\s+)?$")
+_WHICH_PREFIX = re.compile(r"\b(which|what)\s+$")
+# Phrasings the rules cannot turn into filters; such questions fall back instead of running on every row
+_NEGATION = re.compile(r"\b(not|no|except|excluding|exclude|other than|without|besides)\b|n't\b")
+_CONDITION = re.compile(r"\b(than|older|younger|newer|before|after|between|since|until|during|within)\b|\d")
+# Words a listing question may consist of besides its filters ("salaries above 80k", "show rows in Sales")
+_LISTING_WORDS = re.compile(r"\b(show|list|me|all|the|a|an|with|whose|where|that|who|are|is|in|of|for|and|find|get|give|rows|records)\b")
+_STOPWORDS = {"the", "and", "for", "with", "from", "name", "of"}
+_COUNT = re.compile(r"\b(how many|count|number of)\s+(the\s+|different\s+|distinct\s+|unique\s+|separate\s+)*")
+
+
+class PlanError(ValueError):
+    """Raised when a plan is malformed or references columns the data does not have."""
+
+
+@dataclass
+class ComputedResult:
+    plan: dict[str, Any]
+    title: str
+    methodology: str
+    table: pd.DataFrame
+    rows_scanned: int
+    rows_matched: int
+
+
+def _stem(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def as_numeric(series: pd.Series) -> pd.Series | None:
+    """
+    Numeric view of a column. Text columns such as "$95,000" are converted when
+    at least 90% of their non-empty values parse as numbers; otherwise None.
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return None
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+        return None
+    sample = series.dropna().head(200)
+    if sample.empty:
+        return None
+    # Cheap rejection on a sample before converting the whole column
+    sample_numeric = pd.to_numeric(sample.astype(str).str.replace(r"[,$€£¥%\s]", "", regex=True), errors="coerce")
+    if sample_numeric.notna().mean() < 0.9:
+        return None
+    cleaned = series.astype(str).str.replace(r"[,$€£¥%\s]", "", regex=True)
+    converted = pd.to_numeric(cleaned, errors="coerce")
+    if converted[series.notna()].notna().mean() < 0.9:
+        return None
+    return converted
+
+
+def _parse_amount(number: str, suffix: str | None) -> float:
+    value = float(number.replace(",", ""))
+    if suffix == "k":
+        value *= 1_000
+    elif suffix == "m":
+        value *= 1_000_000
+    return value
+
+
+def mentioned_columns(q: str, df: pd.DataFrame) -> list[tuple[Any, int, int]]:
+    """(column, position in query, end position) for every column the question refers to, in order."""
+    words = [(_stem(m.group()), m.start(), m.end()) for m in re.finditer(r"[a-z0-9]+", q)]
+    found: list[tuple[Any, int, int]] = []
+    for col in df.columns:
+        name = str(col).lower()
+        exact = re.search(r"(?<![a-z0-9])" + re.escape(name) + r"(?![a-z0-9])", q)
+        if exact:
+            found.append((col, exact.start(), exact.end()))
+            continue
+        tokens = {_stem(t) for t in re.findall(r"[a-z0-9]+", name) if len(t) >= 3 and t not in _STOPWORDS}
+        for stem, start, end in words:
+            if stem in tokens:
+                found.append((col, start, end))
+                break
+    return sorted(found, key=lambda item: item[1])
+
+
+def _is_numeric(df: pd.DataFrame, col: Any, profile: "DatasetProfile | None") -> bool:
+    if profile is not None and profile.column(col) is not None:
+        return profile.kind(col) == "numeric"
+    return as_numeric(df[col]) is not None
+
+
+def _category_values(df: pd.DataFrame, col: Any, profile: "DatasetProfile | None") -> list[Any] | None:
+    if profile is not None and profile.column(col) is not None:
+        return profile.column(col).categories
+    series = df[col]
+    if not (pd.api.types.is_object_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype)
+            or pd.api.types.is_string_dtype(series)):
+        return None
+    values = series.dropna().unique()
+    return list(values) if len(values) <= MAX_FILTER_CARDINALITY else None
+
+
+def _value_filters(
+    q: str, df: pd.DataFrame, exclude: set[Any], profile: "DatasetProfile | None" = None
+) -> list[dict[str, Any]] | None:
+    """
+    Equality filters for category values that appear verbatim in the question.
+    None when the question names several values of one column ("Sales and
+    Engineering"), which a single equality filter cannot express.
+    """
+    filters = []
+    for col in df.columns:
+        if col in exclude or _is_numeric(df, col, profile):
+            continue
+        values = _category_values(df, col, profile)
+        if values is None:
+            continue
+        found: list[tuple[Any, int, int]] = []
+        for value in values:
+            text = str(value).lower()
+            if len(text) < 2:
+                continue
+            # Plurals count as the value too ("sales directors")
+            for m in re.finditer(r"(?<![a-z0-9])" + re.escape(text) + r"(?:e?s)?(?![a-z0-9])", q):
+                found.append((value, m.start(), m.end()))
+        # "Sales" inside "Sales Director" is part of the longer value, not a second one
+        matched = {value for value, start, end in found
+                   if not any(s <= start and end <= e and (s, e) != (start, end) for _, s, e in found)}
+        if len(matched) > 1:
+            return None
+        if matched:
+            filters.append({"column": col, "op": "==", "value": matched.pop()})
+    return filters
+
+
+def mentions_data(query: str, df: pd.DataFrame, profile: "DatasetProfile | None" = None) -> bool:
+    """Whether the question names a column or a category value of the data on its own"""
+    q = query.lower()
+    return bool(mentioned_columns(q, df)) or _value_filters(q, df, set(), profile) != []
+
+
+def _is_identifier(df: pd.DataFrame, col: Any, profile: "DatasetProfile | None") -> bool:
+    """A column with a distinct value on (nearly) every row, such as an employee id or name"""
+    column = profile.column(col) if profile is not None else None
+    distinct = column.distinct if column is not None else df[col].nunique()
+    return distinct >= 0.95 * max(1, int(df[col].notna().sum()))
+
+
+def parse_rule_plan(query: str, df: pd.DataFrame, profile: "DatasetProfile | None" = None) -> dict[str, Any] | None:
+    """
+    Rule-based planner for simple phrasings ("average salary by department",
+    "top 10 by salary", "how many employees in Sales", "salaries above 80k").
+    Returns None when the question is not a plain aggregation, or has a
+    condition or negation the rules cannot turn into a filter, so the caller
+    can fall back.
+    Column kinds and category values come from the upload's profile when given.
+    """
+    q = query.lower()
+    mentions = mentioned_columns(q, df)
+    numeric = [(col, start, end) for col, start, end in mentions if _is_numeric(df, col, profile)]
+    categorical = [(col, start, end) for col, start, end in mentions if not _is_numeric(df, col, profile)]
+
+    aggs = [name for name, pattern in _AGG_KEYWORDS if re.search(pattern, q)]
+    agg = aggs[0] if aggs else None
+    superlative = next((a for a in aggs if a in ("max", "min")), None)
+    top = _TOP_N.search(q)
+
+    # Group column: a non-numeric column introduced by "by/per/each/across/which",
+    # or named right after "top N" ("top 3 departments by total salary")
+    group_col, asked_which = None, False
+    for col, start, _ in categorical:
+        if _WHICH_PREFIX.search(q[:start]):
+            group_col, asked_which = col, True
+            break
+        if GROUP_PREFIX.search(q[:start]) or (top and start >= top.end() and not q[top.end():start].strip()):
+            group_col = col
+            break
+
+    if _NEGATION.search(q):
+        return None
+
+    filters: list[dict[str, Any]] = []
+    # The question with everything the rules understood blanked out; a condition left over means a filter was missed
+    rest = list(q)
+    for m in _COMPARISON.finditer(q):
+        before = [item for item in numeric if item[2] <= m.start()]
+        if before:
+            target = before[-1][0]
+        elif len(numeric) == 1:
+            target = numeric[0][0]
+        else:
+            return None
+        filters.append({"column": target, "op": _COMPARISON_OPS[m.group(1)],
+                        "value": _parse_amount(m.group(2), m.group(3))})
+        rest[m.start():m.end()] = " " * (m.end() - m.start())
+    values = _value_filters(q, df, exclude={group_col} if group_col is not None else set(), profile=profile)
+    if values is None:
+        return None
+    filters.extend(values)
+    spans = [(start, end) for _, start, end in mentions] + ([top.span()] if top else [])
+    for f in values:
+        spans += [m.span() for m in re.finditer(re.escape(str(f["value"]).lower()) + r"(?:e?s)?", q)]
+    for start, end in spans:
+        rest[start:end] = " " * (end - start)
+    rest_text = "".join(rest)
+    if _CONDITION.search(rest_text):
+        return None
+
+    filter_cols = {f["column"] for f in filters if f["op"] != "=="}
+    value_cols = [col for col, _, _ in numeric if col not in filter_cols] or [col for col, _, _ in numeric]
+    value_col = value_cols[0] if value_cols else None
+
+    if group_col is not None:
+        # "which department has the highest average salary": mean per group, ranked by the superlative
+        group_agg = next((a for a in aggs if a not in ("max", "min")), agg) if len(aggs) > 1 else agg
+        if group_agg == "count" or (group_agg is None and value_col is None):
+            plan = {"op": "group_by", "group_by": group_col, "agg": "count", "filters": filters}
+        elif group_agg is not None and value_col is not None:
+            plan = {"op": "group_by", "group_by": group_col, "column": value_col, "agg": group_agg, "filters": filters}
+        else:
+            return None
+        if top:
+            plan["n"] = int(top.group(2))
+            plan["ascending"] = top.group(1) in ("bottom", "lowest", "smallest", "last")
+        elif asked_which and superlative:
+            plan["n"] = 1
+            plan["ascending"] = superlative == "min"
+        return plan
+
+    if top and value_col is not None:
+        if agg not in (None, "max", "min"):
+            # "average salary of the top 3 earners": an aggregate over a ranking is beyond one plan
+            return None
+        return {
+            "op": "top_n",
+            "column": value_col,
+            "n": int(top.group(2)),
+            "ascending": top.group(1) in ("bottom", "lowest", "smallest", "last"),
+            "filters": filters,
+        }
+
+    if agg in ("max", "min") and value_col is not None and re.search(r"\b(who|which)\b", q):
+        return {"op": "top_n", "column": value_col, "n": 1, "ascending": agg == "min", "filters": filters}
+
+    if agg == "count":
+        # "how many departments are there": the counted noun is a category, so count its values, not rows
+        counting = _COUNT.search(q)
+        counted = next((col for col, start, _ in categorical if counting and start == counting.end()), None)
+        if counted is not None and counted not in {f["column"] for f in filters} \
+                and not _is_identifier(df, counted, profile):
+            return {"op": "aggregate", "column": counted, "agg": "nunique", "filters": filters}
+        return {"op": "count", "filters": filters}
+
+    if agg == "nunique" and mentions:
+        target = categorical[0][0] if categorical else mentions[0][0]
+        return {"op": "aggregate", "column": target, "agg": "nunique", "filters": filters}
+
+    if agg is not None and value_col is not None:
+        return {"op": "aggregate", "column": value_col, "agg": agg, "filters": filters}
+
+    if filters and (re.search(r"\b(show|list|which|who|find|rows|records)\b", q)
+                    or not re.search(r"[a-z]", _LISTING_WORDS.sub(" ", rest_text))):
+        return {"op": "filter", "filters": filters}
+
+    return None
+
+
+def validate_plan(plan: Any, df: pd.DataFrame, index: "DatasetIndex | None" = None) -> dict[str, Any]:
+    """Check a plan (possibly LLM-written) against the DataFrame and normalize it."""
+    if not isinstance(plan, dict) or plan.get("op") not in OPS:
+        raise PlanError("Unknown or missing op")
+    columns = {str(c): c for c in df.columns}
+
+    def column(key: str, numeric: bool = False) -> Any:
+        name = plan.get(key)
+        if str(name) not in columns:
+            raise PlanError(f"Unknown column for {key}: {name!r}")
+        col = columns[str(name)]
+        if numeric and (index.numeric(df, col) if index is not None else as_numeric(df[col])) is None:
+            raise PlanError(f"Column {name!r} is not numeric")
+        return col
+
+    clean: dict[str, Any] = {"op": plan["op"], "filters": []}
+    for f in plan.get("filters") or []:
+        if not isinstance(f, dict) or f.get("op") not in FILTER_OPS or str(f.get("column")) not in columns:
+            raise PlanError(f"Invalid filter: {f!r}")
+        clean["filters"].append({"column": columns[str(f["column"])], "op": f["op"], "value": f.get("value")})
+
+    agg = plan.get("agg")
+    if plan["op"] == "aggregate":
+        if agg not in AGGREGATIONS:
+            raise PlanError(f"Unknown aggregation: {agg!r}")
+        clean["agg"] = agg
+        clean["column"] = column("column", numeric=agg not in ("count", "nunique"))
+    elif plan["op"] == "top_n":
+        clean["column"] = column("column", numeric=True)
+        clean["n"] = max(1, min(int(plan.get("n") or 10), MAX_RESULT_ROWS))
+        clean["ascending"] = bool(plan.get("ascending", False))
+    elif plan["op"] == "group_by":
+        clean["group_by"] = column("group_by")
+        clean["agg"] = agg if agg in AGGREGATIONS else "count"
+        if clean["agg"] != "count":
+            clean["column"] = column("column", numeric=clean["agg"] != "nunique")
+        if plan.get("n"):
+            clean["n"] = max(1, min(int(plan["n"]), MAX_GROUPS))
+        clean["ascending"] = bool(plan.get("ascending", False))
+    return clean
+
+
+def filter_mask(
+    df: pd.DataFrame, filters: list[dict[str, Any]], index: "DatasetIndex | None" = None
+) -> np.ndarray | None:
+    """
+    Boolean row mask for a plan's filter list, or None without filters. Filters
+    the dataset's index covers are answered from it; the rest scan the column.
+    """
+    if not filters:
+        return None
+    mask = np.ones(len(df), dtype=bool)
+    for f in filters:
+        indexed = index.filter_mask(df, f) if index is not None else None
+        if indexed is not None:
+            mask &= indexed
+            continue
+        series = df[f["column"]]
+        op, value = f["op"], f["value"]
+        if op == "contains":
+            mask &= series.astype(str).str.contains(str(value), case=False, regex=False, na=False).to_numpy(bool)
+            continue
+        if op in (">", ">=", "<", "<="):
+            numeric = as_numeric(series)
+            if numeric is None:
+                raise PlanError(f"Cannot compare non-numeric column {f['column']!r}")
+            series, value = numeric, float(value)
+        elif isinstance(value, str) and (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            series, value = series.astype(str).str.lower(), value.lower()
+        if op == "==":
+            matched = series == value
+        elif op == "!=":
+            matched = series != value
+        elif op == ">":
+            matched = series > value
+        elif op == ">=":
+            matched = series >= value
+        elif op == "<":
+            matched = series < value
+        else:
+            matched = series <= value
+        mask &= matched.to_numpy(dtype=bool, na_value=False)
+    return mask
+
+
+def apply_filters(df: pd.DataFrame, filters: list[dict[str, Any]], index: "DatasetIndex | None" = None) -> pd.DataFrame:
+    """Vectorized row filtering for a plan's filter list."""
+    mask = filter_mask(df, filters, index)
+    return df if mask is None else df[mask]
+
+
+def _filters_text(filters: list[dict[str, Any]]) -> str:
+    return " and ".join(f"{f['column']} {f['op']} {f['value']}" for f in filters)
+
+
+def group_label(plan: dict[str, Any]) -> str:
+    """Name of the value column in a group_by result"""
+    return "Count" if plan["agg"] == "count" else f"{_AGG_LABELS[plan['agg']]} of {plan['column']}"
+
+
+def describe_plan(plan: dict[str, Any], rows_scanned: int, rows_matched: int) -> tuple[str, str]:
+    """Title and methodology text for the result of a validated plan"""
+    op = plan["op"]
+    steps = [f"Filtered rows where {_filters_text(plan['filters'])} ({rows_matched} of {rows_scanned} rows matched)."] if plan["filters"] else []
+    if op == "count":
+        title = "Row Count"
+        steps.append(f"Counted the matching rows across all {rows_scanned} rows.")
+    elif op == "aggregate":
+        col, agg = plan["column"], plan["agg"]
+        title = f"{_AGG_LABELS[agg]} of {col}"
+        steps.append(f"Computed the {_AGG_LABELS[agg].lower()} of {col} over {rows_matched} rows.")
+    elif op == "top_n":
+        col, n = plan["column"], plan["n"]
+        title = f"{'Bottom' if plan['ascending'] else 'Top'} {n} by {col}"
+        steps.append(f"Sorted {rows_matched} rows by {col} in {'ascending' if plan['ascending'] else 'descending'} order and kept the first {n}.")
+    elif op == "group_by":
+        label = group_label(plan)
+        title = f"{label} by {plan['group_by']}"
+        steps.append(f"Grouped {rows_matched} rows by {plan['group_by']} and computed {label.lower()} per group.")
+    else:
+        title = "Matching Rows"
+        if rows_matched > MAX_RESULT_ROWS:
+            steps.append(f"Showing the first {MAX_RESULT_ROWS} of {rows_matched} matching rows.")
+    return title, " ".join(steps)
+
+
+def execute_plan(df: pd.DataFrame, plan: dict[str, Any], index: "DatasetIndex | None" = None) -> ComputedResult:
+    """
+    Run a plan with vectorized pandas over the full DataFrame. Matching rows are
+    tracked as a mask, so only the columns a plan reads are filtered; `index`
+    answers covered filters and unfiltered group-bys without scanning.
+    Blocking; callers run it through the worker pool.
+    """
+    plan = validate_plan(plan, df, index)
+    mask = filter_mask(df, plan["filters"], index)
+    rows_matched = len(df) if mask is None else int(np.count_nonzero(mask))
+    op = plan["op"]
+
+    def column(col: Any, numeric: bool = False) -> pd.Series:
+        if numeric:
+            series = index.numeric(df, col) if index is not None else as_numeric(df[col])
+        else:
+            series = df[col]
+        return series if mask is None else series[mask]
+
+    if op == "count":
+        table = pd.DataFrame({"Metric": ["Matching rows"], "Value": [rows_matched]})
+    elif op == "aggregate":
+        col, agg = plan["column"], plan["agg"]
+        if agg == "nunique":
+            value = column(col).nunique()
+        elif agg == "count":
+            value = int(column(col).notna().sum())
+        else:
+            value = getattr(column(col, numeric=True), agg)()
+        table = pd.DataFrame({"Metric": [f"{_AGG_LABELS[agg]} of {col}"], "Value": [value]})
+    elif op == "top_n":
+        col, n = plan["column"], plan["n"]
+        keys = column(col, numeric=True)
+        order = keys.nsmallest(n) if plan["ascending"] else keys.nlargest(n)
+        table = df.loc[order.index]
+    elif op == "group_by":
+        group, agg = plan["group_by"], plan["agg"]
+        series = None
+        if index is not None and mask is None:
+            series = index.group_aggregate(df, group, plan.get("column"), agg)
+        if series is None and agg == "count":
+            keys = column(group)
+            series = keys.groupby(keys, observed=True).size()
+        elif series is None:
+            col = plan["column"]
+            values = column(col) if agg == "nunique" else column(col, numeric=True)
+            series = values.groupby(column(group), observed=True).agg(agg)
+        series = series.sort_values(ascending=plan["ascending"]).head(plan.get("n", MAX_GROUPS))
+        table = series.rename(group_label(plan)).reset_index()
+    else:
+        table = df.head(MAX_RESULT_ROWS) if mask is None else df.iloc[np.flatnonzero(mask)[:MAX_RESULT_ROWS]]
+
+    title, methodology = describe_plan(plan, len(df), rows_matched)
+    return ComputedResult(
+        plan=plan,
+        title=title,
+        methodology=methodology,
+        table=table,
+        rows_scanned=len(df),
+        rows_matched=rows_matched,
+    )
+
+
+def _format_cell(value: Any) -> str:
+    if isinstance(value, float):
+        return "" if pd.isna(value) else f"{value:,.2f}".rstrip("0").rstrip(".")
+    if value is None or value is pd.NA or value is pd.NaT:
+        return ""
+    return str(value).replace("|", "\\|")
+
+
+def markdown_table(df: pd.DataFrame) -> str:
+    """Render a small DataFrame as a Markdown table."""
+    header = "| " + " | ".join(str(c) for c in df.columns) + " |"
+    divider = "|" + "|".join("---" for _ in df.columns) + "|"
+    body = ["| " + " | ".join(_format_cell(v) for v in row) + " |" for row in df.itertuples(index=False)]
+    return "\n".join([header, divider, *body])
+
+
+def render_computed_report(result: ComputedResult) -> str:
+    """Deterministic Markdown report, used when no LLM is available to narrate the result."""
+    return f"""## {result.title}
+
+### Summary
+Computed directly from all {result.rows_scanned} rows of the dataset.
+
+### Methodology
+{result.methodology}
+
+### Findings
+
+**Data Results:**
+
+{markdown_table(result.table)}
+"""
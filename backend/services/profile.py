@@ -0,0 +1,158 @@
+from dataclasses import dataclass, field
+from typing import Any
+
+import pandas as pd
+
+from services.charts import as_datetime
+from services.context import format_number
+from services.planner import MAX_FILTER_CARDINALITY, as_numeric
+
+TOP_VALUES = 5
+
+
+@dataclass
+class ColumnProfile:
+    name: Any
+    dtype: str
+    kind: str  # "numeric", "date" or "category"
+    count: int
+    nulls: int
+    distinct: int
+    top_values: list[tuple[Any, int]] = field(default_factory=list)
+    # Every distinct value for low-cardinality columns; matched against questions by the planner
+    categories: list[Any] | None = None
+    min: float | None = None
+    max: float | None = None
+    mean: float | None = None
+    std: float | None = None
+    q25: float | None = None
+    median: float | None = None
+    q75: float | None = None
+    sum: float | None = None
+    is_currency: bool = False
+    date_min: str | None = None
+    date_max: str | None = None
+    prompt_line: str = ""
+    chart_line: str = ""
+
+
+@dataclass
+class DatasetProfile:
+    """
+    Everything the query and chart prompts need to know about an upload, computed
+    once per upload (or per edited column) and stored with the file.
+    """
+
+    fingerprint: str
+    row_count: int
+    columns: dict[Any, ColumnProfile]
+    schema_text: str = ""
+
+    def column(self, name: Any) -> ColumnProfile | None:
+        return self.columns.get(name)
+
+    def kind(self, name: Any) -> str | None:
+        profile = self.columns.get(name)
+        return profile.kind if profile is not None else None
+
+    def chart_schema(self, max_columns: int = 200) -> str:
+        lines = [profile.chart_line for profile in list(self.columns.values())[:max_columns]]
+        if len(self.columns) > max_columns:
+            lines.append(f"- ... {len(self.columns) - max_columns} more columns")
+        return "\n".join(lines)
+
+    def update_columns(self, df: pd.DataFrame, columns: list[Any], fingerprint: str) -> None:
+        """Recompute only the given columns after an edit; other columns keep their profiles."""
+        self.row_count = len(df)
+        self.fingerprint = fingerprint
+        for col in columns:
+            if col in df.columns:
+                previous = self.columns.get(col)
+                self.columns[col] = profile_column(df[col], currency=previous is not None and previous.is_currency)
+            else:
+                self.columns.pop(col, None)
+        # Keep the sheet's column order
+        self.columns = {col: self.columns[col] if col in self.columns else profile_column(df[col]) for col in df.columns}
+        self.schema_text = render_schema(self.columns)
+
+
+def _float(value: Any) -> float | None:
+    return None if pd.isna(value) else float(value)
+
+
+def profile_column(series: pd.Series, currency: bool = False) -> ColumnProfile:
+    """
+    Profile one column over all rows and pre-render its prompt lines. `currency`
+    marks numeric columns that held currency text before ingest converted them.
+    """
+    nulls = int(series.isna().sum())
+    distinct = int(series.nunique())
+    profile = ColumnProfile(
+        name=series.name,
+        dtype=str(series.dtype),
+        kind="category",
+        count=len(series) - nulls,
+        nulls=nulls,
+        distinct=distinct,
+    )
+
+    numeric = as_numeric(series)
+    dates = as_datetime(series) if numeric is None else None
+    if numeric is not None:
+        profile.kind = "numeric"
+        profile.is_currency = currency or not pd.api.types.is_numeric_dtype(series) and bool(
+            series.dropna().head(200).astype(str).str.contains(r"[$€£¥]").any()
+        )
+        quantiles = numeric.quantile([0.25, 0.5, 0.75])
+        profile.min, profile.max = _float(numeric.min()), _float(numeric.max())
+        profile.mean, profile.std = _float(numeric.mean()), _float(numeric.std())
+        profile.q25, profile.median, profile.q75 = (_float(v) for v in quantiles)
+        profile.sum = _float(numeric.sum())
+    elif dates is not None:
+        profile.kind = "date"
+        profile.date_min, profile.date_max = str(dates.min()), str(dates.max())
+
+    if profile.kind != "numeric":
+        profile.top_values = list(series.value_counts().head(TOP_VALUES).items())
+        if distinct <= MAX_FILTER_CARDINALITY:
+            profile.categories = list(series.dropna().unique())
+
+    render_column(profile, series.dropna().unique()[:3])
+    return profile
+
+
+def render_column(profile: ColumnProfile, examples: Any) -> None:
+    """Fill in the profile's pre-rendered prompt and chart-schema lines"""
+    parts = [f"{profile.dtype} (currency)" if profile.is_currency else profile.dtype, f"{profile.distinct} distinct"]
+    if profile.nulls:
+        parts.append(f"{profile.nulls} null")
+    if profile.kind == "numeric" and profile.min is not None:
+        parts.append(
+            f"min {format_number(profile.min)}, mean {format_number(profile.mean)}, "
+            f"median {format_number(profile.median)}, max {format_number(profile.max)}, "
+            f"sum {format_number(profile.sum)}"
+        )
+    elif profile.kind == "date":
+        parts.append(f"from {profile.date_min} to {profile.date_max}")
+    if profile.top_values:
+        parts.append("top: " + ", ".join(f"{value} ({count})" for value, count in profile.top_values))
+    profile.prompt_line = f"- {profile.name}: " + "; ".join(parts)
+
+    kind = "currency" if profile.is_currency else profile.kind
+    profile.chart_line = f"- {profile.name} ({kind}, {profile.distinct} distinct): {', '.join(str(v) for v in examples)}"
+
+
+def render_schema(columns: dict[Any, ColumnProfile]) -> str:
+    return "\n".join(f"- {col}: {profile.dtype}" for col, profile in columns.items())
+
+
+def build_profile(df: pd.DataFrame, fingerprint: str, currency_columns: list[Any] | None = None) -> DatasetProfile:
+    """Build the profile for an upload. Blocking; run it on the worker pool."""
+    currency = set(currency_columns or ())
+    columns = {col: profile_column(df[col], currency=col in currency) for col in df.columns}
+    return DatasetProfile(
+        fingerprint=fingerprint,
+        row_count=len(df),
+        columns=columns,
+        schema_text=render_schema(columns),
+    )
@@ -0,0 +1,578 @@
+import ast
+import asyncio
+import math
+import multiprocessing
+import operator
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from config.settings import (
+    EXECUTOR_QUEUE,
+    SANDBOX_CPU_SECONDS,
+    SANDBOX_MAX_OPERATIONS,
+    SANDBOX_MAX_UPDATES,
+    SANDBOX_MEMORY_MB,
+    SANDBOX_WORKERS,
+)
+from services.charts import ChartError, compute_chart
+from services.executor import ExecutorSaturated
+from services.metrics import record_span
+from services.optimize import widen_numeric
+
+try:
+    import resource
+except ImportError:  # not available on Windows; workers then run without OS limits
+    resource = None
+
+# Agent operations are a small JSON DSL, never Python code:
+# [
+#   {"op": "set_column", "column": "<name>", "expr": "<expression>", "where": "<expression>" (optional)},
+#   {"op": "filter_rows", "where": "<expression>"},
+#   {"op": "sort", "by": ["<column>", ...], "ascending": true | false},
+#   {"op": "drop_columns", "columns": ["<column>", ...]},
+#   {"op": "rename_columns", "mapping": {"<old>": "<new>"}},
+#   {"op": "fill_missing", "column": "<column>", "value": <value>},
+#   {"op": "drop_duplicates", "columns": ["<column>", ...] (optional)}
+# ]
+# Expressions are Python-syntax formulas over whole columns, e.g.
+# "Salary * 1.1", "where(col('Annual Salary') > 90000, 'high', 'normal')", "upper(Department)".
+OPERATIONS: dict[str, tuple[set[str], set[str]]] = {
+    # op -> (required keys, optional keys)
+    "set_column": ({"column", "expr"}, {"where"}),
+    "filter_rows": ({"where"}, set()),
+    "sort": ({"by"}, {"ascending"}),
+    "drop_columns": ({"columns"}, set()),
+    "rename_columns": ({"mapping"}, set()),
+    "fill_missing": ({"column", "value"}, set()),
+    "drop_duplicates": (set(), {"columns"}),
+}
+MAX_EXPRESSION_CHARS = 500
+MAX_EXPRESSION_NODES = 100
+# Integer powers run as one uninterruptible call; larger exponents are computed as floats
+MAX_INT_EXPONENT = 64
+
+_BINARY = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+_COMPARE = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.Name,
+    ast.Constant, ast.Load, ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or, *_BINARY, *_COMPARE,
+)
+
+
+class OperationError(ValueError):
+    """Raised when an agent operation or expression is invalid for the sheet."""
+
+
+class SandboxLimitExceeded(Exception):
+    """Raised when an operation run hits the sandbox CPU-time or memory cap."""
+
+
+def _text(x: Any) -> Any:
+    return x.astype(str).where(x.notna()) if isinstance(x, pd.Series) else str(x)
+
+
+def _str_method(name: str) -> Callable[..., Any]:
+    def apply(x: Any, *args: Any) -> Any:
+        if isinstance(x, pd.Series):
+            return getattr(_text(x).str, name)(*args)
+        return getattr(str(x), name)(*args)
+    return apply
+
+
+def _contains(x: Any, needle: Any) -> Any:
+    if isinstance(x, pd.Series):
+        return _text(x).str.contains(str(needle), case=False, regex=False, na=False)
+    return str(needle).lower() in str(x).lower()
+
+
+def _where(cond: Any, a: Any, b: Any, index: pd.Index) -> pd.Series:
+    cond = pd.Series(cond, index=index) if not isinstance(cond, pd.Series) else cond
+    a = a if isinstance(a, pd.Series) else pd.Series(a, index=index)
+    return a.where(cond.fillna(False).astype(bool), b)
+
+
+def _number(x: Any) -> Any:
+    if isinstance(x, pd.Series):
+        return pd.to_numeric(_text(x).str.replace(r"[,$€£¥%\s]", "", regex=True), errors="coerce")
+    return pd.to_numeric(str(x).replace(",", ""), errors="coerce")
+
+
+def _date_part(part: str) -> Callable[[Any], Any]:
+    def apply(x: Any) -> Any:
+        dates = pd.to_datetime(x, errors="coerce", format="mixed")
+        return getattr(dates.dt, part) if isinstance(dates, pd.Series) else getattr(dates, part)
+    return apply
+
+
+# name -> (min args, max args, implementation); "where" also gets the frame index
+FUNCTIONS: dict[str, tuple[int, int, Callable[..., Any]]] = {
+    "abs": (1, 1, lambda x: x.abs() if isinstance(x, pd.Series) else abs(x)),
+    "round": (1, 2, lambda x, n=0: x.round(int(n)) if isinstance(x, pd.Series) else round(x, int(n))),
+    "min": (2, 2, lambda a, b: np.fmin(a, b)),
+    "max": (2, 2, lambda a, b: np.fmax(a, b)),
+    "upper": (1, 1, _str_method("upper")),
+    "lower": (1, 1, _str_method("lower")),
+    "strip": (1, 1, _str_method("strip")),
+    "title": (1, 1, _str_method("title")),
+    "replace": (3, 3, lambda x, old, new: _str_method("replace")(x, str(old), str(new))),
+    "len": (1, 1, lambda x: _text(x).str.len() if isinstance(x, pd.Series) else len(str(x))),
+    "contains": (2, 2, _contains),
+    "startswith": (2, 2, lambda x, s: _str_method("startswith")(x, str(s))),
+    "endswith": (2, 2, lambda x, s: _str_method("endswith")(x, str(s))),
+    "text": (1, 1, _text),
+    "number": (1, 1, _number),
+    "isnull": (1, 1, lambda x: x.isna() if isinstance(x, pd.Series) else x is None),
+    "notnull": (1, 1, lambda x: x.notna() if isinstance(x, pd.Series) else x is not None),
+    "fillna": (2, 2, lambda x, v: x.fillna(v) if isinstance(x, pd.Series) else (v if x is None else x)),
+    "where": (3, 3, _where),
+    "year": (1, 1, _date_part("year")),
+    "month": (1, 1, _date_part("month")),
+    "day": (1, 1, _date_part("day")),
+}
+
+
+def check_expression(text: Any) -> ast.Expression:
+    """Parse an expression and reject anything outside the whitelisted syntax."""
+    if not isinstance(text, str) or not text.strip():
+        raise OperationError("Expressions must be non-empty strings")
+    if len(text) > MAX_EXPRESSION_CHARS:
+        raise OperationError(f"Expression is longer than {MAX_EXPRESSION_CHARS} characters")
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError as e:
+        raise OperationError(f"Invalid expression {text!r}: {e.msg}") from None
+    nodes = list(ast.walk(tree))
+    if len(nodes) > MAX_EXPRESSION_NODES:
+        raise OperationError(f"Expression {text!r} is too complex")
+    for node in nodes:
+        if not isinstance(node, _ALLOWED_NODES):
+            raise OperationError(f"Unsupported syntax in {text!r}: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, str, bool, type(None))):
+            raise OperationError(f"Unsupported constant in {text!r}")
+        if isinstance(node, ast.Call):
+            name = node.func.id if isinstance(node.func, ast.Name) else None
+            if node.keywords or (name != "col" and name not in FUNCTIONS):
+                raise OperationError(f"Unknown function in {text!r}: {ast.unparse(node.func)}")
+            low, high = (1, 1) if name == "col" else FUNCTIONS[name][:2]
+            if not low <= len(node.args) <= high:
+                raise OperationError(f"{name}() takes {low}-{high} arguments")
+            if name == "col" and not (isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+                raise OperationError("col() takes a column name string")
+    return tree
+
+
+def _column(df: pd.DataFrame, name: Any) -> pd.Series:
+    matches = [i for i, col in enumerate(df.columns) if str(col) == str(name)]
+    if not matches:
+        raise OperationError(f"Unknown column: {name!r}")
+    series = df.iloc[:, matches[0]]
+    # Categoricals (see services/optimize.py) behave like their values in formulas
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(series.cat.categories.dtype)
+    # Compact int32 columns are widened so formulas cannot overflow
+    return widen_numeric(series)
+
+
+def _evaluate(node: ast.AST, df: pd.DataFrame) -> Any:
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, df)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return _column(df, node.id)
+    if isinstance(node, ast.BinOp):
+        left, right = _evaluate(node.left, df), _evaluate(node.right, df)
+        if isinstance(node.op, ast.Pow) and isinstance(right, int) and abs(right) > MAX_INT_EXPONENT:
+            right = float(right)
+        return _BINARY[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp):
+        value = _evaluate(node.operand, df)
+        if isinstance(node.op, ast.Not):
+            return ~value.astype(bool) if isinstance(value, pd.Series) else not value
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BoolOp):
+        values = [_evaluate(v, df) for v in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        result = values[0]
+        for value in values[1:]:
+            result = combine(result, value)
+        return result
+    if isinstance(node, ast.Compare):
+        left, result = _evaluate(node.left, df), True
+        for op, right_node in zip(node.ops, node.comparators):
+            right = _evaluate(right_node, df)
+            result = result & _COMPARE[type(op)](left, right)
+            left = right
+        return result
+    if isinstance(node, ast.IfExp):
+        return _where(_evaluate(node.test, df), _evaluate(node.body, df), _evaluate(node.orelse, df), df.index)
+    if isinstance(node, ast.Call):
+        name = node.func.id
+        if name == "col":
+            return _column(df, node.args[0].value)
+        args = [_evaluate(arg, df) for arg in node.args]
+        if name == "where":
+            args.append(df.index)
+        return FUNCTIONS[name][2](*args)
+    raise OperationError(f"Unsupported expression: {ast.unparse(node)}")
+
+
+def evaluate(text: str, df: pd.DataFrame) -> Any:
+    try:
+        return _evaluate(check_expression(text), df)
+    except OperationError:
+        raise
+    except (TypeError, ValueError, KeyError, AttributeError, ZeroDivisionError, OverflowError) as e:
+        raise OperationError(f"Cannot evaluate {text!r}: {e}") from None
+
+
+def _names(value: Any, key: str) -> list[str]:
+    names = [value] if isinstance(value, str) else value
+    if not isinstance(names, list) or not names or not all(isinstance(n, str) for n in names):
+        raise OperationError(f"'{key}' must be a column name or a list of column names")
+    return names
+
+
+def parse_operations(operations: Any) -> list[dict[str, Any]]:
+    """Check the shape of an operation list and the syntax of its expressions; columns are checked when it runs."""
+    if not isinstance(operations, list):
+        raise OperationError("Operations must be a list")
+    if len(operations) > SANDBOX_MAX_OPERATIONS:
+        raise OperationError(f"At most {SANDBOX_MAX_OPERATIONS} operations are allowed per request")
+    clean = []
+    for op in operations:
+        if not isinstance(op, dict) or op.get("op") not in OPERATIONS:
+            raise OperationError(f"Unknown operation: {op.get('op') if isinstance(op, dict) else op!r}")
+        required, optional = OPERATIONS[op["op"]]
+        missing = required - op.keys()
+        unknown = op.keys() - required - optional - {"op"}
+        if missing or unknown:
+            raise OperationError(f"{op['op']}: missing {sorted(missing)}, unexpected {sorted(unknown)}")
+        for key in ("expr", "where"):
+            if key in op:
+                check_expression(op[key])
+        for key in ("by", "columns"):
+            if key in op:
+                op[key] = _names(op[key], key)
+        if "column" in op and not isinstance(op["column"], str):
+            raise OperationError(f"{op['op']}: 'column' must be a string")
+        if op["op"] == "rename_columns" and not (
+            isinstance(op["mapping"], dict) and all(isinstance(v, str) for v in op["mapping"].values())
+        ):
+            raise OperationError("rename_columns: 'mapping' must map old names to new names")
+        clean.append(op)
+    return clean
+
+
+def _as_series(value: Any, df: pd.DataFrame) -> pd.Series:
+    return value if isinstance(value, pd.Series) else pd.Series([value] * len(df), index=df.index)
+
+
+def apply_operations(df: pd.DataFrame, operations: list[dict[str, Any]]) -> pd.DataFrame:
+    """Run parsed operations on a shallow copy of the frame; the input is never modified."""
+    out = df.copy(deep=False)
+    for op in operations:
+        kind = op["op"]
+        if kind == "set_column":
+            values = _as_series(evaluate(op["expr"], out), out)
+            if "where" in op:
+                mask = _as_series(evaluate(op["where"], out), out).fillna(False).astype(bool)
+                if op["column"] in out.columns:
+                    values = _column(out, op["column"]).where(~mask, values)
+                else:
+                    values = values.where(mask)
+            out[op["column"]] = values
+        elif kind == "filter_rows":
+            mask = _as_series(evaluate(op["where"], out), out).fillna(False).astype(bool)
+            out = out[mask]
+        elif kind == "sort":
+            for name in op["by"]:
+                _column(out, name)
+            out = out.sort_values(op["by"], ascending=op.get("ascending", True), kind="stable")
+        elif kind == "drop_columns":
+            for name in op["columns"]:
+                _column(out, name)
+            out = out.drop(columns=op["columns"])
+        elif kind == "rename_columns":
+            for name in op["mapping"]:
+                _column(out, name)
+            out = out.rename(columns=op["mapping"])
+        elif kind == "fill_missing":
+            out[op["column"]] = _column(out, op["column"]).fillna(op["value"])
+        elif kind == "drop_duplicates":
+            for name in op.get("columns") or []:
+                _column(out, name)
+            out = out.drop_duplicates(subset=op.get("columns"))
+    return out
+
+
+def sheet_frame(rows: list[list[Any]]) -> pd.DataFrame:
+    """DataFrame for a SheetState grid: row 0 is the header, the other rows are data."""
+    if not rows:
+        return pd.DataFrame()
+    width = max(len(row) for row in rows)
+    header = [str(v) if v not in (None, "") else f"Column {i + 1}" for i, v in enumerate(list(rows[0]) + [None] * (width - len(rows[0])))]
+    data = [list(row) + [None] * (width - len(row)) for row in rows[1:]]
+    return pd.DataFrame(data, columns=header).infer_objects()
+
+
+def _cell_values(series: pd.Series | None, length: int) -> np.ndarray:
+    # JSON-ready Python values, padded with None to `length`; NaN and infinities become None
+    values = np.full(length, None, dtype=object)
+    if series is not None and len(series):
+        missing = series.isna().to_numpy()
+        if pd.api.types.is_float_dtype(series):
+            missing |= np.isinf(series.to_numpy(dtype=float, na_value=np.nan))
+        cells = np.array(series.astype(object).tolist() + [None], dtype=object)[:-1]
+        cells[missing] = None
+        values[:len(cells)] = cells
+    return values
+
+
+def diff_frames(
+    before: pd.DataFrame, after: pd.DataFrame, max_updates: int = SANDBOX_MAX_UPDATES
+) -> tuple[list[tuple[int, int, Any]], int]:
+    """
+    Cell updates that turn the `before` grid into the `after` grid, by position:
+    row 0 is the header, cells past the end of `after` are cleared with None.
+    Returns at most `max_updates` updates and the total number of changed cells.
+    """
+    updates: list[tuple[int, int, Any]] = []
+    total = 0
+    width = max(before.shape[1], after.shape[1])
+    length = max(len(before), len(after))
+    for j in range(width):
+        old = before.iloc[:, j] if j < before.shape[1] else None
+        new = after.iloc[:, j] if j < after.shape[1] else None
+        old_name = str(before.columns[j]) if old is not None else None
+        new_name = str(after.columns[j]) if new is not None else None
+        if old_name != new_name:
+            total += 1
+            if len(updates) < max_updates:
+                updates.append((0, j, new_name))
+        if old is not None and new is not None and len(old) == len(new) and old.index.equals(new.index) and old.equals(new):
+            continue
+        old_values, new_values = _cell_values(old, length), _cell_values(new, length)
+        changed = np.flatnonzero(old_values != new_values)
+        total += len(changed)
+        room = max_updates - len(updates)
+        updates.extend((int(i) + 1, j, new_values[i]) for i in changed[:room])
+    return updates, total
+
+
+def to_ranges(updates: list[tuple[int, int, Any]]) -> list[tuple[int, int, list[list[Any]]]]:
+    """
+    Merge cell updates (in diff_frames order: column by column, rows ascending)
+    into rectangular blocks: runs of consecutive rows within a column, then
+    neighbouring columns with the same run. Returns (row, col, row-major values).
+    """
+    runs: list[list[Any]] = []  # [col, first row, last row, values]
+    for row, col, value in updates:
+        if runs and runs[-1][0] == col and runs[-1][2] == row - 1:
+            runs[-1][2] = row
+            runs[-1][3].append(value)
+        else:
+            runs.append([col, row, row, [value]])
+
+    blocks: list[list[Any]] = []  # [first row, first col, last col, column values]
+    last_block: dict[tuple[int, int], list[Any]] = {}
+    for col, first, last, values in runs:
+        block = last_block.get((first, last))
+        if block is not None and block[2] == col - 1:
+            block[2] = col
+            block[3].append(values)
+        else:
+            block = [first, col, col, [values]]
+            blocks.append(block)
+            last_block[(first, last)] = block
+    return [(first, col, [list(row) for row in zip(*columns)]) for first, col, _, columns in blocks]
+
+
+@dataclass
+class SandboxResult:
+    updates: list[tuple[int, int, Any]]
+    changed_cells: int
+    # Cells included in the result; fewer than changed_cells when SANDBOX_MAX_UPDATES cut it short
+    returned_cells: int
+    row_count: int
+    columns: list[str]
+    chart: dict[str, Any] | None = None
+    notes: list[str] = field(default_factory=list)
+    # The updates merged into blocks (see to_ranges), when asked for; `updates` is then empty
+    ranges: list[tuple[int, int, list[list[Any]]]] | None = None
+
+
+def _run(
+    df: pd.DataFrame, operations: list[dict[str, Any]], chart_spec: dict | None, max_updates: int, ranges: bool
+) -> SandboxResult:
+    # Runs inside a sandbox worker
+    after = apply_operations(df, operations)
+    updates, changed = diff_frames(df, after, max_updates)
+    result = SandboxResult(updates, changed, len(updates), len(after), [str(col) for col in after.columns])
+    if ranges:
+        result.ranges, result.updates = to_ranges(updates), []
+    if chart_spec is not None:
+        try:
+            result.chart = compute_chart(after, chart_spec)
+        except ChartError as e:
+            result.notes.append(f"Chart skipped: {e}")
+    return result
+
+
+def _on_cpu_limit(signum: int, frame: Any) -> None:
+    raise SandboxLimitExceeded(f"Operations exceeded the {SANDBOX_CPU_SECONDS}s CPU-time limit")
+
+
+def _init_worker(memory_mb: int) -> None:
+    # Workers start from a fresh interpreter, so the cap covers only their own data
+    if resource is None:
+        return
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+
+def _limited(fn: Callable[..., Any], *args: Any) -> tuple[Any, float]:
+    # RLIMIT_CPU counts the worker's lifetime CPU time, so the soft limit is moved per task
+    limited = resource is not None and SANDBOX_CPU_SECONDS > 0
+    if limited:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        soft = math.ceil(usage.ru_utime + usage.ru_stime) + SANDBOX_CPU_SECONDS
+        resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+    start = time.perf_counter()
+    try:
+        return fn(*args), time.perf_counter() - start
+    except MemoryError:
+        raise SandboxLimitExceeded(f"Operations exceeded the {SANDBOX_MEMORY_MB} MB memory limit") from None
+    finally:
+        if limited:
+            resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+# One single-process pool per worker slot: a task starts only when a slot is free, and a
+# stuck or killed worker takes down its own task only, never the others
+_idle: list[ProcessPoolExecutor] = []
+_slots: asyncio.Semaphore | None = None
+_in_flight = 0
+_stats = {"runs": 0, "failed": 0, "limit_exceeded": 0, "restarts": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+
+def _start_worker() -> ProcessPoolExecutor:
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(
+        max_workers=1, mp_context=context, initializer=_init_worker, initargs=(SANDBOX_MEMORY_MB,)
+    )
+
+
+async def _checkout() -> ProcessPoolExecutor:
+    """Wait for a free slot and take its worker, starting one for a slot that has none"""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(SANDBOX_WORKERS)
+    await _slots.acquire()
+    return _idle.pop() if _idle else _start_worker()
+
+
+def _checkin(worker: ProcessPoolExecutor | None) -> None:
+    """Free the slot; a retired worker (None) is replaced on the slot's next use"""
+    if worker is not None:
+        _idle.append(worker)
+    _slots.release()
+
+
+def _retire(worker: ProcessPoolExecutor, kill: bool = False) -> None:
+    if kill:
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((worker._processes or {}).values()):
+            process.kill()
+    worker.shutdown(wait=False, cancel_futures=True)
+    _stats["restarts"] += 1
+
+
+async def run_operations(
+    df: pd.DataFrame, operations: list[dict[str, Any]], chart_spec: dict | None = None, ranges: bool = False
+) -> SandboxResult:
+    """
+    Apply agent operations to a copy of the frame in a sandbox worker process and
+    return the resulting cell updates, merged into blocks with `ranges`. Workers are capped at SANDBOX_CPU_SECONDS of
+    CPU time per request and SANDBOX_MEMORY_MB of memory. The wall-clock limit
+    starts once a worker takes the task, so time queued behind others is not counted.
+    """
+    global _in_flight
+    if _in_flight >= SANDBOX_WORKERS + EXECUTOR_QUEUE:
+        raise ExecutorSaturated(f"Server is busy ({_in_flight} sheet operations in progress). Please retry shortly.")
+
+    _in_flight += 1
+    loop = asyncio.get_running_loop()
+    worker: ProcessPoolExecutor | None = None
+    checked_out = False
+    try:
+        worker = await _checkout()
+        checked_out = True
+        future = loop.run_in_executor(worker, _limited, _run, df, operations, chart_spec, SANDBOX_MAX_UPDATES, ranges)
+        timeout = SANDBOX_CPU_SECONDS * 2 + 10 if SANDBOX_CPU_SECONDS > 0 else None
+        result, run_s = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        # Stuck in a single native call where SIGXCPU cannot interrupt it
+        _stats["limit_exceeded"] += 1
+        _retire(worker, kill=True)
+        worker = None
+        raise SandboxLimitExceeded("Operations exceeded the sandbox time limit") from None
+    except asyncio.CancelledError:
+        # The request went away mid-run; its worker is still busy, so it is not handed to the next request
+        if checked_out:
+            _retire(worker, kill=True)
+            worker = None
+        raise
+    except SandboxLimitExceeded:
+        _stats["limit_exceeded"] += 1
+        raise
+    except BrokenProcessPool:
+        # This task's worker was killed (hard memory or CPU limit); the slot starts a fresh one next time
+        _stats["limit_exceeded"] += 1
+        _retire(worker)
+        worker = None
+        raise SandboxLimitExceeded("Operations exceeded the sandbox resource limits") from None
+    except Exception:
+        _stats["failed"] += 1
+        raise
+    finally:
+        _in_flight -= 1
+        if checked_out:
+            _checkin(worker)
+    _stats["runs"] += 1
+    record_span("sandbox", run_s)
+    _stats["total_ms"] += run_s * 1000
+    _stats["max_ms"] = max(_stats["max_ms"], run_s * 1000)
+    return result
+
+
+def sandbox_stats() -> dict[str, Any]:
+    return {
+        "workers": SANDBOX_WORKERS,
+        "cpu_seconds": SANDBOX_CPU_SECONDS,
+        "memory_mb": SANDBOX_MEMORY_MB,
+        "in_flight": _in_flight,
+        "runs": _stats["runs"],
+        "failed": _stats["failed"],
+        "limit_exceeded": _stats["limit_exceeded"],
+        "restarts": _stats["restarts"],
+        "avg_ms": round(_stats["total_ms"] / _stats["runs"], 3) if _stats["runs"] else 0.0,
+        "max_ms": round(_stats["max_ms"], 3),
+    }
@@ -0,0 +1,273 @@
+import json
+import os
+import threading
+import time
+from typing import Any
+
+import pandas as pd
+
+from config.settings import ENGINE_DIR, ENGINE_MEMORY_MB, ENGINE_THREADS, QUERY_PLANNER, SQL_TIMEOUT_SECONDS
+from services.cache import response_cache_key
+from services.engine import amount_sql, duckdb, quote
+from services.logs import get_logger
+from services.planner import MAX_RESULT_ROWS, ComputedResult
+
+log = get_logger("sql")
+
+if QUERY_PLANNER == "sql" and duckdb is None:
+    log.warning("QUERY_PLANNER=sql needs the duckdb package (pip install duckdb); planning with JSON plans instead")
+
+ENABLED = duckdb is not None
+# The table name questions are answered against
+TABLE = "data"
+# Distinct values listed in the schema so the model can write exact filters
+SCHEMA_CATEGORIES = 20
+
+# Functions a generated query may call. Everything else (file readers, settings,
+# getenv, table functions) is rejected before the query runs.
+SQL_FUNCTIONS = frozenset({
+    # aggregates
+    "count", "count_star", "sum", "avg", "mean", "min", "max", "median", "mode", "quantile_cont", "quantile_disc",
+    "quantile", "approx_quantile", "approx_count_distinct", "stddev", "stddev_samp", "stddev_pop", "variance",
+    "var_samp", "var_pop", "corr", "covar_samp", "covar_pop", "regr_slope", "regr_intercept", "regr_r2",
+    "arg_max", "arg_min", "max_by", "min_by", "first", "last", "any_value", "string_agg", "bool_and", "bool_or",
+    "product", "fsum", "sumkahan", "kurtosis", "skewness", "entropy", "histogram", "list",
+    # windows
+    "row_number", "rank", "dense_rank", "percent_rank", "cume_dist", "ntile", "lag", "lead", "first_value",
+    "last_value", "nth_value",
+    # numbers
+    "abs", "round", "floor", "ceil", "ceiling", "trunc", "sign", "sqrt", "cbrt", "pow", "power", "exp", "ln", "log",
+    "log10", "log2", "greatest", "least", "mod", "isnan", "isinf", "isfinite", "coalesce", "nullif", "ifnull",
+    # text
+    "lower", "upper", "lcase", "ucase", "trim", "ltrim", "rtrim", "length", "strlen", "substr", "substring", "left",
+    "right", "replace", "concat", "concat_ws", "contains", "starts_with", "ends_with", "prefix", "suffix", "strpos",
+    "position", "instr", "lpad", "rpad", "split_part", "regexp_matches", "regexp_full_match", "regexp_replace",
+    "regexp_extract", "like_escape", "ilike_escape", "format", "printf", "reverse", "repeat",
+    # dates
+    "date_trunc", "datetrunc", "date_part", "datepart", "date_diff", "datediff", "date_sub", "datesub", "date_add",
+    "strftime", "strptime", "try_strptime", "year", "month", "day", "quarter", "week", "weekofyear", "dayofweek",
+    "dayofyear", "dayname", "monthname", "hour", "minute", "second", "epoch", "last_day", "make_date",
+    "current_date", "today", "to_days", "to_months", "to_years", "to_weeks", "to_hours",
+})
+
+
+class SQLError(ValueError):
+    """A generated query that is not a single read-only SELECT over the data, or that failed to run"""
+
+
+_stats = {"generated": 0, "cache_hits": 0, "rejected": 0, "executed": 0, "failed": 0, "execute_seconds": 0.0}
+# Generated SQL runs in its own DuckDB database that can read only the engine's Parquet files
+_db: Any = None
+_db_lock = threading.Lock()
+
+
+def cursor() -> Any:
+    """
+    A cursor on the database generated queries run in. External access is off,
+    so file readers and paths used as table names fail even if validation
+    missed them; only ENGINE_DIR (the query engine's files) stays readable.
+    """
+    global _db
+    with _db_lock:
+        if _db is None:
+            os.makedirs(ENGINE_DIR, exist_ok=True)
+            db = duckdb.connect(config={"memory_limit": f"{ENGINE_MEMORY_MB}MB", "threads": ENGINE_THREADS})
+            db.execute("SET allowed_directories = ?", [[os.path.join(os.path.abspath(ENGINE_DIR), "")]])
+            db.execute("SET enable_external_access = false")
+            _db = db
+        return _db.cursor()
+
+
+def sql_cache_key(fingerprint: str, query: str, model: str) -> str:
+    """Response cache key under which a dataset's question keeps its compiled SQL"""
+    return response_cache_key(fingerprint, query, "sql", model)
+
+
+def record_sql(event: str) -> None:
+    _stats[event] += 1
+
+
+def _is_text(series: pd.Series) -> bool:
+    return not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series))
+
+
+def _is_narrow_int(series: pd.Series) -> bool:
+    return pd.api.types.is_integer_dtype(series.dtype) and series.dtype.itemsize < 8
+
+
+def _view_sql(dataframe: pd.DataFrame, file_info: dict) -> tuple[str, str]:
+    """
+    The `data` view the query runs against and the relation it reads: the stored
+    Parquet file for the query engine, the registered DataFrame otherwise. Text
+    columns the profile reads as numbers ("$95,000") are exposed as numbers,
+    categoricals as text and compact integer columns as BIGINT.
+    """
+    profile = file_info.get('profile')
+    engine = file_info.get('engine')
+    select = []
+    for col in dataframe.columns:
+        kind = profile.kind(col) if profile is not None else None
+        if kind == "numeric" and _is_text(dataframe[col]):
+            select.append(f"{amount_sql(quote(col))} AS {quote(col)}")
+        elif isinstance(dataframe[col].dtype, pd.CategoricalDtype):
+            # Categoricals register as ENUMs, which reject comparisons with values they do not hold
+            select.append(f"CAST({quote(col)} AS VARCHAR) AS {quote(col)}")
+        elif _is_narrow_int(dataframe[col]):
+            # Compact int32 columns (see services/optimize.py) would overflow in arithmetic
+            select.append(f"CAST({quote(col)} AS BIGINT) AS {quote(col)}")
+        else:
+            select.append(quote(col))
+    source = engine.source if engine is not None else "_frame"
+    return f"SELECT {', '.join(select)} FROM {source}", source
+
+
+def _connect(dataframe: pd.DataFrame, file_info: dict) -> tuple[Any, str]:
+    con = cursor()
+    view, source = _view_sql(dataframe, file_info)
+    if source == "_frame":
+        con.register("_frame", dataframe)
+    return con, view
+
+
+def schema_text(dataframe: pd.DataFrame, file_info: dict) -> str:
+    """
+    The `data` table as the model sees it: SQL type, role and range of each
+    column, and the exact values of low-cardinality ones. Blocking; run it on the
+    worker pool.
+    """
+    con, view = _connect(dataframe, file_info)
+    try:
+        types = con.execute(f"DESCRIBE {view}").fetchall()
+    finally:
+        con.close()
+    profile = file_info.get('profile')
+    lines = [f"TABLE {TABLE} ({file_info.get('row_count', len(dataframe))} rows)"]
+    for name, sql_type, *_ in types:
+        column = profile.column(name) if profile is not None else None
+        parts = [f"- {quote(name)} {sql_type}"]
+        if column is not None:
+            if column.is_currency:
+                parts.append("currency")
+            if column.kind == "numeric" and column.min is not None:
+                parts.append(f"from {column.min:g} to {column.max:g}")
+            elif column.kind == "date" and column.date_min:
+                parts.append(f"from {column.date_min} to {column.date_max}")
+            if column.categories is not None and len(column.categories) <= SCHEMA_CATEGORIES:
+                parts.append("values: " + ", ".join(repr(str(v)) for v in column.categories))
+            elif column.kind == "category":
+                parts.append(f"{column.distinct} distinct")
+        lines.append("; ".join(parts))
+    return "\n".join(lines)
+
+
+def _walk(node: Any, functions: set[str], tables: list[tuple[dict, frozenset[str]]], ctes: frozenset[str]) -> None:
+    # `ctes` holds the CTE names visible at this point: those of the enclosing queries only,
+    # so a name defined in one subquery does not cover a table (or file path) elsewhere
+    if isinstance(node, dict):
+        if node.get("class") in ("FUNCTION", "WINDOW") and not node.get("is_operator"):
+            name = node.get("function_name")
+            if name:
+                functions.add(name.lower())
+        if node.get("type") in ("BASE_TABLE", "TABLE_FUNCTION"):
+            tables.append((node, ctes))
+        defined = [str(cte.get("key", "")).lower() for cte in (node.get("cte_map") or {}).get("map") or []]
+        if defined:
+            ctes = ctes | frozenset(defined)
+        for value in node.values():
+            _walk(value, functions, tables, ctes)
+    elif isinstance(node, list):
+        for value in node:
+            _walk(value, functions, tables, ctes)
+
+
+def validate_sql(sql: Any) -> str:
+    """
+    Check that generated SQL is one SELECT that reads only the `data` table (or
+    its own CTEs) and calls only SQL_FUNCTIONS; returns it without a trailing
+    semicolon. DuckDB parses it, so nothing is executed.
+    """
+    if not isinstance(sql, str) or not sql.strip():
+        raise SQLError("No SQL query")
+    sql = sql.strip().rstrip(";").strip()
+    con = cursor()
+    try:
+        tree = json.loads(con.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    finally:
+        con.close()
+    if tree.get("error"):
+        raise SQLError(tree.get("error_message") or "Only SELECT queries are allowed")
+    if len(tree.get("statements") or []) != 1:
+        raise SQLError("Exactly one SELECT query is allowed")
+
+    functions: set[str] = set()
+    tables: list[tuple[dict, frozenset[str]]] = []
+    _walk(tree["statements"], functions, tables, frozenset())
+    for table, ctes in tables:
+        name = str(table.get("table_name") or "").lower()
+        if table["type"] != "BASE_TABLE" or table.get("schema_name") or table.get("catalog_name") or name not in {TABLE, *ctes}:
+            raise SQLError(f"Queries may only read the {TABLE} table")
+    unknown = sorted(functions - SQL_FUNCTIONS)
+    if unknown:
+        raise SQLError(f"Functions not allowed: {', '.join(unknown)}")
+    return sql
+
+
+def run_sql(sql: str, dataframe: pd.DataFrame, file_info: dict, title: str | None = None) -> ComputedResult:
+    """
+    Validate and run a generated query over every row: the registered DataFrame,
+    or the query engine's Parquet file for large uploads. At most MAX_RESULT_ROWS
+    rows are returned; queries running past SQL_TIMEOUT_SECONDS are interrupted.
+    Blocking; callers run it through the worker pool.
+    """
+    try:
+        sql = validate_sql(sql)
+    except SQLError:
+        _stats["rejected"] += 1
+        raise
+    started = time.perf_counter()
+    con, view = _connect(dataframe, file_info)
+    timer = threading.Timer(SQL_TIMEOUT_SECONDS, con.interrupt) if SQL_TIMEOUT_SECONDS > 0 else None
+    try:
+        if timer is not None:
+            timer.start()
+        table = con.execute(
+            f"WITH {TABLE} AS ({view}) SELECT * FROM ({sql}) AS result LIMIT {MAX_RESULT_ROWS + 1}"
+        ).df()
+    except duckdb.Error as e:
+        _stats["failed"] += 1
+        if isinstance(e, duckdb.InterruptException):
+            raise SQLError(f"The query ran for more than {SQL_TIMEOUT_SECONDS:g}s") from e
+        raise SQLError(str(e)) from e
+    finally:
+        if timer is not None:
+            timer.cancel()
+        con.close()
+    _stats["executed"] += 1
+    _stats["execute_seconds"] += time.perf_counter() - started
+
+    rows = file_info.get('row_count', len(dataframe))
+    methodology = f"Ran this SQL query over all {rows} rows of the {TABLE} table: `{' '.join(sql.split())}`."
+    if len(table) > MAX_RESULT_ROWS:
+        table = table.head(MAX_RESULT_ROWS)
+        methodology += f" Showing the first {MAX_RESULT_ROWS} result rows."
+    return ComputedResult(
+        plan={"op": "sql", "sql": sql},
+        title=title or "Query Result",
+        methodology=methodology,
+        table=table,
+        rows_scanned=rows,
+        rows_matched=len(table),
+    )
+
+
+def sql_stats() -> dict[str, Any]:
+    executed = _stats["executed"]
+    return {
+        "enabled": ENABLED and QUERY_PLANNER == "sql",
+        "generated": _stats["generated"],
+        "cache_hits": _stats["cache_hits"],
+        "rejected": _stats["rejected"],
+        "executed": executed,
+        "failed": _stats["failed"],
+        "avg_execute_ms": round(_stats["execute_seconds"] * 1000 / executed, 1) if executed else 0.0,
+    }
@@ -0,0 +1,481 @@
+import asyncio
+import os
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import pandas as pd
+
+from config.settings import (
+    DATAFRAME_STORE,
+    INGEST_STRINGS,
+    SHARED_STORE_DIR,
+    STORE_MAX_BYTES,
+    STORE_SPILL_DIR,
+    STORE_TTL_SECONDS,
+    WEB_CONCURRENCY,
+)
+from services.logs import get_logger
+from services.metrics import record_span
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # the disk-spill and shared backends need pyarrow
+    pa = None
+
+log = get_logger("store")
+
+
+def write_frame(base_path: str, df: pd.DataFrame) -> str:
+    """
+    Persist a DataFrame as uncompressed Arrow IPC (Feather v2) so it can be
+    memory-mapped without decoding. Files are written under a temporary name and
+    renamed into place, so concurrent readers never see a partial file.
+    """
+    tmp_path = f"{base_path}.{os.getpid()}.tmp"
+    try:
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+        path = f"{base_path}.arrow"
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed-type object columns have no Arrow equivalent
+        df.to_pickle(tmp_path)
+        path = f"{base_path}.pkl"
+    os.replace(tmp_path, path)
+    # Drop a stale copy in the other format left by an earlier write
+    stale = f"{base_path}.pkl" if path.endswith(".arrow") else f"{base_path}.arrow"
+    if os.path.exists(stale):
+        os.unlink(stale)
+    return path
+
+
+def read_frame(base_path: str) -> pd.DataFrame | None:
+    """Memory-map a frame written by write_frame; numeric columns without nulls are zero-copy."""
+    arrow_path = f"{base_path}.arrow"
+    if os.path.exists(arrow_path):
+        source = pa.memory_map(arrow_path, "r")
+        table = pa.ipc.open_file(source).read_all()
+        if INGEST_STRINGS == "arrow":
+            # Keep the NaN-based pyarrow strings set at ingest (services/optimize.py)
+            strings = pd.StringDtype("pyarrow_numpy")
+            return table.to_pandas(split_blocks=True, types_mapper={pa.string(): strings, pa.large_string(): strings}.get)
+        return table.to_pandas(split_blocks=True)
+    pickle_path = f"{base_path}.pkl"
+    if os.path.exists(pickle_path):
+        return pd.read_pickle(pickle_path)
+    return None
+
+
+def write_meta(base_path: str, file_data: dict[str, Any]) -> None:
+    meta = {k: v for k, v in file_data.items() if k != 'dataframe'}
+    tmp_path = f"{base_path}.meta.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(meta, f)
+    os.replace(tmp_path, f"{base_path}.meta")
+
+
+def read_meta(base_path: str) -> dict[str, Any] | None:
+    try:
+        with open(f"{base_path}.meta", "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def unlink_frame(base_path: str) -> bool:
+    removed = False
+    for suffix in (".arrow", ".pkl", ".meta"):
+        try:
+            os.unlink(f"{base_path}{suffix}")
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def frame_nbytes(file_data: dict[str, Any]) -> int:
+    """Deep memory footprint of the DataFrame held in a file_data entry"""
+    df = file_data.get('dataframe')
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+
+class DataFrameStore(ABC):
+    """
+    Storage for uploaded files. Each entry is the file_data dict built by
+    upload_excel_file, including the parsed DataFrame under 'dataframe'.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, file_id: str) -> dict[str, Any] | None:
+        ...
+
+    @abstractmethod
+    def put(self, file_id: str, file_data: dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, file_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict[str, Any]:
+        ...
+
+    def __contains__(self, file_id: str) -> bool:
+        return self.get(file_id) is not None
+
+    # Backends that read or write files set this, so their calls run off the event loop
+    blocking_io = False
+
+    async def _call(self, fn: Any, *args: Any) -> Any:
+        if not self.blocking_io:
+            return fn(*args)
+        start = time.perf_counter()
+        try:
+            # A thread rather than the worker pool: the store's state lives in this process
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            record_span("store", time.perf_counter() - start)
+
+    async def get_async(self, file_id: str) -> dict[str, Any] | None:
+        return await self._call(self.get, file_id)
+
+    async def put_async(self, file_id: str, file_data: dict[str, Any]) -> None:
+        await self._call(self.put, file_id, file_data)
+
+    async def delete_async(self, file_id: str) -> bool:
+        return await self._call(self.delete, file_id)
+
+
+@dataclass
+class _Entry:
+    file_data: dict[str, Any]
+    nbytes: int
+    expires_at: float
+
+
+class MemoryLRUStore(DataFrameStore):
+    """
+    In-process store that evicts the least recently used files once the total
+    DataFrame size exceeds max_bytes, and drops entries older than ttl_seconds.
+    A single file larger than max_bytes is still kept until something else is added.
+    """
+
+    def __init__(self, max_bytes: int = STORE_MAX_BYTES, ttl_seconds: float = STORE_TTL_SECONDS) -> None:
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.expirations = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def _expiry(self) -> float:
+        return time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else float('inf')
+
+    def _remove(self, file_id: str) -> _Entry | None:
+        entry = self._entries.pop(file_id, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+        return entry
+
+    def _evict(self, file_id: str, entry: _Entry) -> None:
+        """Hook for subclasses; called for entries pushed out by the size limit."""
+        self.evictions += 1
+
+    def _load(self, file_id: str) -> dict[str, Any] | None:
+        """Hook for subclasses to serve entries that are not in memory."""
+        return None
+
+    def get(self, file_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(file_id)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(file_id)
+                self.hits += 1
+                return entry.file_data
+
+            file_data = self._load(file_id)
+            if file_data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(file_id, file_data)
+            return file_data
+
+    def _insert(self, file_id: str, file_data: dict[str, Any]) -> None:
+        self._remove(file_id)
+        entry = _Entry(file_data, frame_nbytes(file_data), self._expiry())
+        self._entries[file_id] = entry
+        self._bytes += entry.nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            oldest_id, oldest = self._entries.popitem(last=False)
+            self._bytes -= oldest.nbytes
+            self._evict(oldest_id, oldest)
+
+    def put(self, file_id: str, file_data: dict[str, Any]) -> None:
+        with self._lock:
+            self._insert(file_id, file_data)
+
+    def delete(self, file_id: str) -> bool:
+        with self._lock:
+            return self._remove(file_id) is not None
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class DiskSpillStore(MemoryLRUStore):
+    """
+    Memory LRU store that spills evicted frames to disk as uncompressed Arrow IPC
+    (Feather v2) instead of dropping them, and memory-maps them back on the next get.
+    """
+
+    blocking_io = True
+
+    def __init__(
+        self,
+        spill_dir: str = STORE_SPILL_DIR,
+        max_bytes: int = STORE_MAX_BYTES,
+        ttl_seconds: float = STORE_TTL_SECONDS,
+    ) -> None:
+        super().__init__(max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self.spill_dir = spill_dir
+        self.spills = 0
+        self.reloads = 0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def _base(self, file_id: str) -> str:
+        return os.path.join(self.spill_dir, file_id)
+
+    def _evict(self, file_id: str, entry: _Entry) -> None:
+        super()._evict(file_id, entry)
+        try:
+            write_frame(self._base(file_id), entry.file_data['dataframe'])
+            write_meta(self._base(file_id), entry.file_data)
+            self.spills += 1
+        except Exception as e:
+            log.error(f"Error spilling {file_id} to disk: {e}")
+
+    def _load(self, file_id: str) -> dict[str, Any] | None:
+        base = self._base(file_id)
+        meta_path = f"{base}.meta"
+        if not os.path.exists(meta_path):
+            return None
+        if self.ttl_seconds > 0 and os.path.getmtime(meta_path) + self.ttl_seconds <= time.time():
+            unlink_frame(base)
+            self.expirations += 1
+            return None
+        df = read_frame(base)
+        file_data = read_meta(base)
+        if df is None or file_data is None:
+            return None
+        file_data['dataframe'] = df
+        # Back in memory, so the spilled copy is no longer needed
+        unlink_frame(base)
+        self.reloads += 1
+        return file_data
+
+    def delete(self, file_id: str) -> bool:
+        with self._lock:
+            in_memory = self._remove(file_id) is not None
+            on_disk = unlink_frame(self._base(file_id))
+            return in_memory or on_disk
+
+    def stats(self) -> dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                "backend": "disk",
+                "spill_dir": self.spill_dir,
+                "spilled_entries": sum(1 for name in os.listdir(self.spill_dir) if name.endswith(".meta")),
+                "spills": self.spills,
+                "reloads": self.reloads,
+            })
+        return stats
+
+
+class SharedArrowStore(DataFrameStore):
+    """
+    Store for multi-worker deployments. Every upload is written once to a shared
+    directory as Arrow IPC keyed by file_id, and any worker can memory-map it.
+    Mapped pages live in the OS page cache, so N workers reading the same file
+    share one physical copy of its numeric columns.
+    Each worker keeps the frames it has mapped in a small local cache; entries
+    are revalidated against the shared directory so deletes from other workers
+    are honoured.
+    """
+
+    blocking_io = True
+
+    def __init__(
+        self,
+        shared_dir: str = SHARED_STORE_DIR,
+        max_bytes: int = STORE_MAX_BYTES,
+        ttl_seconds: float = STORE_TTL_SECONDS,
+        local_entries: int = 32,
+    ) -> None:
+        super().__init__()
+        self.shared_dir = shared_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.local_entries = local_entries
+        self.expirations = 0
+        self._local: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.RLock()
+        os.makedirs(shared_dir, exist_ok=True)
+
+    def _base(self, file_id: str) -> str:
+        return os.path.join(self.shared_dir, file_id)
+
+    def _disk_usage(self) -> list[tuple[float, int, str]]:
+        """(last access, size, file_id) for every stored frame, oldest first"""
+        usage = []
+        for name in os.listdir(self.shared_dir):
+            if not name.endswith(".meta"):
+                continue
+            file_id = name[:-len(".meta")]
+            base = self._base(file_id)
+            try:
+                accessed = os.path.getmtime(f"{base}.meta")
+                size = sum(
+                    os.path.getsize(f"{base}{suffix}")
+                    for suffix in (".arrow", ".pkl")
+                    if os.path.exists(f"{base}{suffix}")
+                )
+            except FileNotFoundError:
+                continue  # removed by another worker mid-scan
+            usage.append((accessed, size, file_id))
+        return sorted(usage)
+
+    def _enforce_limits(self, keep: str) -> None:
+        usage = self._disk_usage()
+        total = sum(size for _, size, _ in usage)
+        now = time.time()
+        for accessed, size, file_id in usage:
+            if file_id == keep:
+                continue
+            if self.ttl_seconds > 0 and accessed + self.ttl_seconds <= now:
+                self.expirations += 1
+            elif total > self.max_bytes:
+                self.evictions += 1
+            else:
+                continue
+            unlink_frame(self._base(file_id))
+            self._local.pop(file_id, None)
+            total -= size
+
+    def get(self, file_id: str) -> dict[str, Any] | None:
+        base = self._base(file_id)
+        with self._lock:
+            try:
+                version = os.path.getmtime(f"{base}.arrow" if os.path.exists(f"{base}.arrow") else f"{base}.pkl")
+                accessed = os.path.getmtime(f"{base}.meta")
+            except FileNotFoundError:
+                self._local.pop(file_id, None)
+                self.misses += 1
+                return None
+            if self.ttl_seconds > 0 and accessed + self.ttl_seconds <= time.time():
+                unlink_frame(base)
+                self._local.pop(file_id, None)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            cached = self._local.get(file_id)
+            if cached is not None and cached[0] == version:
+                self._local.move_to_end(file_id)
+                file_data = cached[1]
+            else:
+                df = read_frame(base)
+                file_data = read_meta(base)
+                if df is None or file_data is None:
+                    self.misses += 1
+                    return None
+                file_data['dataframe'] = df
+                self._local[file_id] = (version, file_data)
+                while len(self._local) > self.local_entries:
+                    self._local.popitem(last=False)
+            # Touch the metadata so TTL and LRU eviction see this access from any worker
+            os.utime(f"{base}.meta")
+            self.hits += 1
+            return file_data
+
+    def put(self, file_id: str, file_data: dict[str, Any]) -> None:
+        base = self._base(file_id)
+        with self._lock:
+            write_frame(base, file_data['dataframe'])
+            write_meta(base, file_data)
+            self._local.pop(file_id, None)
+            self._enforce_limits(keep=file_id)
+
+    def delete(self, file_id: str) -> bool:
+        with self._lock:
+            self._local.pop(file_id, None)
+            return unlink_frame(self._base(file_id))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            usage = self._disk_usage()
+            return {
+                "backend": "shared",
+                "shared_dir": self.shared_dir,
+                "entries": len(usage),
+                "bytes": sum(size for _, size, _ in usage),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "local_entries": len(self._local),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "pid": os.getpid(),
+            }
+
+
+_store: DataFrameStore | None = None
+
+
+def get_store() -> DataFrameStore:
+    """Lazy initialization of the configured DataFrame store"""
+    global _store
+    if _store is None:
+        if DATAFRAME_STORE in ("disk", "shared") and pa is None:
+            # Falling back would keep the shared handle registry while the data stays in one worker
+            raise RuntimeError(f"DATAFRAME_STORE={DATAFRAME_STORE} needs the pyarrow package (pip install pyarrow)")
+        if DATAFRAME_STORE == "shared":
+            _store = SharedArrowStore()
+        elif DATAFRAME_STORE == "disk":
+            _store = DiskSpillStore()
+        else:
+            _store = MemoryLRUStore()
+        if WEB_CONCURRENCY > 1 and not isinstance(_store, SharedArrowStore):
+            log.warning("Running multiple workers without DATAFRAME_STORE=shared. "
+                  "Queries routed to a worker that did not handle the upload will return 404.")
+    return _store
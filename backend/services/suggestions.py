@@ -0,0 +1,83 @@
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Any
+
+from services.cache import get_response_cache, response_cache_key
+from services.llm import SUGGESTIONS_MODEL, generate_suggestions
+
+# Finished jobs kept for polling; older ones are answered from the response cache
+MAX_FINISHED_JOBS = 256
+# Upper bound for the long-poll wait of GET /chat/suggestions/{job_id}
+MAX_WAIT_SECONDS = 30.0
+
+_jobs: OrderedDict[str, asyncio.Task] = OrderedDict()
+_job_stats = {"started": 0, "cached": 0, "joined": 0}
+
+
+def suggestions_job_id(fingerprint: str) -> str:
+    """Jobs are keyed by dataset content, so every upload of the same data shares one job and cache entry"""
+    return response_cache_key(fingerprint, "", mode="suggestions", model=SUGGESTIONS_MODEL)
+
+
+def _forget_finished() -> None:
+    finished = [job_id for job_id, task in _jobs.items() if task.done()]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        _jobs.pop(job_id, None)
+
+
+def start_suggestions_job(
+    df: Any, columns: list[str], numeric_cols: list[str], fingerprint: str
+) -> tuple[str, list[str] | None]:
+    """
+    Start generating suggestions in the background. Returns the job id and, when
+    this dataset's suggestions are already cached, the suggestions themselves.
+    """
+    job_id = suggestions_job_id(fingerprint)
+    cached = get_response_cache().get(job_id)
+    if cached is not None:
+        _job_stats["cached"] += 1
+        return job_id, json.loads(cached)
+
+    task = _jobs.get(job_id)
+    if task is not None and not (task.done() and (task.cancelled() or task.exception() is not None)):
+        _job_stats["joined"] += 1
+        return job_id, task.result() if task.done() else None
+
+    _jobs[job_id] = asyncio.create_task(generate_suggestions(df, columns, numeric_cols, cache_key=job_id))
+    _job_stats["started"] += 1
+    _forget_finished()
+    return job_id, None
+
+
+async def get_suggestions_job(job_id: str, wait: float = 0.0) -> dict[str, Any] | None:
+    """
+    Status of a suggestions job, waiting up to `wait` seconds for it to finish.
+    None when the job is unknown to this worker and not in the response cache.
+    """
+    task = _jobs.get(job_id)
+    if task is None:
+        cached = get_response_cache().get(job_id)
+        if cached is None:
+            return None
+        return {"job_id": job_id, "status": "done", "suggestions": json.loads(cached)}
+
+    if not task.done() and wait > 0:
+        try:
+            await asyncio.wait_for(asyncio.shield(task), min(wait, MAX_WAIT_SECONDS))
+        except Exception:
+            pass  # timeouts and job failures are reported through the status below
+
+    if not task.done():
+        return {"job_id": job_id, "status": "pending", "suggestions": []}
+    if task.cancelled() or task.exception() is not None:
+        return {"job_id": job_id, "status": "failed", "suggestions": []}
+    return {"job_id": job_id, "status": "done", "suggestions": task.result()}
+
+
+def suggestions_stats() -> dict[str, Any]:
+    return {
+        **_job_stats,
+        "pending": sum(1 for task in _jobs.values() if not task.done()),
+        "tracked": len(_jobs),
+    }
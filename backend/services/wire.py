@@ -0,0 +1,95 @@
+import json
+from typing import Any
+
+import pandas as pd
+
+from models.schemas import ChatRequest, ChatResponse, SheetState
+from services.sandbox import sheet_frame
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; JSON and Arrow bodies work without it
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow IPC bodies need pyarrow
+    pa = None
+
+JSON_TYPES = {"", "application/json"}
+MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+ARROW_FILE_TYPE = "application/vnd.apache.arrow.file"
+# Schema metadata key of Arrow bodies holding the other request fields as JSON
+ARROW_REQUEST_KEY = b"insightxl.request"
+
+
+class UnsupportedMediaType(Exception):
+    """Raised for a request body type the server cannot decode."""
+
+
+def _media_type(header: str) -> str:
+    return header.split(";", 1)[0].strip().lower()
+
+
+def decode_chat_request(body: bytes, content_type: str) -> ChatRequest:
+    """
+    Parse a /chat request body by content type:
+    - application/json: the ChatRequest schema
+    - application/msgpack: the same fields, msgpack-encoded (needs msgpack)
+    - application/vnd.apache.arrow.stream (or .file): the sheet as an Arrow table; the other
+      fields (message, file_id, update_format, sheet_name) are JSON in the schema metadata
+      under "insightxl.request"
+    Raises pydantic.ValidationError or ValueError for malformed bodies. Blocking; run it on the worker pool.
+    """
+    media = _media_type(content_type)
+    if media in JSON_TYPES:
+        return ChatRequest.model_validate_json(body)
+    if media in MSGPACK_TYPES:
+        if msgpack is None:
+            raise UnsupportedMediaType("msgpack bodies need the msgpack package on the server")
+        return ChatRequest.model_validate(msgpack.unpackb(body, raw=False))
+    if media in (ARROW_STREAM_TYPE, ARROW_FILE_TYPE):
+        if pa is None:
+            raise UnsupportedMediaType("Arrow bodies need pyarrow on the server")
+        reader = pa.ipc.open_stream(body) if media == ARROW_STREAM_TYPE else pa.ipc.open_file(body)
+        table = reader.read_all()
+        fields = json.loads((table.schema.metadata or {}).get(ARROW_REQUEST_KEY, b"{}"))
+        if not isinstance(fields, dict):
+            raise ValueError("insightxl.request metadata must be a JSON object")
+        sheet = SheetState(name=fields.pop("sheet_name", "Sheet1"))
+        sheet._frame = table.to_pandas()
+        request = ChatRequest.model_validate(fields)
+        request.sheet = sheet
+        return request
+    raise UnsupportedMediaType(f"Unsupported content type: {media}")
+
+
+def accepts_msgpack(accept: str) -> bool:
+    return msgpack is not None and any(_media_type(part) in MSGPACK_TYPES for part in accept.split(","))
+
+
+def encode_msgpack(response: ChatResponse) -> bytes:
+    return msgpack.packb(response.model_dump(mode="json"))
+
+
+def sheet_to_frame(sheet: SheetState) -> pd.DataFrame:
+    """DataFrame for a sheet in any of its forms: Arrow, column lists or rows. Blocking; run it on the worker pool."""
+    if sheet._frame is not None:
+        return sheet._frame
+    if sheet.columns is not None:
+        df = pd.DataFrame(dict(enumerate(sheet.columns)))
+        df.columns = [name if name else f"Column {i + 1}" for i, name in enumerate(sheet.header)]
+        return df.infer_objects()
+    return sheet_frame(sheet.rows)
+
+
+def sheet_preview(sheet: SheetState, max_rows: int) -> tuple[list[list[Any]], int]:
+    """Header plus the first `max_rows` data rows, and the total number of data rows."""
+    if sheet._frame is not None:
+        df = sheet._frame
+        return [list(map(str, df.columns)), *df.head(max_rows).astype(object).values.tolist()], len(df)
+    if sheet.columns is not None:
+        length = len(sheet.columns[0]) if sheet.columns else 0
+        return [list(sheet.header), *map(list, zip(*(col[:max_rows] for col in sheet.columns)))], length
+    return sheet.rows[:max_rows + 1], max(0, len(sheet.rows) - 1)
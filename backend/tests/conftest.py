@@ -0,0 +1,69 @@
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+BACKEND = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND))
+
+# Supabase settings are read at import, so the stub's address is fixed before any app module loads
+JWT_SECRET = "fake-jwt-secret-for-local-testing-only"
+with socket.socket() as _sock:
+    _sock.bind(("127.0.0.1", 0))
+    SUPABASE_PORT = _sock.getsockname()[1]
+os.environ.update(
+    SUPABASE_URL=f"http://127.0.0.1:{SUPABASE_PORT}", SUPABASE_KEY="anon", SUPABASE_JWT_SECRET=JWT_SECRET
+)
+
+
+@pytest.fixture
+def salaries() -> pd.DataFrame:
+    return pd.read_csv(BACKEND / "employee_salary_test.csv")
+
+
+@pytest.fixture(scope="session")
+def fake_supabase():
+    """benchmarks/fake_supabase.py served on SUPABASE_URL for the whole session"""
+    import uvicorn
+
+    from benchmarks.fake_supabase import create_app
+
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(JWT_SECRET), host="127.0.0.1", port=SUPABASE_PORT, log_level="warning"
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield os.environ["SUPABASE_URL"]
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def chat_client():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from routers import chat
+
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/chat")
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def file_id(chat_client):
+    """employee_salary_test.csv uploaded through /chat/upload, deleted afterwards"""
+    with open(BACKEND / "employee_salary_test.csv", "rb") as f:
+        response = chat_client.post("/chat/upload", files={"file": ("salaries.csv", f, "text/csv")})
+    assert response.status_code == 200, response.text
+    file_id = response.json()["file_id"]
+    yield file_id
+    chat_client.delete(f"/chat/file/{file_id}")
@@ -0,0 +1,45 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import auth
+from services.auth import RevocationList
+
+
+@pytest.fixture
+def client(fake_supabase):
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/auth")
+    with TestClient(app) as client:
+        yield client
+
+
+def _sign_up(client, email):
+    response = client.post("/auth/signup", json={"email": email, "password": "secret-pass", "name": "Ada"})
+    assert response.status_code == 200, response.text
+    return response.json()["session"]["access_token"]
+
+
+def test_signed_out_token_is_refused(client):
+    token = _sign_up(client, "ada@example.com")
+    user = client.get("/auth/user", params={"access_token": token})
+    assert user.status_code == 200
+    assert user.json()["user"]["name"] == "Ada"
+
+    assert client.post("/auth/signout", params={"access_token": token}).status_code == 200
+    assert client.get("/auth/user", params={"access_token": token}).status_code == 401
+
+
+def test_signout_requires_a_token(client):
+    assert client.post("/auth/signout").status_code == 422
+
+
+def test_revocations_are_shared_through_sqlite(tmp_path):
+    path = str(tmp_path / "revoked.sqlite")
+    # Two workers open the same file
+    first, second = RevocationList(path), RevocationList(path)
+    first.add("digest", expires_at=9e9)
+    assert "digest" in second
+    first.add("expired", expires_at=1.0)
+    assert "expired" not in second
+    assert len(second) == 1
@@ -0,0 +1,73 @@
+from models.schemas import SheetPatch
+from routers import chat
+from services import cache as cache_module
+from services.cache import ResponseCache, dataset_fingerprint, response_cache_key
+from services.patches import patched_fingerprint
+
+
+def test_rephrasings_share_a_key():
+    key = response_cache_key("fp", "What is the average salary?", "analysis", "gpt-4o")
+    assert response_cache_key("fp", "  what is the   AVERAGE salary ", "analysis", "gpt-4o") == key
+    assert response_cache_key("other", "what is the average salary", "analysis", "gpt-4o") != key
+    assert response_cache_key("fp", "what is the average salary", "chart", "gpt-4o") != key
+    assert response_cache_key("fp", "what is the average salary", "analysis", "gpt-4o-mini") != key
+    assert response_cache_key("fp", "what is the median salary", "analysis", "gpt-4o") != key
+
+
+def test_fingerprints_follow_the_data(salaries):
+    assert dataset_fingerprint(salaries.copy()) == dataset_fingerprint(salaries)
+    edited = salaries.copy()
+    edited.iloc[3, 2] = "Legal"
+    assert dataset_fingerprint(edited) != dataset_fingerprint(salaries)
+    assert dataset_fingerprint(salaries.rename(columns={"Department": "Team"})) != dataset_fingerprint(salaries)
+
+    patch = SheetPatch(base_version=0, edits=[{"op": "delete_rows", "row": 1}])
+    other = SheetPatch(base_version=0, edits=[{"op": "delete_rows", "row": 2}])
+    assert patched_fingerprint("fp", patch) != "fp"
+    assert patched_fingerprint("fp", patch) != patched_fingerprint("fp", other)
+
+
+def test_a_patch_invalidates_cached_answers(chat_client, file_id):
+    before = chat.store.get(chat.handles.get(file_id).dataset_id)["fingerprint"]
+    patch = {"base_version": 0, "edits": [{"op": "set_cells", "row": 1, "col": 2, "values": [["Legal"]]}]}
+    assert chat_client.patch(f"/chat/file/{file_id}", json=patch).status_code == 200
+    after = chat.store.get(chat.handles.get(file_id).dataset_id)["fingerprint"]
+    assert after != before
+    question = "what is the average salary"
+    assert response_cache_key(after, question, "analysis", "m") != response_cache_key(before, question, "analysis", "m")
+
+
+def test_memory_tier_is_bounded():
+    cache = ResponseCache(max_entries=2, db_path="")
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") is None and cache.get("c") == "C"
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl_seconds=60, db_path=str(tmp_path / "responses.sqlite"))
+    cache.set("k", "answer")
+    now[0] += 59
+    assert cache.get("k") == "answer"
+    now[0] += 2
+    assert cache.get("k") is None
+
+
+def test_workers_share_the_disk_tier_and_prune_it(monkeypatch, tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    first, second = ResponseCache(ttl_seconds=60, db_path=path), ResponseCache(ttl_seconds=60, db_path=path)
+    first.set("k", "answer")
+    assert second.get("k") == "answer" and second.stats()["disk_hits"] == 1
+
+    monkeypatch.setattr(cache_module, "PRUNE_EVERY_WRITES", 2)
+    now = [cache_module.time.time() + 120]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    # Every second write prunes; "k" expired a minute ago
+    first.set("fresh", "answer")
+    first.set("fresher", "answer")
+    count = first._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    assert first.pruned == 1 and count == 2
+
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from services import llm
+from services.conversations import ConversationStore, refers_back
+
+
+@pytest.fixture
+def no_model(monkeypatch):
+    monkeypatch.setattr(llm, "get_llm_gateway", lambda: None)
+
+
+def _file_info(df):
+    return {"filename": "salaries.csv", "row_count": len(df), "column_count": len(df.columns), "dtypes": {}}
+
+
+@pytest.mark.parametrize("question", [
+    "what is their average salary?",
+    "show them by department",
+    "and the median?",
+    "what about Legal?",
+    "why is that?",
+])
+def test_follow_ups(salaries, question):
+    assert refers_back(question, salaries)
+
+
+@pytest.mark.parametrize("question", [
+    "average salary by department",
+    "what is the total Annual Salary",
+    "how many employees in Sales",
+])
+def test_standalone_questions(salaries, question):
+    assert not refers_back(question, salaries)
+
+
+def test_independent_questions_are_computed_in_a_conversation(salaries, no_model):
+    conversation = ConversationStore().get("user", "file")
+
+    async def ask(question):
+        return await llm.answer_query_with_context(question, salaries, _file_info(salaries), conversation=conversation)
+
+    first = asyncio.run(ask("average salary by department"))
+    second = asyncio.run(ask("what is the total Annual Salary"))
+    assert conversation.has_history
+    assert "862,500" in second or "862500" in second
+    for answer in (first, second):
+        assert answer != llm.NOT_CONFIGURED_MESSAGE
+
+    # A real follow-up needs the model and the history, so it is not computed from the question alone
+    assert asyncio.run(ask("what is their average salary?")) == llm.NOT_CONFIGURED_MESSAGE
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.indexes import DatasetIndex
+from services.planner import filter_mask
+
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 20, 2000).astype(float)
+    values[rng.random(2000) < 0.1] = np.nan
+    return pd.DataFrame({
+        "float": values,
+        "Int64": pd.array(values, dtype="Float64").astype("Int64"),
+        "Float64": pd.array(values, dtype="Float64"),
+    })
+
+
+@pytest.mark.parametrize("column", ["float", "Int64", "Float64"])
+@pytest.mark.parametrize("op", ["==", "!=", ">", ">=", "<", "<="])
+def test_indexed_filters_match_the_scan(frame, column, op):
+    index = DatasetIndex("test")
+    for value in (-1, 0, 7, 19, 25):
+        f = [{"column": column, "op": op, "value": value}]
+        np.testing.assert_array_equal(filter_mask(frame, f, index), filter_mask(frame, f))
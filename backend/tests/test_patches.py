@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from models.schemas import SheetPatch
+from routers import chat
+from services.handles import HandleRegistry
+from services.optimize import compact_frame
+from services.patches import PatchError, apply_patch
+
+
+def _rename(base_version, name):
+    return {"base_version": base_version, "edits": [{"op": "set_cells", "row": 0, "col": 0, "values": [[name]]}]}
+
+
+def test_patches_must_name_the_current_version(chat_client, file_id):
+    first = chat_client.patch(f"/chat/file/{file_id}", json=_rename(0, "ID"))
+    assert first.status_code == 200 and first.json()["version"] == 1
+    assert first.json()["columns"][0] == "ID"
+
+    stale = chat_client.patch(f"/chat/file/{file_id}", json=_rename(0, "Employee"))
+    assert stale.status_code == 409 and stale.headers["X-Sheet-Version"] == "1"
+    assert chat_client.get(f"/chat/file/{file_id}/sheets").json()["version"] == 1
+
+    assert chat_client.patch(f"/chat/file/{file_id}", json=_rename(1, "Employee")).status_code == 200
+
+
+def test_a_version_is_claimed_by_one_worker(tmp_path):
+    path = str(tmp_path / "handles.sqlite")
+    # Two workers open the same registry and patch version 0 of one handle at the same time
+    first, second = HandleRegistry(path), HandleRegistry(path)
+    handle = first.acquire("dataset", "user", "salaries.csv")
+    assert first.advance_version(handle.file_id, 0, 1)
+    assert not second.advance_version(handle.file_id, 0, 1)
+    assert second.get(handle.file_id).version == 1
+
+
+def test_a_patch_in_flight_on_another_worker_is_a_conflict(chat_client, file_id):
+    # Another worker claimed version 1 and has not stored its data yet
+    assert chat.handles.advance_version(file_id, 0, 1)
+    response = chat_client.patch(f"/chat/file/{file_id}", json=_rename(0, "ID"))
+    assert response.status_code == 409 and response.headers["X-Sheet-Version"] == "1"
+    assert chat_client.patch(f"/chat/file/{file_id}", json=_rename(1, "ID")).status_code == 409
+
+
+def _patch(df, *edits):
+    return apply_patch(df, SheetPatch(base_version=0, edits=list(edits)))
+
+
+@pytest.fixture
+def compact(salaries):
+    df, _ = compact_frame(salaries)
+    assert df["Annual Salary"].dtype == "int32"
+    return df
+
+
+def test_large_numbers_widen_a_compact_int_column(compact):
+    column = list(compact.columns).index("Annual Salary")
+    result = _patch(compact, {"op": "set_cells", "row": 1, "col": column, "values": [["3000000000"]]})
+    salaries = result.dataframe["Annual Salary"]
+    assert salaries.dtype == "int64" and salaries.iloc[0] == 3_000_000_000
+    assert salaries.iloc[1:].tolist() == compact["Annual Salary"].iloc[1:].tolist()
+
+    inserted = _patch(compact, {"op": "insert_rows", "row": 1, "values": [["E999", "Ann Lee", "Sales", "Rep", 3_000_000_000]]})
+    assert inserted.dataframe["Annual Salary"].dtype == "int64"
+    assert inserted.dataframe["Annual Salary"].iloc[0] == 3_000_000_000
+
+
+def test_amounts_keep_the_column_type(compact):
+    column = list(compact.columns).index("Annual Salary")
+    result = _patch(compact, {"op": "set_cells", "row": 2, "col": column, "values": [["$1,200"], [5]]})
+    salaries = result.dataframe["Annual Salary"]
+    assert salaries.dtype == "int32" and salaries.iloc[1:3].tolist() == [1200, 5]
+    assert result.changed_columns == ["Annual Salary"] and not result.rows_changed
+
+
+def test_bools_are_not_numbers():
+    df = pd.DataFrame({"n": pd.array([1, 2], dtype="int64")})
+    result = _patch(df, {"op": "set_cells", "row": 1, "col": 0, "values": [[True]]})
+    assert isinstance(result.dataframe["n"].iloc[0], (bool, np.bool_))
+
+
+def test_rows_and_renames(compact):
+    result = _patch(
+        compact,
+        {"op": "delete_rows", "row": 1, "count": 2},
+        {"op": "set_cells", "row": 0, "col": 0, "values": [["ID"]]},
+    )
+    assert len(result.dataframe) == len(compact) - 2 and result.rows_changed
+    assert result.dataframe.columns[0] == "ID" and result.removed_columns == ["Employee ID"]
+    with pytest.raises(PatchError, match="past the end"):
+        _patch(compact, {"op": "set_cells", "row": len(compact) + 1, "col": 0, "values": [["x"]]})
@@ -0,0 +1,73 @@
+import pytest
+
+from services.planner import execute_plan, parse_rule_plan, validate_plan
+
+
+def _answer(df, question):
+    plan = parse_rule_plan(question, df)
+    assert plan is not None, question
+    return execute_plan(df, validate_plan(plan, df)).table
+
+
+@pytest.mark.parametrize("question", [
+    # A comparison that cannot be tied to a numeric column
+    "how many employees earn more than 90000",
+    # A condition the rules do not parse
+    "total salary for employees older than 40",
+    # Negations
+    "how many employees are not in Sales",
+    "average salary except Sales",
+    "count employees excluding Engineering",
+    "total salary for departments other than Legal",
+    # Several values of one column
+    "average salary for Sales and Engineering",
+    "how many employees in Legal or Finance",
+    # An aggregate over a ranking
+    "what is the average salary of the top 3 earners",
+    "total salary of the bottom 5",
+])
+def test_unparsed_conditions_fall_back(salaries, question):
+    assert parse_rule_plan(question, salaries) is None
+
+
+def test_count_with_comparison(salaries):
+    table = _answer(salaries, "how many employees have a salary of more than 90000")
+    assert table["Value"].iloc[0] == 5
+
+
+def test_count_with_category(salaries):
+    table = _answer(salaries, "how many employees in Sales")
+    assert table["Value"].iloc[0] == 2
+
+
+def test_listing_without_verb(salaries):
+    plan = parse_rule_plan("salaries above 80k", salaries)
+    assert plan == {"op": "filter", "filters": [{"column": "Annual Salary", "op": ">", "value": 80000.0}]}
+    assert len(_answer(salaries, "salaries above 80k")) == 6
+
+
+def test_group_by(salaries):
+    table = _answer(salaries, "which department has the highest average salary")
+    assert table.iloc[0]["Department"] in ("Engineering", "Legal")
+    assert table.iloc[0].iloc[1] == 105000
+
+
+@pytest.mark.parametrize("question", ["how many departments are there", "how many different departments"])
+def test_counting_a_category_counts_its_values(salaries, question):
+    plan = parse_rule_plan(question, salaries)
+    assert plan == {"op": "aggregate", "column": "Department", "agg": "nunique", "filters": []}
+    assert _answer(salaries, question)["Value"].iloc[0] == 8
+
+
+def test_counting_rows_by_an_identifier(salaries):
+    assert parse_rule_plan("how many employees", salaries) == {"op": "count", "filters": []}
+
+
+def test_longer_value_is_not_two_values(salaries):
+    table = _answer(salaries, "how many Sales Directors")
+    assert table["Value"].iloc[0] == 1
+
+
+def test_top_n_with_superlative_is_a_ranking(salaries):
+    plan = parse_rule_plan("top 5 highest salaries", salaries)
+    assert plan["op"] == "top_n" and plan["n"] == 5
@@ -0,0 +1,116 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from config.settings import SANDBOX_MAX_OPERATIONS
+from services import llm, sandbox
+from services.optimize import compact_frame
+from services.sandbox import OperationError, apply_operations, evaluate, parse_operations, run_operations
+
+
+@pytest.fixture
+def compact(salaries) -> pd.DataFrame:
+    df, _ = compact_frame(salaries)
+    assert df["Annual Salary"].dtype == "int32"
+    return df
+
+
+def test_formulas_on_compact_int_columns_do_not_overflow(compact):
+    expected = compact["Annual Salary"].astype("int64")
+    pd.testing.assert_series_equal(evaluate("col('Annual Salary') * 100000", compact), expected * 100000, check_names=False)
+    assert (evaluate("col('Annual Salary') ** 2", compact) > 0).all()
+    after = apply_operations(compact, parse_operations([
+        {"op": "set_column", "column": "Cents", "expr": "col('Annual Salary') * 100000"},
+    ]))
+    assert after["Cents"].tolist() == (expected * 100000).tolist()
+    assert compact["Annual Salary"].dtype == "int32"
+
+
+def test_nullable_int_columns_are_widened():
+    df = pd.DataFrame({"n": pd.array([2_000_000_000, None], dtype="Int32")})
+    result = evaluate("col('n') * 2", df)
+    assert result.dtype == "Int64" and result[0] == 4_000_000_000 and pd.isna(result[1])
+
+
+@pytest.mark.parametrize("operations, message", [
+    ([{"op": "set_column", "column": "x", "expr": "1"}] * (SANDBOX_MAX_OPERATIONS + 1), "At most"),
+    ([{"op": "exec", "code": "1"}], "Unknown operation"),
+    ([{"op": "set_column", "column": "x"}], "missing ['expr']"),
+    ([{"op": "set_column", "column": "x", "expr": "__import__('os')"}], "Unknown function"),
+    ([{"op": "set_column", "column": "x", "expr": "col('a').__class__"}], "Unsupported syntax"),
+    ([{"op": "set_column", "column": "x", "expr": "1 + " * 200 + "1"}], "longer than"),
+    ([{"op": "filter_rows", "where": " + ".join(["1"] * 120)}], "too complex"),
+])
+def test_operation_limits(operations, message):
+    with pytest.raises(OperationError, match=message.replace("[", r"\[").replace("(", r"\(")):
+        parse_operations(operations)
+
+
+def test_unknown_columns_fail_when_run(salaries):
+    with pytest.raises(OperationError, match="Unknown column"):
+        apply_operations(salaries, parse_operations([{"op": "sort", "by": "Bonus"}]))
+
+
+def test_run_operations_in_a_worker(compact):
+    operations = parse_operations([
+        {"op": "set_column", "column": "Annual Salary", "expr": "col('Annual Salary') * 100000",
+         "where": "Department == 'Sales'"},
+    ])
+    sales = compact.index[compact["Department"] == "Sales"]
+    column = list(compact.columns).index("Annual Salary")
+
+    async def run():
+        result = await run_operations(compact, operations)
+        with pytest.raises(OperationError, match="Unknown column"):
+            await run_operations(compact, parse_operations([{"op": "drop_columns", "columns": "Bonus"}]))
+        # The failed run gave its slot back
+        again = await run_operations(compact, operations)
+        return result, again
+
+    restarts = sandbox.sandbox_stats()["restarts"]
+    result, again = asyncio.run(run())
+    assert result.changed_cells == len(sales) and again.updates == result.updates
+    assert {(row, col) for row, col, _ in result.updates} == {(row + 1, column) for row in sales}  # row 0 is the header
+    assert all(value == int(compact.at[row - 1, "Annual Salary"]) * 100000 for row, _, value in result.updates)
+    assert sandbox.sandbox_stats()["restarts"] == restarts
+
+
+class _Gateway:
+    """Answers every agent call with the same operations plan"""
+
+    def __init__(self, plan):
+        self.content = json.dumps(plan)
+
+    async def complete(self, **kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))])
+
+
+def _events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_streamed_agent_runs_operations_on_an_uploaded_file(chat_client, file_id, monkeypatch):
+    gateway = _Gateway({
+        "reply": "Doubled the salaries.",
+        "operations": [{"op": "set_column", "column": "Annual Salary", "expr": "col('Annual Salary') * 2"}],
+    })
+    monkeypatch.setattr(llm, "get_llm_gateway", lambda: gateway)
+    message = {"message": "double the salaries", "file_id": file_id}
+
+    plain = chat_client.post("/chat", json=message)
+    assert plain.status_code == 200, plain.text
+    streamed = chat_client.post("/chat/stream", json=message)
+    assert streamed.status_code == 200
+    events = _events(streamed.text)
+    event, done = events[-1]
+    assert event == "done" and done["updates"] == plain.json()["updates"] and done["updates"]
+    assert "".join(data["content"] for event, data in events if event == "delta") == plain.json()["reply"]
+
+    assert chat_client.post("/chat/stream", json={**message, "file_id": "missing"}).status_code == 404
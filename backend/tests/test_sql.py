@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+from services.sql import SQLError, cursor, run_sql, validate_sql  # noqa: E402
+
+
+@pytest.fixture
+def secret(tmp_path):
+    path = tmp_path / "leak.csv"
+    path.write_text("secret,value\ntop,42\n")
+    return str(path)
+
+
+def test_cte_in_a_subquery_does_not_cover_a_file_path(salaries, secret):
+    sql = f'SELECT * FROM data, (WITH "{secret}" AS (SELECT 1) SELECT 1) s, "{secret}" f'
+    with pytest.raises(SQLError, match="only read the data table"):
+        run_sql(sql, salaries, {"row_count": len(salaries)})
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH t AS (SELECT * FROM data) SELECT count(*) FROM t",
+    "WITH a AS (SELECT 1 AS x), b AS (SELECT * FROM a) SELECT * FROM b",
+    "SELECT * FROM (WITH t AS (SELECT * FROM data) SELECT * FROM t) s",
+])
+def test_visible_ctes_are_allowed(sql):
+    assert validate_sql(sql + ";") == sql
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM other",
+    "SELECT * FROM main.data",
+    "SELECT * FROM read_csv('/etc/passwd')",
+    "SELECT getenv('HOME')",
+    "SELECT 1; SELECT 2",
+    "DELETE FROM data",
+    "WITH t AS (SELECT 1) SELECT * FROM (SELECT * FROM t) s, (SELECT * FROM u) v",
+])
+def test_rejected(sql):
+    with pytest.raises(SQLError):
+        validate_sql(sql)
+
+
+def test_files_are_unreadable_even_without_validation(secret):
+    con = cursor()
+    try:
+        with pytest.raises(Exception, match="Permission"):
+            con.execute(f"SELECT * FROM '{secret}'").fetchall()
+    finally:
+        con.close()
+
+
+def test_runs_over_every_row(salaries):
+    result = run_sql('SELECT count(*) AS n FROM data WHERE "Department" = \'Sales\'', salaries, {"row_count": 10})
+    assert result.table["n"].iloc[0] == 2
+
+
+def test_compact_int_columns_do_not_overflow():
+    df = pd.DataFrame({"Units": np.array([120000, 3], dtype="int32")})
+    result = run_sql('SELECT "Units" * 100000 AS n FROM data', df, {"row_count": 2})
+    assert result.table["n"].tolist() == [12_000_000_000, 300_000]
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from services import store as store_module  # noqa: E402
+from services.store import MemoryLRUStore, SharedArrowStore  # noqa: E402
+
+
+def test_shared_store_round_trip(tmp_path, salaries):
+    store = SharedArrowStore(shared_dir=str(tmp_path))
+
+    async def run():
+        await store.put_async("a", {"dataframe": salaries, "row_count": len(salaries)})
+        file_data = await store.get_async("a")
+        deleted = await store.delete_async("a")
+        return file_data, deleted, await store.get_async("a")
+
+    file_data, deleted, gone = asyncio.run(run())
+    pd.testing.assert_frame_equal(file_data["dataframe"], salaries)
+    assert file_data["row_count"] == len(salaries) and deleted and gone is None
+
+
+def test_file_reads_do_not_block_the_event_loop(tmp_path, salaries, monkeypatch):
+    store = SharedArrowStore(shared_dir=str(tmp_path))
+    store.put("a", {"dataframe": salaries})
+    read_frame = store_module.read_frame
+
+    def slow_read(base):
+        time.sleep(0.3)
+        return read_frame(base)
+
+    monkeypatch.setattr(store_module, "read_frame", slow_read)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        file_data = await store.get_async("a")
+        ticker.cancel()
+        return file_data, ticks
+
+    file_data, ticks = asyncio.run(run())
+    assert file_data is not None and ticks >= 10
+
+
+def test_memory_store_stays_inline(salaries):
+    store = MemoryLRUStore()
+    asyncio.run(store.put_async("a", {"dataframe": salaries}))
+    assert not store.blocking_io and store.get("a")["dataframe"] is salaries
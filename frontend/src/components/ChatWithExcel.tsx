@@ -93,6 +93,7 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
     try {
       const formData = new FormData();
       formData.append("file", file);
+      if (user) formData.append("user_id", user.id);
 
       const response = await fetch("http://localhost:8000/chat/upload", {
         method: "POST",
@@ -106,6 +107,9 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
       const data = await response.json();
       setFileData(data);
       setSuggestions(data.suggestions || []);
+      if (data.suggestions_status === "pending" && data.suggestions_job_id) {
+        void pollSuggestions(data.suggestions_job_id);
+      }
 
       // Add welcome message
       setMessages([
@@ -125,6 +129,26 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
     }
   };
 
+  // Suggestions are generated after the upload returns; long-poll until they are ready
+  const pollSuggestions = async (jobId: string) => {
+    for (let attempt = 0; attempt < 5; attempt++) {
+      try {
+        const response = await fetch(
+          `http://localhost:8000/chat/suggestions/${jobId}?wait=10`
+        );
+        if (!response.ok) return;
+        const job = await response.json();
+        if (job.status !== "pending") {
+          if (job.suggestions?.length) setSuggestions(job.suggestions);
+          return;
+        }
+      } catch (error) {
+        console.error("Error fetching suggestions:", error);
+        return;
+      }
+    }
+  };
+
   const handleSuggestionClick = async (suggestion: string) => {
     await sendMessage(suggestion);
   };
@@ -153,7 +177,8 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
     setIsLoading(true);
 
     try {
-      const response = await fetch("http://localhost:8000/chat/query", {
+      // Stream the answer as server-sent events so report text appears as it is generated
+      const response = await fetch("http://localhost:8000/chat/query/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -162,22 +187,79 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
           message: content,
           file_id: fileData?.file_id,
           user_id: user.id,
+          // The server keeps earlier questions about this file; a fresh chat starts over
+          new_conversation: !messages.some((message) => message.role === "user"),
         }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error("Failed to get response");
       }
 
-      const data = await response.json();
+      const assistantId = (Date.now() + 1).toString();
+      let fullText = "";
+      let started = false;
+
+      const showAssistant = (text: string, chartData?: ChartData) => {
+        if (!started) {
+          started = true;
+          setIsLoading(false);
+          setMessages((prev) => [
+            ...prev,
+            { id: assistantId, role: "assistant", content: text, chartData, timestamp: new Date() },
+          ]);
+          return;
+        }
+        setMessages((prev) =>
+          prev.map((m) => (m.id === assistantId ? { ...m, content: text, chartData } : m))
+        );
+      };
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let streamError: string | null = null;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line: "event: <name>\ndata: <json>"
+        let boundary = buffer.indexOf("\n\n");
+        while (boundary !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          boundary = buffer.indexOf("\n\n");
+
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = raw.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+
+          if (event === "delta") {
+            fullText += payload.content;
+            // Chart JSON is only rendered once complete
+            if (!fullText.trimStart().startsWith("{")) {
+              showAssistant(fullText);
+            }
+          } else if (event === "error") {
+            streamError = payload.message || "An error occurred.";
+          }
+        }
+      }
+
+      if (streamError && !fullText) {
+        throw new Error(streamError);
+      }
 
       // Check if the response is chart data (JSON)
       let chartData: ChartData | undefined;
-      let textContent = data.response;
+      let textContent = fullText;
 
       try {
         // Try to parse as JSON chart data
-        const parsed = JSON.parse(data.response);
+        const parsed = JSON.parse(fullText);
         if (parsed.type === "chart" && parsed.chartType && parsed.data) {
           chartData = parsed as ChartData;
           textContent = ""; // No text content for chart responses
@@ -189,15 +271,7 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
         chartData = undefined;
       }
 
-      const assistantMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        role: "assistant",
-        content: textContent,
-        chartData,
-        timestamp: new Date(),
-      };
-
-      setMessages((prev) => [...prev, assistantMessage]);
+      showAssistant(textContent, chartData);
     } catch (error) {
       console.error("Error sending message:", error);
       const errorMessage: Message = {
@@ -239,6 +313,7 @@ const ChatWithExcel: React.FC<ChatWithExcelProps> = ({ user, onShowLogin }) => {
     try {
       const formData = new FormData();
       formData.append("file", file);
+      if (user) formData.append("user_id", user.id);
 
       const response = await fetch("http://localhost:8000/chat/upload", {
         method: "POST",